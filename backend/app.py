@@ -1,12 +1,37 @@
 import os
-from flask import Flask, render_template
-from flask_socketio import SocketIO
+import time
+import click
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from flask import Flask, render_template, request, send_from_directory
+from flask_socketio import SocketIO, join_room, rooms
 
 from backend.config import Config
-from backend.models import db
+from backend.models import db, Ambulance, EmergencyCall
 from backend.routes.callcenter import callcenter_bp
 from backend.routes.location import location_bp
-from backend.routes.ambulance import ambulance_bp
+from backend.routes.ambulance import ambulance_bp, ambulance_service
+from backend.routes.changes import changes_bp
+from backend.routes.tiles import tiles_bp
+from backend.routes.connection import connection_bp
+from backend.routes.metrics import metrics_bp
+from backend.routes.debug import debug_bp
+from backend.services import init_services
+from backend.services.archive_service import archive_periodically
+from backend.services.location_history_service import flush_tracks_at_exit, flush_tracks_periodically
+from backend.utils.spatial_index import ensure_spatial_index
+from backend.utils.change_feed import ensure_change_feed
+from backend.utils.sqlite_pragmas import apply_sqlite_pragmas
+from backend.utils.schema import ensure_columns
+from backend.utils.waitlist import WAITLIST_INDEX_SQL
+from backend.utils.assignment_notifier import ASSIGNMENT_VERSIONS_SQL
+from backend.utils.position_coalescer import PositionCoalescer
+from backend.utils.telemetry import TelemetryError, decode_frame, telemetry_watermarks, valid_points
+from backend.utils.tiles import TileStore, TilePackError
+from backend.utils.rooms import DISPATCHERS_ROOM, ambulance_room, call_room, rooms_for
+from backend.utils.metrics import SOCKETIO_CLIENTS, install_metrics, record_query
+from backend.utils.tracing import dispatch_traces
+from backend.utils.profiling import install_request_profiler, request_profiler
 
 def create_app(config_class=Config):
     # Initialize Flask app
@@ -15,50 +40,269 @@ def create_app(config_class=Config):
                 template_folder='../frontend')
     app.config.from_object(config_class)
     
+    # Archived calls go to their own bind so they can be moved to a separate file
+    app.config['SQLALCHEMY_BINDS'] = {
+        'archive': app.config.get('ARCHIVE_DATABASE_URI') or app.config['SQLALCHEMY_DATABASE_URI'],
+        **(app.config.get('SQLALCHEMY_BINDS') or {})
+    }
+    
+    # Workers behind one port are not sticky: without a queue and websocket-only
+    # transport, clients and emits end up split between processes
+    if app.config.get('SOCKETIO_WORKERS', 1) > 1 and not (
+            app.config.get('SOCKETIO_MESSAGE_QUEUE') and app.config.get('SOCKETIO_TRANSPORTS') == ['websocket']):
+        raise RuntimeError("SOCKETIO_WORKERS > 1 needs SOCKETIO_MESSAGE_QUEUE and SOCKETIO_TRANSPORTS=websocket")
+    
     # Initialize extensions
     db.init_app(app)
-    socketio = SocketIO(app, cors_allowed_origins="*")
+    # Services are built on first use, so the app boots without Twilio credentials
+    init_services(app)
+    socketio = SocketIO(
+        app,
+        cors_allowed_origins="*",
+        message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+        transports=app.config.get('SOCKETIO_TRANSPORTS'),
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE')
+    )
+    
+    # Ambulance positions reach dashboards in batched, rate-limited frames
+    app.extensions['position_coalescer'] = None
+    if app.config.get('POSITION_BROADCAST_INTERVAL', 0) > 0:
+        app.extensions['position_coalescer'] = PositionCoalescer(
+            socketio,
+            interval=app.config['POSITION_BROADCAST_INTERVAL'],
+            max_in_flight=app.config.get('POSITION_BROADCAST_MAX_IN_FLIGHT', 2),
+            ack_timeout=app.config.get('POSITION_BROADCAST_ACK_TIMEOUT', 10),
+            # Dashboards may sit on other workers; broadcast through the queue
+            room=DISPATCHERS_ROOM if app.config.get('SOCKETIO_MESSAGE_QUEUE') else None
+        )
+    coalescer = app.extensions['position_coalescer']
+    
+    # Offline map tiles for the district, memory-mapped from an MBTiles file
+    app.extensions['tile_store'] = None
+    if app.config.get('TILE_PACK_PATH'):
+        try:
+            app.extensions['tile_store'] = TileStore(
+                app.config['TILE_PACK_PATH'],
+                mmap_size=app.config.get('TILE_PACK_MMAP_SIZE', 256 * 1024 * 1024)
+            )
+        except TilePackError as e:
+            print(f"Region tiles disabled: {e}")
     
     # Register blueprints
     app.register_blueprint(callcenter_bp)
     app.register_blueprint(location_bp)
     app.register_blueprint(ambulance_bp)
+    app.register_blueprint(changes_bp)
+    app.register_blueprint(tiles_bp)
+    app.register_blueprint(connection_bp)
+    
+    # Request, database, dependency and Socket.IO metrics for /metrics
+    metrics_enabled = app.config.get('METRICS_ENABLED', False)
+    if metrics_enabled:
+        install_metrics(app, socketio, coalescer, waitlist=lambda: app.extensions['services'].reads.waitlist_stats())
+        app.register_blueprint(metrics_bp)
+    
+    # Token-guarded debug endpoints: the slowest recent dispatches, request
+    # profiles, stack samples and memory snapshots
+    dispatch_traces.resize(app.config.get('DISPATCH_TRACE_BUFFER_SIZE', 500))
+    app.register_blueprint(debug_bp)
+    if app.config.get('DEBUG_TOKEN'):
+        request_profiler.configure(app.config.get('PROFILE_SAMPLE_EVERY', 0))
+        install_request_profiler(app)
     
     # Create database tables
     with app.app_context():
+        # WAL and a busy timeout so several worker processes can share the file
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', lambda dbapi_connection, _: apply_sqlite_pragmas(
+                    dbapi_connection, synchronous=app.config.get('SQLITE_SYNCHRONOUS', 'FULL')
+                ))
+            
+            if metrics_enabled:
+                event.listen(engine, 'before_cursor_execute', start_query_timer)
+                event.listen(engine, 'after_cursor_execute', stop_query_timer)
+        
         db.create_all()
+        
+        # Columns added since a database was first created
+        added_columns = (
+            (None, 'emergency_calls', {
+                'location_accuracy': 'FLOAT', 'severity': 'INTEGER DEFAULT 2',
+                'queued_time': 'DATETIME', 'queue_key': 'FLOAT'
+            }),
+            ('archive', 'emergency_calls_archive', {'location_accuracy': 'FLOAT', 'severity': 'INTEGER'})
+        )
+        for bind_key, table, columns in added_columns:
+            engine = db.engines[bind_key]
+            if engine.dialect.name == 'sqlite':
+                raw_connection = engine.raw_connection()
+                try:
+                    ensure_columns(raw_connection, table, columns)
+                finally:
+                    raw_connection.close()
+        
+        # R*Tree index over ambulance and call positions, maintained by triggers,
+        # and a change log giving dashboards a version to sync from
+        app.extensions['spatial_index'] = False
+        app.extensions['change_feed'] = False
+        app.extensions['assignment_versions'] = None
+        if db.engine.dialect.name == 'sqlite':
+            raw_connection = db.engine.raw_connection()
+            try:
+                app.extensions['spatial_index'] = ensure_spatial_index(raw_connection)
+                app.extensions['change_feed'] = ensure_change_feed(
+                    raw_connection, app.config.get('CHANGE_FEED_RETENTION', 10000)
+                )
+                raw_connection.execute(WAITLIST_INDEX_SQL)
+                raw_connection.execute(ASSIGNMENT_VERSIONS_SQL)
+                raw_connection.commit()
+            finally:
+                raw_connection.close()
+            # Long-poll versions shared by every worker process; waiters poll
+            # them only when other processes can change them
+            app.extensions['assignment_versions'] = db.engine.raw_connection
+            app.extensions['assignment_recheck'] = bool(app.config.get('SOCKETIO_MESSAGE_QUEUE'))
+    
+    # Move closed calls out of the hot table in the background
+    if app.config.get('CALL_ARCHIVE_INTERVAL_SECONDS', 0) > 0:
+        socketio.start_background_task(archive_periodically, app, socketio)
+    
+    # Write track buffers of units that stopped pinging, and whatever is left at exit
+    if app.config.get('LOCATION_HISTORY_FLUSH_INTERVAL_SECONDS', 0) > 0:
+        socketio.start_background_task(flush_tracks_periodically, app, socketio)
+        flush_tracks_at_exit(app)
+    
+    @app.cli.command('archive-calls')
+    @click.option('--hours', type=int, default=None, help='Archive calls closed more than this many hours ago')
+    @click.option('--batch-size', type=int, default=None, help='Calls moved per transaction')
+    def archive_calls_command(hours, batch_size):
+        """Archive completed and cancelled calls"""
+        archived = app.extensions['services'].archive.archive_closed_calls(older_than_hours=hours, batch_size=batch_size)
+        click.echo(f"Archived {archived} calls")
     
     # Home route
     @app.route('/')
     def home():
         return render_template('callcenter/index.html')
     
+    # Served from the root so its scope covers the whole app
+    @app.route('/service-worker.js')
+    def service_worker():
+        response = send_from_directory(os.path.join(os.path.dirname(__file__), 'services'), 'service-worker.js',
+                                       mimetype='application/javascript', max_age=0)
+        response.headers['Service-Worker-Allowed'] = '/'
+        return response
+    
     # Socket.IO events for real-time updates
     @socketio.on('connect')
     def handle_connect():
         print('Client connected')
+        SOCKETIO_CLIENTS.inc()
     
     @socketio.on('disconnect')
     def handle_disconnect():
         print('Client disconnected')
+        SOCKETIO_CLIENTS.dec()
+        if coalescer:
+            coalescer.unsubscribe(request.sid)
+    
+    # Clients join rooms so events only reach the dashboards, tablet and caller involved
+    @socketio.on('join_dispatch')
+    def handle_join_dispatch(data=None):
+        join_room(DISPATCHERS_ROOM)
+        if coalescer:
+            coalescer.subscribe(request.sid)
+            coalescer.start()
+    
+    @socketio.on('join_ambulance')
+    def handle_join_ambulance(data):
+        ambulance = Ambulance.query.filter_by(ambulance_id=(data or {}).get('ambulance_id')).first()
+        if not ambulance:
+            return {"success": False, "error": "Invalid ambulance ID"}
+        join_room(ambulance_room(ambulance.id))
+        return {"success": True}
+    
+    @socketio.on('join_call')
+    def handle_join_call(data):
+        # The share link id is the caller's credential; the numeric call id is guessable
+        call = EmergencyCall.query.filter_by(location_link_id=(data or {}).get('location_link_id')).first()
+        if not call:
+            return {"success": False, "error": "Invalid location link"}
+        join_room(call_room(call.id))
+        return {"success": True}
     
     @socketio.on('location_shared')
     def handle_location_shared(data):
-        # Broadcast to call center dashboard
-        socketio.emit('location_update', data, broadcast=True)
+        # Relay to call center dashboards and the caller's own page
+        socketio.emit('location_update', data, to=rooms_for(call_id=data.get('emergency_call_id')))
     
     @socketio.on('ambulance_assigned')
     def handle_ambulance_assigned(data):
-        # Broadcast to call center dashboard and ambulance app
-        socketio.emit('assignment_update', data, broadcast=True)
+        # Relay to call center dashboards, the assigned ambulance and the caller
+        socketio.emit('assignment_update', data, to=rooms_for(
+            call_id=data.get('emergency_call_id'),
+            ambulance_pk=data.get('ambulance_id')
+        ))
     
     @socketio.on('ambulance_location_update')
     def handle_ambulance_update(data):
-        # Broadcast ambulance location updates to call center
-        socketio.emit('ambulance_update', data, broadcast=True)
+        # Only dispatchers track the fleet; other tablets don't need each other's pings
+        if coalescer:
+            coalescer.submit(data)
+        else:
+            socketio.emit('ambulance_update', {'positions': [data]}, to=DISPATCHERS_ROOM)
+    
+    @socketio.on('telemetry')
+    def handle_telemetry(frame):
+        # Binary GPS frames from tablets; acked so the tablet can drop its buffer
+        try:
+            ambulance_pk, points = decode_frame(frame)
+        except (TelemetryError, TypeError, OverflowError) as e:
+            return {"success": False, "error": str(e)}
+        
+        # Only the tablet that joined this ambulance's room may report for it
+        if ambulance_room(ambulance_pk) not in rooms():
+            return {"success": False, "error": "Join the ambulance room first"}
+        
+        last_seq = points[-1]['seq'] if points else None
+        valid = valid_points(points)
+        rejected = len(points) - len(valid)
+        points = telemetry_watermarks.filter(ambulance_pk, valid)
+        try:
+            ambulance = ambulance_service.ingest_telemetry(ambulance_pk, points) if points else None
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.error(f"Error storing telemetry for ambulance {ambulance_pk}: {e}")
+            return {"success": False, "error": "Could not store telemetry"}
+        
+        if ambulance:
+            telemetry_watermarks.commit(ambulance_pk, points)
+            latest = points[-1]
+            position = {
+                'ambulance_id': ambulance.ambulance_id,
+                'latitude': ambulance.latitude,
+                'longitude': ambulance.longitude,
+                'speed': latest['speed'],
+                'heading': latest['heading']
+            }
+            if coalescer:
+                coalescer.submit(position)
+            else:
+                socketio.emit('ambulance_update', {'positions': [position]}, to=DISPATCHERS_ROOM)
+        
+        return {"success": True, "accepted": len(points), "rejected": rejected, "last_seq": last_seq}
     
     return app, socketio
 
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('query_start', None)
+    if start is not None:
+        record_query(time.perf_counter() - start)
+
 if __name__ == '__main__':
     app, socketio = create_app()
     socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=True)
\ No newline at end of file
@@ -11,19 +11,104 @@ class Config:
     # Database settings
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite:///emergency_response.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # FULL syncs every commit; NORMAL is faster but an OS crash can lose the last commits
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'FULL')
+    
+    # Archive of closed calls; defaults to a table in the main database.
+    # Point it at a separate SQLite file to keep cold history out of the hot file.
+    ARCHIVE_DATABASE_URI = os.getenv('ARCHIVE_DATABASE_URI')
+    CALL_ARCHIVE_AFTER_HOURS = int(os.getenv('CALL_ARCHIVE_AFTER_HOURS', '24'))
+    CALL_ARCHIVE_BATCH_SIZE = int(os.getenv('CALL_ARCHIVE_BATCH_SIZE', '500'))
+    CALL_ARCHIVE_INTERVAL_SECONDS = int(os.getenv('CALL_ARCHIVE_INTERVAL_SECONDS', '3600'))  # 0 disables the background job
     
     # Twilio settings
     TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', 'your_actual_sid_here')
     TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', 'your_actual_token_here')
     TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER', 'your_actual_phone_here')
+    TWILIO_API_URL = os.getenv('TWILIO_API_URL')  # e.g. a local fake for load tests; unset uses api.twilio.com
     
     # OpenStreetMap settings
     NOMINATIM_USER_AGENT = os.getenv('NOMINATIM_USER_AGENT', 'emergency_response_system')
+    NOMINATIM_URL = os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org')  # empty disables reverse geocoding
+    NOMINATIM_TIMEOUT_SECONDS = float(os.getenv('NOMINATIM_TIMEOUT_SECONDS', '5'))
+    
+    # Region tile pack (MBTiles) served to ambulance apps for offline maps; unset disables it
+    TILE_PACK_PATH = os.getenv('TILE_PACK_PATH')
+    TILE_PACK_MMAP_SIZE = int(os.getenv('TILE_PACK_MMAP_SIZE', str(256 * 1024 * 1024)))
+    TILE_CACHE_MAX_AGE = int(os.getenv('TILE_CACHE_MAX_AGE', '604800'))  # 7 days; ETags revalidate after that
+    TILE_KEYS_MAX = int(os.getenv('TILE_KEYS_MAX', '100000'))  # keys listed per request
+    
+    # Offline route bundles built at dispatch time. Set ROUTING_URL to your own
+    # OSRM-compatible router; unset ships the straight line. The router sees
+    # the caller's position, so do not point it at a public demo server.
+    ROUTING_URL = os.getenv('ROUTING_URL', '')
+    ROUTING_TIMEOUT_SECONDS = float(os.getenv('ROUTING_TIMEOUT_SECONDS', '3'))  # dispatch waits at most this long
+    ROUTE_BUNDLE_TOLERANCE_M = float(os.getenv('ROUTE_BUNDLE_TOLERANCE_M', '5'))
+    ROUTE_BUNDLE_BUFFER_M = int(os.getenv('ROUTE_BUNDLE_BUFFER_M', '300'))  # corridor half-width for tile keys
+    ROUTE_BUNDLE_CHECKPOINT_M = int(os.getenv('ROUTE_BUNDLE_CHECKPOINT_M', '1000'))
+    ROUTE_BUNDLE_MAX_TILES = int(os.getenv('ROUTE_BUNDLE_MAX_TILES', '4000'))
     
     # Application settings
     BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
     EMERGENCY_NUMBER = os.getenv('EMERGENCY_NUMBER', '108')
     
+    # Location history settings
+    LOCATION_HISTORY_BATCH_SIZE = int(os.getenv('LOCATION_HISTORY_BATCH_SIZE', '30'))  # points per flushed segment
+    LOCATION_HISTORY_FLUSH_SECONDS = int(os.getenv('LOCATION_HISTORY_FLUSH_SECONDS', '300'))
+    LOCATION_HISTORY_FLUSH_INTERVAL_SECONDS = int(os.getenv('LOCATION_HISTORY_FLUSH_INTERVAL_SECONDS', '60'))  # 0 disables the background job
+    TRACK_PLAYBACK_MAX_POINTS = int(os.getenv('TRACK_PLAYBACK_MAX_POINTS', '500'))  # default and upper bound of max_points
+    TRACK_PLAYBACK_MAX_WINDOW_HOURS = int(os.getenv('TRACK_PLAYBACK_MAX_WINDOW_HOURS', '168'))  # 7 days
+    
+    # Dashboard change feed settings
+    CHANGE_FEED_RETENTION = int(os.getenv('CHANGE_FEED_RETENTION', '10000'))  # change log rows kept
+    CHANGE_FEED_MAX_CHANGES = int(os.getenv('CHANGE_FEED_MAX_CHANGES', '5000'))  # above this a full reload is sent
+    
+    # Socket.IO scale-out. With a message queue (e.g. redis://localhost:6379/0)
+    # emits from any worker process reach clients connected to every other one.
+    # Several workers behind one port need either sticky sessions at the load
+    # balancer or websocket-only transport (SOCKETIO_TRANSPORTS=websocket).
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_TRANSPORTS = [t.strip() for t in os.getenv('SOCKETIO_TRANSPORTS', '').split(',') if t.strip()] or None
+    # Worker processes sharing one port (gunicorn -w); more than 1 needs both of the above
+    SOCKETIO_WORKERS = int(os.getenv('SOCKETIO_WORKERS', '1'))
+    SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE')  # unset picks eventlet when installed; 'threading' skips loading it, e.g. in tests
+    
+    # Ambulance position broadcast settings; positions are coalesced per unit and
+    # flushed to dashboards once per interval (0 emits every ping immediately)
+    POSITION_BROADCAST_INTERVAL = float(os.getenv('POSITION_BROADCAST_INTERVAL', '1.0'))
+    POSITION_BROADCAST_MAX_IN_FLIGHT = int(os.getenv('POSITION_BROADCAST_MAX_IN_FLIGHT', '2'))  # unacked frames per dashboard
+    POSITION_BROADCAST_ACK_TIMEOUT = float(os.getenv('POSITION_BROADCAST_ACK_TIMEOUT', '10'))
+    
+    # Batched location updates from gateways and offline replay
+    LOCATION_BATCH_MAX_ITEMS = int(os.getenv('LOCATION_BATCH_MAX_ITEMS', '1000'))
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+    
+    # Caller connectivity probes from the share page
+    CONNECTIVITY_PROBE_MAX_BYTES = int(os.getenv('CONNECTIVITY_PROBE_MAX_BYTES', '262144'))
+    CONNECTIVITY_SMS_FALLBACK = os.getenv('CONNECTIVITY_SMS_FALLBACK', 'True') == 'True'  # SMS protocol on very slow links
+    
+    # Progressive caller location: a more accurate fix this far from the
+    # stored one re-runs dispatch; closer ones only update the assigned unit
+    LOCATION_REDISPATCH_DISTANCE_M = float(os.getenv('LOCATION_REDISPATCH_DISTANCE_M', '500'))
+    
+    # Calls that find no free unit wait on the dispatch waitlist; a freed unit
+    # goes to the nearest of the first few, ranked by wait time and severity
+    DISPATCH_WAITLIST_CANDIDATES = int(os.getenv('DISPATCH_WAITLIST_CANDIDATES', '5'))
+    DISPATCH_WAITLIST_SEVERITY_STEP_SECONDS = int(os.getenv('DISPATCH_WAITLIST_SEVERITY_STEP_SECONDS', '300'))  # wait one severity level is worth
+    
+    # Prometheus metrics at /metrics: request, database, dependency and Socket.IO stats
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+    
+    # Debug endpoints under /api/debug answer only requests with this token
+    # in the X-Debug-Token header; unset disables them
+    DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+    DISPATCH_TRACE_BUFFER_SIZE = int(os.getenv('DISPATCH_TRACE_BUFFER_SIZE', '500'))  # recent dispatches kept for /api/debug/dispatches
+    PROFILE_SAMPLE_EVERY = int(os.getenv('PROFILE_SAMPLE_EVERY', '0'))  # cProfile one in N requests from startup; 0 waits for /api/debug/profile/requests
+    STACK_SAMPLER_MAX_SECONDS = int(os.getenv('STACK_SAMPLER_MAX_SECONDS', '300'))
+    
+    # Assignment long-poll settings for ambulance apps without a live socket
+    ASSIGNMENT_WAIT_MAX_SECONDS = int(os.getenv('ASSIGNMENT_WAIT_MAX_SECONDS', '25'))  # below typical proxy idle timeouts
+    
     # SMS Protocol Settings
     SMS_ENABLED = os.getenv('SMS_ENABLED', 'True') == 'True'
     SMS_LOCATION_CODE_PREFIX = os.getenv('SMS_LOCATION_CODE_PREFIX', 'ERS-LOC')
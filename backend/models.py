@@ -3,6 +3,9 @@ from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+# Calls in these states are finished and eligible for archival
+CLOSED_CALL_STATUSES = ('completed', 'cancelled')
+
 class Ambulance(db.Model):
     __tablename__ = 'ambulances'
     
@@ -15,28 +18,35 @@ class Ambulance(db.Model):
     is_available = db.Column(db.Boolean, default=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Fields of the API representation, in output order; also the columns
+    # list endpoints may select with ?fields= (backend.utils.serialization)
+    SERIALIZED_FIELDS = (
+        'id', 'ambulance_id', 'driver_name', 'driver_phone',
+        'latitude', 'longitude', 'is_available', 'last_updated'
+    )
+    # Unit summary embedded in call lists (?embed=ambulance)
+    SUMMARY_FIELDS = ('id', 'ambulance_id', 'driver_name', 'driver_phone', 'latitude', 'longitude', 'last_updated')
+    
     def __repr__(self):
         return f"Ambulance('{self.ambulance_id}', '{self.driver_name}')"
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'ambulance_id': self.ambulance_id,
-            'driver_name': self.driver_name,
-            'driver_phone': self.driver_phone,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
-            'is_available': self.is_available,
-            'last_updated': self.last_updated.isoformat()
-        }
+        data = {}
+        for column in self.SERIALIZED_FIELDS:
+            value = getattr(self, column)
+            data[column] = value.isoformat() if isinstance(value, datetime) else value
+        return data
 
 class EmergencyCall(db.Model):
     __tablename__ = 'emergency_calls'
+    # Ids are never reused once the archiver deletes the newest calls; the
+    # archive keeps the original ids
+    __table_args__ = {'sqlite_autoincrement': True}
     
     id = db.Column(db.Integer, primary_key=True)
     caller_phone = db.Column(db.String(15), nullable=False)
     call_time = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default='initiated')  # initiated, location_shared, assigned, completed
+    status = db.Column(db.String(20), default='initiated', index=True)  # initiated, location_shared, assigned, completed, cancelled
     location_link_id = db.Column(db.String(50), unique=True)
     
     # SMS protocol fields
@@ -48,40 +58,147 @@ class EmergencyCall(db.Model):
     # Location details (will be updated once shared)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    location_accuracy = db.Column(db.Float, nullable=True)  # metres; the best fix received is kept
     address = db.Column(db.Text, nullable=True)
     
     # Assignment details
     assigned_ambulance_id = db.Column(db.Integer, db.ForeignKey('ambulances.id'), nullable=True)
     assigned_time = db.Column(db.DateTime, nullable=True)
+    severity = db.Column(db.Integer, default=2)  # 1 critical, 2 urgent, 3 routine
+    
+    # Dispatch waitlist (backend.utils.waitlist): set while no unit is free.
+    # The partial index on queue_key is created by WAITLIST_INDEX_SQL.
+    queued_time = db.Column(db.DateTime, nullable=True)
+    queue_key = db.Column(db.Float, nullable=True)
     
     # Timestamps
     location_shared_time = db.Column(db.DateTime, nullable=True)
     pickup_time = db.Column(db.DateTime, nullable=True)
     completion_time = db.Column(db.DateTime, nullable=True)
     
-    # Relationship
+    # Relationship; lazy, so views that show the unit load it with
+    # joinedload(EmergencyCall.assigned_ambulance) in the same query
     assigned_ambulance = db.relationship('Ambulance', backref='emergency_calls')
     
+    # Fields of the API representation, in output order; also the columns
+    # list endpoints may select with ?fields= (backend.utils.serialization)
+    SERIALIZED_FIELDS = (
+        'id', 'caller_phone', 'call_time', 'status', 'location_link_id',
+        'sms_location_code', 'sms_code_expiry', 'connectivity_status', 'location_method',
+        'latitude', 'longitude', 'location_accuracy', 'address', 'assigned_ambulance_id', 'assigned_time',
+        'severity', 'queued_time', 'location_shared_time', 'pickup_time', 'completion_time'
+    )
+    
     def __repr__(self):
         return f"EmergencyCall('{self.id}', '{self.caller_phone}', '{self.status}')"
     
+    def to_dict(self, embed_ambulance=False):
+        data = {}
+        for column in self.SERIALIZED_FIELDS:
+            value = getattr(self, column)
+            data[column] = value.isoformat() if isinstance(value, datetime) else value
+        if embed_ambulance and self.assigned_ambulance:
+            data['assigned_ambulance'] = self.assigned_ambulance.to_dict()
+        return data
+
+class EmergencyCallArchive(db.Model):
+    __tablename__ = 'emergency_calls_archive'
+    __bind_key__ = 'archive'
+    
+    # Mirrors EmergencyCall; rows keep their original ids. No foreign key to
+    # ambulances because the archive may live in a separate database file.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    caller_phone = db.Column(db.String(15), nullable=False, index=True)
+    call_time = db.Column(db.DateTime, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    location_link_id = db.Column(db.String(50))
+    sms_location_code = db.Column(db.String(20), nullable=True)
+    sms_code_expiry = db.Column(db.DateTime, nullable=True)
+    connectivity_status = db.Column(db.String(20))
+    location_method = db.Column(db.String(20), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    location_accuracy = db.Column(db.Float, nullable=True)
+    address = db.Column(db.Text, nullable=True)
+    assigned_ambulance_id = db.Column(db.Integer, nullable=True)
+    assigned_time = db.Column(db.DateTime, nullable=True)
+    severity = db.Column(db.Integer, nullable=True)
+    location_shared_time = db.Column(db.DateTime, nullable=True)
+    pickup_time = db.Column(db.DateTime, nullable=True)
+    completion_time = db.Column(db.DateTime, nullable=True)
+    archived_time = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Columns copied verbatim from emergency_calls
+    COPIED_COLUMNS = (
+        'id', 'caller_phone', 'call_time', 'status', 'location_link_id',
+        'sms_location_code', 'sms_code_expiry', 'connectivity_status', 'location_method',
+        'latitude', 'longitude', 'location_accuracy', 'address', 'assigned_ambulance_id', 'assigned_time',
+        'severity', 'location_shared_time', 'pickup_time', 'completion_time'
+    )
+    
+    @classmethod
+    def from_call(cls, call):
+        return cls(**{column: getattr(call, column) for column in cls.COPIED_COLUMNS})
+    
+    def __repr__(self):
+        return f"EmergencyCallArchive('{self.id}', '{self.caller_phone}', '{self.status}')"
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'caller_phone': self.caller_phone,
-            'call_time': self.call_time.isoformat(),
-            'status': self.status,
-            'location_link_id': self.location_link_id,
-            'sms_location_code': self.sms_location_code,
-            'sms_code_expiry': self.sms_code_expiry.isoformat() if self.sms_code_expiry else None,
-            'connectivity_status': self.connectivity_status,
-            'location_method': self.location_method,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
-            'address': self.address,
-            'assigned_ambulance_id': self.assigned_ambulance_id,
-            'assigned_time': self.assigned_time.isoformat() if self.assigned_time else None,
-            'location_shared_time': self.location_shared_time.isoformat() if self.location_shared_time else None,
-            'pickup_time': self.pickup_time.isoformat() if self.pickup_time else None,
-            'completion_time': self.completion_time.isoformat() if self.completion_time else None
-        }
\ No newline at end of file
+        data = {}
+        for column in self.COPIED_COLUMNS + ('archived_time',):
+            value = getattr(self, column)
+            data[column] = value.isoformat() if isinstance(value, datetime) else value
+        return data
+
+
+class AmbulanceTrackSegment(db.Model):
+    __tablename__ = 'ambulance_track_segments'
+    __table_args__ = (
+        db.Index('ix_track_segments_ambulance_day', 'ambulance_id', 'day', 'start_time'),
+    )
+    
+    # Append-only: each row holds one flushed batch of GPS points for one
+    # ambulance on one UTC day, delta-encoded by backend.utils.track_encoding
+    id = db.Column(db.Integer, primary_key=True)
+    ambulance_id = db.Column(db.Integer, db.ForeignKey('ambulances.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    point_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        return f"AmbulanceTrackSegment('{self.ambulance_id}', '{self.day}', {self.point_count} points)"
+
+
+class IdempotencyRecord(db.Model):
+    __tablename__ = 'idempotency_keys'
+    
+    # Response of a completed write, returned again when a client retries with
+    # the same Idempotency-Key instead of applying the request twice
+    key = db.Column(db.String(128), primary_key=True)
+    endpoint = db.Column(db.String(100), primary_key=True)
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"IdempotencyRecord('{self.endpoint}', '{self.key}')"
+
+
+class RouteBundle(db.Model):
+    __tablename__ = 'route_bundles'
+    
+    # Offline navigation data built at dispatch time (backend.utils.route_bundle);
+    # a re-dispatch adds a new row and the latest one for the call is served
+    id = db.Column(db.Integer, primary_key=True)
+    emergency_call_id = db.Column(db.Integer, db.ForeignKey('emergency_calls.id'), nullable=False, index=True)
+    ambulance_id = db.Column(db.Integer, db.ForeignKey('ambulances.id'), nullable=False)
+    source = db.Column(db.String(20), nullable=False)
+    distance_m = db.Column(db.Integer)
+    duration_s = db.Column(db.Integer)
+    data = db.Column(db.Text, nullable=False)
+    created_time = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"RouteBundle('{self.emergency_call_id}', '{self.source}')"
@@ -9,12 +9,22 @@ from flask import Blueprint
 from .callcenter import callcenter_bp
 from .location import location_bp
 from .ambulance import ambulance_bp
+from .changes import changes_bp
+from .tiles import tiles_bp
+from .connection import connection_bp
+from .metrics import metrics_bp
+from .debug import debug_bp
 
 # List of all blueprints to be registered with the Flask app
 all_blueprints = [
     callcenter_bp,
     location_bp,
-    ambulance_bp
+    ambulance_bp,
+    changes_bp,
+    tiles_bp,
+    connection_bp,
+    metrics_bp,
+    debug_bp
 ]
 
 def register_all_blueprints(app):
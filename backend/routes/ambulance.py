@@ -1,9 +1,22 @@
-from flask import Blueprint, request, jsonify, render_template
+import json
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, render_template, Response, current_app as app
 from backend.models import db, Ambulance, EmergencyCall
-from backend.services.ambulance_service import AmbulanceService
+from sqlalchemy.exc import IntegrityError
+from backend.services import service_proxy
+from backend.services.idempotency_service import MAX_KEY_LENGTH
+from backend.utils.distance import haversine_distance
+from backend.utils.assignment_notifier import assignment_notifier
+from backend.utils.caller_location import parse_location_fix
+from backend.utils.location_batch import APPLIED, STALE
+from backend.utils.rooms import DISPATCHERS_ROOM
+from backend.utils.tiles import parse_coverage_report
+from backend.utils.serialization import json_response, parse_fields, rows_to_dicts
 
 ambulance_bp = Blueprint('ambulance', __name__, url_prefix='/api/ambulance')
-ambulance_service = AmbulanceService()
+ambulance_service = service_proxy('ambulance')
+idempotency_service = service_proxy('idempotency')
+reads = service_proxy('reads')
 
 @ambulance_bp.route('/app')
 def ambulance_app():
@@ -47,8 +60,124 @@ def update_location():
     if not success:
         return jsonify({"success": False, "error": "Failed to update location"}), 400
     
+    # Queue the position for the next batched dashboard frame
+    coalescer = app.extensions.get('position_coalescer')
+    if coalescer:
+        coalescer.submit({
+            'ambulance_id': data['ambulance_id'],
+            'latitude': data['latitude'],
+            'longitude': data['longitude']
+        })
+    
     return jsonify({"success": True})
 
+@ambulance_bp.route('/update-locations', methods=['POST'])
+def update_locations():
+    """
+    API endpoint for batched location updates from fleet gateways and offline replay.
+    Accepts a JSON array (or {"items": [...]}) of {ambulance_id, lat, lon, ts, seq}
+    and applies it in one transaction with a result per item. Send an
+    Idempotency-Key header to make retries safe: a repeated key returns the
+    stored response without applying the batch again.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    
+    if not isinstance(items, list):
+        return jsonify({"success": False, "error": "Expected a list of location updates"}), 400
+    
+    max_items = app.config.get('LOCATION_BATCH_MAX_ITEMS', 1000)
+    if len(items) > max_items:
+        return jsonify({"success": False, "error": f"At most {max_items} updates per request"}), 413
+    
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+        return jsonify({"success": False, "error": "Invalid Idempotency-Key"}), 400
+    
+    if key:
+        stored = idempotency_service.get_response(key, 'update-locations')
+        if stored:
+            body, status_code = stored
+            return jsonify(body), status_code, {'Idempotent-Replay': 'true'}
+    
+    results, updated, track_points = ambulance_service.update_locations_batch(items)
+    body = {
+        "success": True,
+        "applied": sum(1 for result in results if result['status'] == APPLIED),
+        "stale": sum(1 for result in results if result['status'] == STALE),
+        "rejected": sum(1 for result in results if result['status'] not in (APPLIED, STALE)),
+        "results": results
+    }
+    
+    if key:
+        idempotency_service.save_response(key, 'update-locations', body)
+        idempotency_service.prune()
+    
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The same key was committed by a concurrent retry; answer with its result
+        db.session.rollback()
+        stored = idempotency_service.get_response(key, 'update-locations') if key else None
+        if not stored:
+            raise
+        body, status_code = stored
+        return jsonify(body), status_code, {'Idempotent-Replay': 'true'}
+    
+    # The trail, once the positions are committed
+    ambulance_service.location_history.record_positions(track_points)
+    
+    coalescer = app.extensions.get('position_coalescer')
+    if coalescer:
+        for ambulance in updated:
+            coalescer.submit({
+                'ambulance_id': ambulance.ambulance_id,
+                'latitude': ambulance.latitude,
+                'longitude': ambulance.longitude
+            })
+    
+    return jsonify(body)
+
+@ambulance_bp.route('/tile-coverage', methods=['POST'])
+def report_tile_coverage():
+    """
+    API endpoint for the ambulance app's service worker to report how much of
+    its assignment's route corridor is cached for offline use. The report is
+    relayed to dispatchers as a `tile_coverage` event.
+    """
+    data = request.get_json(silent=True) or {}
+    
+    ambulance = Ambulance.query.filter_by(ambulance_id=data.get('ambulance_id')).first()
+    if not ambulance:
+        return jsonify({"success": False, "error": "Invalid ambulance ID"}), 404
+    
+    try:
+        report = parse_coverage_report(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    report.update({
+        'ambulance_id': ambulance.id,
+        'ambulance_code': ambulance.ambulance_id,
+        'emergency_call_id': data.get('emergency_call_id'),
+        'reported_at': datetime.utcnow().isoformat()
+    })
+    
+    socketio = app.extensions.get('socketio')
+    if socketio:
+        socketio.emit('tile_coverage', report, to=DISPATCHERS_ROOM)
+    
+    return jsonify({"success": True, "coverage": report['coverage']})
+
+@ambulance_bp.route('/broadcast-stats', methods=['GET'])
+def broadcast_stats():
+    """API endpoint for position broadcast counters (received, coalesced, dropped, sent)"""
+    coalescer = app.extensions.get('position_coalescer')
+    if not coalescer:
+        return jsonify({"success": False, "error": "Position coalescing is disabled"}), 404
+    
+    return jsonify({"success": True, "stats": coalescer.stats()})
+
 @ambulance_bp.route('/get-assignment/<ambulance_id>', methods=['GET'])
 def get_assignment(ambulance_id):
     """API endpoint for ambulance driver to get their active assignment"""
@@ -73,9 +202,51 @@ def get_assignment(ambulance_id):
     return jsonify({
         "success": True,
         "has_assignment": True,
-        "emergency_call": emergency_call.to_dict()
+        "emergency_call": emergency_call.to_dict(),
+        "route_bundle": ambulance_service.route_service.get_bundle(emergency_call.id)
     })
 
+@ambulance_bp.route('/wait-assignment/<ambulance_id>', methods=['GET'])
+def wait_assignment(ambulance_id):
+    """
+    Long-poll fallback for ambulance apps without a live socket.
+    Holds the request until the assignment of this ambulance changes from the
+    `since` version or `timeout` seconds pass, then returns the current
+    assignment and version to pass as `since` next time.
+    """
+    ambulance = Ambulance.query.filter_by(ambulance_id=ambulance_id).first()
+    
+    if not ambulance:
+        return jsonify({"success": False, "error": "Invalid ambulance ID"}), 404
+    
+    ambulance_pk = ambulance.id
+    since = request.args.get('since', type=int)
+    timeout = min(
+        request.args.get('timeout', app.config['ASSIGNMENT_WAIT_MAX_SECONDS'], type=float),
+        app.config['ASSIGNMENT_WAIT_MAX_SECONDS']
+    )
+    
+    # Release the pooled connection while the request sleeps
+    db.session.remove()
+    
+    if since is None:
+        version, changed = assignment_notifier.version(ambulance_pk), True
+    else:
+        version, changed = assignment_notifier.wait(ambulance_pk, since, max(0, timeout))
+    
+    response = {"success": True, "version": version, "changed": changed}
+    if changed:
+        emergency_call = EmergencyCall.query.filter_by(
+            assigned_ambulance_id=ambulance_pk,
+            status='assigned'
+        ).first()
+        response["has_assignment"] = emergency_call is not None
+        if emergency_call:
+            response["emergency_call"] = emergency_call.to_dict()
+            response["route_bundle"] = ambulance_service.route_service.get_bundle(emergency_call.id)
+    
+    return jsonify(response)
+
 @ambulance_bp.route('/mark-arrived', methods=['POST'])
 def mark_arrived():
     """API endpoint for ambulance driver to mark arrival at the emergency location"""
@@ -118,6 +289,11 @@ def register_ambulance():
     if not data or not all(field in data for field in required_fields):
         return jsonify({"success": False, "error": "Missing required fields"}), 400
     
+    try:
+        position = parse_location_fix({'latitude': data['latitude'], 'longitude': data['longitude']})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     # Check if ambulance_id already exists
     existing = Ambulance.query.filter_by(ambulance_id=data['ambulance_id']).first()
     if existing:
@@ -128,25 +304,134 @@ def register_ambulance():
         ambulance_id=data['ambulance_id'],
         driver_name=data['driver_name'],
         driver_phone=data['driver_phone'],
-        latitude=data['latitude'],
-        longitude=data['longitude'],
+        latitude=position['latitude'],
+        longitude=position['longitude'],
         is_available=True
     )
     
     db.session.add(new_ambulance)
     db.session.commit()
     
+    # A new unit is offered to the calls waiting for one
+    dispatch = ambulance_service.dispatch_waitlist(new_ambulance)
+    
     return jsonify({
         "success": True,
-        "ambulance": new_ambulance.to_dict()
+        "ambulance": new_ambulance.to_dict(),
+        "assigned_call_id": dispatch["emergency_call_id"] if dispatch else None
     })
 
 @ambulance_bp.route('/all', methods=['GET'])
 def get_all_ambulances():
-    """API endpoint to get all registered ambulances"""
-    ambulances = Ambulance.query.all()
+    """API endpoint to get all registered ambulances (?fields= for a subset)"""
+    try:
+        fields = parse_fields(request.args.get('fields'), Ambulance.SERIALIZED_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     
-    return jsonify({
+    return json_response({
         "success": True,
-        "ambulances": [ambulance.to_dict() for ambulance in ambulances]
-    })
\ No newline at end of file
+        "ambulances": rows_to_dicts(fields, reads.ambulances(fields))
+    })
+
+@ambulance_bp.route('/nearby', methods=['GET'])
+def get_nearby_ambulances():
+    """API endpoint to get ambulances within radius_km of a point, nearest first (?fields= for a subset)"""
+    try:
+        fields = parse_fields(request.args.get('fields'), Ambulance.SERIALIZED_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', 5.0, type=float)
+    available_only = request.args.get('available_only', 'true').lower() != 'false'
+    
+    if latitude is None or longitude is None or not 0 < radius_km <= 500:
+        return jsonify({"success": False, "error": "lat, lon and a valid radius_km are required"}), 400
+    
+    # The position is needed for the exact distance even when not returned
+    selected = fields + tuple(name for name in ('latitude', 'longitude') if name not in fields)
+    candidates = ambulance_service.get_ambulances_in_radius(
+        latitude, longitude, radius_km, available_only, fields=selected
+    )
+    
+    nearby = []
+    for row in candidates:
+        distance = haversine_distance(latitude, longitude, row.latitude, row.longitude)
+        if distance <= radius_km:
+            nearby.append((distance, row))
+    nearby.sort(key=lambda item: item[0])
+    
+    return json_response({
+        "success": True,
+        "ambulances": [
+            dict(zip(fields, row), distance_km=round(distance, 3))
+            for distance, row in nearby
+        ]
+    })
+
+def _parse_iso_datetime(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+@ambulance_bp.route('/track/<ambulance_id>', methods=['GET'])
+def get_ambulance_track(ambulance_id):
+    """
+    API endpoint to play back an ambulance's recorded track.
+    Query parameters: start and end (ISO 8601, default the last hour) and
+    max_points (at most TRACK_PLAYBACK_MAX_POINTS, the default). Points are
+    streamed as [timestamp_ms, latitude, longitude].
+    """
+    ambulance = Ambulance.query.filter_by(ambulance_id=ambulance_id).first()
+    
+    if not ambulance:
+        return jsonify({"success": False, "error": "Invalid ambulance ID"}), 404
+    
+    try:
+        end = _parse_iso_datetime(request.args.get('end')) or datetime.utcnow()
+        start = _parse_iso_datetime(request.args.get('start')) or end - timedelta(hours=1)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid start or end time"}), 400
+    
+    # Larger values would turn off downsampling of a long window
+    limit = app.config.get('TRACK_PLAYBACK_MAX_POINTS', 500)
+    try:
+        max_points = int(request.args.get('max_points', limit))
+    except ValueError:
+        max_points = 0
+    if max_points <= 0:
+        return jsonify({"success": False, "error": "max_points must be a positive integer"}), 400
+    max_points = min(max_points, limit)
+    
+    max_window = timedelta(hours=app.config.get('TRACK_PLAYBACK_MAX_WINDOW_HOURS', 168))
+    if start >= end or end - start > max_window:
+        return jsonify({"success": False, "error": "Invalid playback window"}), 400
+    
+    track = ambulance_service.location_history.playback(ambulance.id, start, end, max_points)
+    
+    def generate():
+        header = {
+            "success": True,
+            "ambulance_id": ambulance.ambulance_id,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "raw_point_count": track["raw_point_count"],
+            "downsampled": track["downsampled"],
+            "tolerance_m": track["tolerance_m"]
+        }
+        yield json.dumps(header)[:-1] + ', "points": ['
+        
+        points = track["points"]
+        for i in range(0, len(points), 500):
+            chunk = json.dumps(points[i:i + 500], separators=(',', ':'))[1:-1]
+            yield (',' if i else '') + chunk
+        
+        yield ']}'
+    
+    return Response(generate(), mimetype='application/json')
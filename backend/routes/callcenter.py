@@ -1,79 +1,139 @@
 from datetime import datetime
-from flask import Blueprint, request, jsonify, current_app as app
-from backend.models import db, EmergencyCall
-from backend.services.location_service import LocationService
-from backend.services.sms_service import SMSService
-from backend.services.ambulance_service import AmbulanceService
+from flask import Blueprint, request, jsonify
+from sqlalchemy.orm import joinedload
+from backend.models import db, Ambulance, EmergencyCall
+from backend.services import service_proxy
+from backend.utils.serialization import json_response, parse_fields, rows_to_dicts, rows_to_embedded_dicts
+from backend.utils.waitlist import parse_severity
 
 callcenter_bp = Blueprint('callcenter', __name__, url_prefix='/api/callcenter')
-location_service = LocationService()
-sms_service = SMSService()
-ambulance_service = AmbulanceService()
+location_service = service_proxy('location')
+sms_service = service_proxy('sms')
+ambulance_service = service_proxy('ambulance')
+sms_location_service = service_proxy('sms_location')
+archive_service = service_proxy('archive')
+reads = service_proxy('reads')
 
-@callcenter_bp.route('/initiate-call', methods=['POST'])
-def initiate_call():
-    """API endpoint for call center to initiate emergency response process"""
-    data = request.get_json()
-    
-    if not data or 'caller_phone' not in data:
-        return jsonify({"success": False, "error": "Caller phone number is required"}), 400
-    
-    # Generate location sharing link ID
-    location_link_id = location_service.generate_location_link_id()
-    
-    # Create emergency call record
-    emergency_call = EmergencyCall(
-        caller_phone=data['caller_phone'],
-        location_link_id=location_link_id,
-        status='initiated'
-    )
-    
-    db.session.add(emergency_call)
-    db.session.commit()
+@callcenter_bp.route('/active-calls', methods=['GET'])
+def get_active_calls():
+    """
+    API endpoint to get all active emergency calls for the dashboard.
+    ?fields= picks a subset; ?embed=ambulance nests a summary of the assigned
+    unit under assigned_ambulance, read in the same query.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'), EmergencyCall.SERIALIZED_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    embed = request.args.get('embed')
+    if embed not in (None, '', 'ambulance'):
+        return jsonify({"success": False, "error": f"Unknown embed: {embed}"}), 400
+    
+    # Closed calls are archived out of this table, so this stays a small scan
+    if embed:
+        return json_response({
+            "success": True,
+            "calls": rows_to_embedded_dicts(
+                fields, 'assigned_ambulance', Ambulance.SUMMARY_FIELDS,
+                reads.active_calls_with_units(fields, Ambulance.SUMMARY_FIELDS)
+            )
+        })
     
-    # Generate location sharing URL
-    location_share_url = location_service.get_location_share_url(location_link_id)
+    return json_response({
+        "success": True,
+        "calls": rows_to_dicts(fields, reads.active_calls(fields))
+    })
+
+@callcenter_bp.route('/calls-in-viewport', methods=['GET'])
+def get_calls_in_viewport():
+    """API endpoint to get active calls inside a map viewport (?fields= for a subset)"""
+    try:
+        fields = parse_fields(request.args.get('fields'), EmergencyCall.SERIALIZED_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    box = {
+        'min_lat': request.args.get('min_lat', type=float),
+        'max_lat': request.args.get('max_lat', type=float),
+        'min_lon': request.args.get('min_lon', type=float),
+        'max_lon': request.args.get('max_lon', type=float)
+    }
+    
+    if any(value is None for value in box.values()):
+        return jsonify({"success": False, "error": "min_lat, max_lat, min_lon and max_lon are required"}), 400
+    
+    return json_response({
+        "success": True,
+        "calls": rows_to_dicts(fields, reads.active_calls_in_box(box, fields))
+    })
+
+@callcenter_bp.route('/call/<int:call_id>', methods=['GET'])
+def get_call_details(call_id):
+    """API endpoint to get details of a specific emergency call, with its assigned ambulance"""
+    call = db.session.get(EmergencyCall, call_id, options=[joinedload(EmergencyCall.assigned_ambulance)])
     
-    # Send SMS with location sharing link to the caller
-    sms_result = sms_service.send_location_share_link(
-        data['caller_phone'], 
-        location_share_url
-    )
+    if not call:
+        return jsonify({"success": False, "error": "Call not found"}), 404
     
     return jsonify({
         "success": True,
-        "emergency_call_id": emergency_call.id,
-        "location_link_id": location_link_id,
-        "location_share_url": location_share_url,
-        "sms_sent": sms_result["success"]
+        "call": call.to_dict(embed_ambulance=True)
     })
 
-@callcenter_bp.route('/active-calls', methods=['GET'])
-def get_active_calls():
-    """API endpoint to get all active emergency calls for the dashboard"""
-    # Get all calls that are not completed
-    active_calls = EmergencyCall.query.filter(
-        EmergencyCall.status != 'completed'
-    ).order_by(EmergencyCall.call_time.desc()).all()
+@callcenter_bp.route('/history', methods=['GET'])
+def get_call_history():
+    """API endpoint to search archived emergency calls"""
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid since or until time"}), 400
+    
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    offset = request.args.get('offset', 0, type=int)
+    
+    calls = archive_service.search_history(
+        caller_phone=request.args.get('caller_phone'),
+        status=request.args.get('status'),
+        since=since,
+        until=until,
+        limit=limit,
+        offset=offset
+    )
     
     return jsonify({
         "success": True,
-        "calls": [call.to_dict() for call in active_calls]
+        "calls": [call.to_dict() for call in calls],
+        "limit": limit,
+        "offset": offset
     })
 
-@callcenter_bp.route('/call/<int:call_id>', methods=['GET'])
-def get_call_details(call_id):
-    """API endpoint to get details of a specific emergency call"""
-    call = EmergencyCall.query.get(call_id)
+@callcenter_bp.route('/history/<int:call_id>', methods=['GET'])
+def get_archived_call(call_id):
+    """API endpoint to get an archived emergency call"""
+    call = archive_service.get_archived_call(call_id)
     
     if not call:
-        return jsonify({"success": False, "error": "Call not found"}), 404
+        return jsonify({"success": False, "error": "Call not found in archive"}), 404
     
     return jsonify({
         "success": True,
         "call": call.to_dict()
     })
 
+@callcenter_bp.route('/archive', methods=['POST'])
+def archive_calls():
+    """API endpoint to archive closed calls immediately"""
+    data = request.get_json(silent=True) or {}
+    
+    archived = archive_service.archive_closed_calls(
+        older_than_hours=data.get('older_than_hours'),
+        batch_size=data.get('batch_size')
+    )
+    
+    return jsonify({"success": True, "archived": archived})
+
 @callcenter_bp.route('/assign-ambulance/<int:call_id>', methods=['POST'])
 def assign_ambulance(call_id):
     """API endpoint to manually assign the nearest ambulance to an emergency"""
@@ -94,7 +154,7 @@ def complete_emergency(call_id):
     
     return jsonify({"success": True})
 
-@callcenter_bp.route('/api/callcenter/initiate-call', methods=['POST'])
+@callcenter_bp.route('/initiate-call', methods=['POST'])
 def initiate_call():
     """API endpoint for call center to initiate emergency response process"""
     data = request.get_json()
@@ -102,6 +162,11 @@ def initiate_call():
     if not data or 'caller_phone' not in data:
         return jsonify({"success": False, "error": "Caller phone number is required"}), 400
     
+    try:
+        severity = parse_severity(data.get('severity'))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     # Check connectivity status if provided
     connectivity_status = data.get('connectivity_status', 'unknown')
     
@@ -113,6 +178,7 @@ def initiate_call():
         caller_phone=data['caller_phone'],
         location_link_id=location_link_id,
         connectivity_status=connectivity_status,
+        severity=severity,
         status='initiated'
     )
     
@@ -136,9 +202,6 @@ def initiate_call():
     
     # If the caller has no internet or SMS failed, initiate SMS protocol
     if connectivity_status == 'offline' or not sms_success:
-        from backend.services.sms_location_service import SMSLocationService
-        sms_location_service = SMSLocationService()
-        
         sms_protocol_initiated = sms_location_service.initiate_sms_location_protocol(emergency_call)
     
     return jsonify({
@@ -151,8 +214,8 @@ def initiate_call():
         "connectivity_status": connectivity_status
     })
 
-# Add a new endpoint to manually initiate SMS protocol for an existing call
-@callcenter_bp.route('/api/callcenter/initiate-sms-protocol/<int:call_id>', methods=['POST'])
+# Manually initiate SMS protocol for an existing call
+@callcenter_bp.route('/initiate-sms-protocol/<int:call_id>', methods=['POST'])
 def initiate_sms_protocol(call_id):
     """Manually initiate SMS-based location protocol for an existing call"""
     emergency_call = EmergencyCall.query.get(call_id)
@@ -160,9 +223,6 @@ def initiate_sms_protocol(call_id):
     if not emergency_call:
         return jsonify({"success": False, "error": "Emergency call not found"}), 404
     
-    from backend.services.sms_location_service import SMSLocationService
-    sms_location_service = SMSLocationService()
-    
     success = sms_location_service.initiate_sms_location_protocol(emergency_call)
     
     if success:
@@ -0,0 +1,59 @@
+from flask import Blueprint, request, current_app as app
+from backend.models import db, Ambulance, EmergencyCall, CLOSED_CALL_STATUSES
+from backend.services import service_proxy
+from backend.utils.change_feed import CALL, AMBULANCE, read_changes
+from backend.utils.serialization import json_response, rows_to_dicts
+
+changes_bp = Blueprint('changes', __name__, url_prefix='/api')
+reads = service_proxy('reads')
+
+@changes_bp.route('/changes', methods=['GET'])
+def get_changes():
+    """
+    API endpoint for incremental dashboard sync.
+    Returns active calls and ambulances changed after the `since` sequence
+    number, plus ids to drop. With reset=true the client must replace its
+    state with the full snapshot returned.
+    """
+    since = request.args.get('since', 0, type=int)
+    
+    if not app.extensions.get('change_feed'):
+        changes = {'seq': 0, 'reset': True}
+    else:
+        changes = read_changes(
+            db.session.connection().connection,
+            since,
+            app.config.get('CHANGE_FEED_MAX_CHANGES', 5000)
+        )
+    
+    call_fields = EmergencyCall.SERIALIZED_FIELDS
+    ambulance_fields = Ambulance.SERIALIZED_FIELDS
+    if changes['reset']:
+        calls = reads.active_calls(call_fields)
+        ambulances = reads.ambulances(ambulance_fields)
+        removed_calls = []
+        removed_ambulances = []
+    else:
+        calls = []
+        removed_calls = list(changes['deleted'][CALL])
+        if changes['changed'][CALL]:
+            for call in reads.calls_by_ids(changes['changed'][CALL], call_fields):
+                if call.status in CLOSED_CALL_STATUSES:
+                    removed_calls.append(call.id)
+                else:
+                    calls.append(call)
+        
+        ambulances = []
+        removed_ambulances = list(changes['deleted'][AMBULANCE])
+        if changes['changed'][AMBULANCE]:
+            ambulances = reads.ambulances_by_ids(changes['changed'][AMBULANCE], ambulance_fields)
+    
+    return json_response({
+        "success": True,
+        "seq": changes['seq'],
+        "reset": changes['reset'],
+        "calls": rows_to_dicts(call_fields, calls),
+        "ambulances": rows_to_dicts(ambulance_fields, ambulances),
+        "removed_calls": removed_calls,
+        "removed_ambulances": removed_ambulances
+    })
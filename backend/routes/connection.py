@@ -0,0 +1,74 @@
+from flask import Blueprint, request, jsonify, Response, current_app as app
+from backend.models import db, EmergencyCall
+from backend.services import get_service
+from backend.utils.connectivity import VERY_LOW_BANDWIDTH, parse_connectivity_report, probe_payload
+from backend.utils.rooms import rooms_for
+
+connection_bp = Blueprint('connection', __name__, url_prefix='/api/connection')
+
+def uncached(response):
+    # A cached answer would measure the browser, not the link
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@connection_bp.route('/ping', methods=['GET', 'HEAD'])
+def ping():
+    """API endpoint for latency checks: an empty response, no database access"""
+    return uncached(Response(status=204))
+
+@connection_bp.route('/probe', methods=['GET'])
+def probe():
+    """
+    API endpoint for throughput checks: `bytes` bytes of incompressible data
+    (capped at CONNECTIVITY_PROBE_MAX_BYTES) for the client to time.
+    """
+    size = request.args.get('bytes', 16384, type=int)
+    payload = probe_payload(size, app.config.get('CONNECTIVITY_PROBE_MAX_BYTES', 262144))
+    return uncached(Response(payload, mimetype='application/octet-stream'))
+
+@connection_bp.route('/report', methods=['POST'])
+def report():
+    """
+    API endpoint for the share page's measurements. Updates the call's
+    connectivity_status and, for a very slow link before any location was
+    shared, moves the caller to the SMS location protocol.
+    """
+    data = request.get_json()
+    
+    if not data or 'location_link_id' not in data:
+        return jsonify({"success": False, "error": "Missing required data"}), 400
+    
+    try:
+        measurement = parse_connectivity_report(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    emergency_call = EmergencyCall.query.filter_by(location_link_id=data['location_link_id']).first()
+    if not emergency_call:
+        return jsonify({"success": False, "error": "Invalid location link"}), 404
+    
+    status = measurement['connectivity_status']
+    emergency_call.connectivity_status = status
+    db.session.commit()
+    
+    # Switch early rather than wait for the web flow to time out
+    sms_protocol_initiated = False
+    use_sms = status == VERY_LOW_BANDWIDTH and emergency_call.latitude is None
+    if (use_sms and not emergency_call.sms_location_code
+            and app.config.get('SMS_ENABLED') and app.config.get('CONNECTIVITY_SMS_FALLBACK', True)):
+        sms_protocol_initiated = get_service('sms_location').initiate_sms_location_protocol(emergency_call)
+    
+    socketio = app.extensions.get('socketio')
+    if socketio:
+        socketio.emit('connectivity_update', {
+            'emergency_call_id': emergency_call.id,
+            **measurement,
+            'connectivity_status': emergency_call.connectivity_status
+        }, to=rooms_for(call_id=emergency_call.id))
+    
+    return jsonify({
+        "success": True,
+        **measurement,
+        "use_sms": use_sms,
+        "sms_protocol_initiated": sms_protocol_initiated
+    })
@@ -0,0 +1,143 @@
+from flask import Blueprint, request, jsonify, abort, current_app as app
+from backend.utils.debug_access import debug_access_allowed
+from backend.utils.tracing import dispatch_traces
+from backend.utils.profiling import (
+    PROFILE_SORT_KEYS,
+    ProfilingError,
+    memory_snapshots,
+    parse_sample_every,
+    parse_sampler_window,
+    request_profiler,
+    stack_sampler
+)
+
+debug_bp = Blueprint('debug', __name__, url_prefix='/api/debug')
+
+@debug_bp.before_request
+def require_debug_token():
+    # Hide the endpoints entirely from anyone without the token
+    if not debug_access_allowed(app.config.get('DEBUG_TOKEN'), request.headers):
+        abort(404)
+
+@debug_bp.route('/dispatches', methods=['GET'])
+def get_dispatch_traces():
+    """API endpoint listing recent dispatches with their stage timings"""
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    order = request.args.get('order', 'slowest')
+    
+    if order not in ('slowest', 'recent'):
+        return jsonify({"success": False, "error": "order must be slowest or recent"}), 400
+    
+    traces = dispatch_traces.slowest(limit) if order == 'slowest' else dispatch_traces.recent(limit)
+    
+    return jsonify({
+        "success": True,
+        "buffered": len(dispatch_traces),
+        "dispatches": traces
+    })
+
+@debug_bp.route('/profile/requests', methods=['GET'])
+def get_request_profile():
+    """API endpoint with the merged cProfile stats of sampled requests"""
+    limit = min(request.args.get('limit', 30, type=int), 500)
+    sort = request.args.get('sort', 'cumulative')
+    
+    if sort not in PROFILE_SORT_KEYS:
+        return jsonify({"success": False, "error": "sort must be cumulative, tottime or calls"}), 400
+    
+    return jsonify({"success": True, **request_profiler.stats(limit, sort)})
+
+@debug_bp.route('/profile/requests', methods=['POST'])
+def configure_request_profile():
+    """API endpoint to profile one in sample_every requests (0 stops); clears the stats"""
+    try:
+        sample_every = parse_sample_every(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    request_profiler.configure(sample_every)
+    return jsonify({"success": True, "sample_every": sample_every})
+
+@debug_bp.route('/profile/sampler', methods=['GET'])
+def get_stack_samples():
+    """API endpoint with the stack samples of the current or last window"""
+    limit = min(request.args.get('limit', 30, type=int), 500)
+    return jsonify({"success": True, **stack_sampler.results(limit)})
+
+@debug_bp.route('/profile/sampler', methods=['POST'])
+def start_stack_sampler():
+    """API endpoint to sample every thread's stack for duration_s seconds"""
+    try:
+        duration, interval = parse_sampler_window(
+            request.get_json(silent=True) or {},
+            app.config.get('STACK_SAMPLER_MAX_SECONDS', 300)
+        )
+        stack_sampler.start(duration, interval)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ProfilingError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    
+    return jsonify({"success": True, **stack_sampler.results(0)}), 202
+
+@debug_bp.route('/profile/sampler/stop', methods=['POST'])
+def stop_stack_sampler():
+    """API endpoint to end the sampling window early and return its samples"""
+    stack_sampler.stop()
+    limit = min(request.args.get('limit', 30, type=int), 500)
+    return jsonify({"success": True, **stack_sampler.results(limit)})
+
+@debug_bp.route('/memory/snapshots', methods=['GET'])
+def list_memory_snapshots():
+    """API endpoint listing the kept memory snapshots"""
+    return jsonify({"success": True, "snapshots": memory_snapshots.list()})
+
+@debug_bp.route('/memory/snapshots', methods=['POST'])
+def take_memory_snapshot():
+    """API endpoint to snapshot allocations; the first one starts tracemalloc"""
+    frames = (request.get_json(silent=True) or {}).get('frames', 1)
+    
+    if not isinstance(frames, int) or not 1 <= frames <= 25:
+        return jsonify({"success": False, "error": "frames must be between 1 and 25"}), 400
+    
+    snapshot_id = memory_snapshots.take(frames)
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    return jsonify({"success": True, **memory_snapshots.summary(snapshot_id, limit)})
+
+@debug_bp.route('/memory/snapshots/<int:snapshot_id>', methods=['GET'])
+def get_memory_snapshot(snapshot_id):
+    """API endpoint with the largest allocation sites and object types of a snapshot"""
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    group_by = request.args.get('group_by', 'lineno')
+    
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({"success": False, "error": "group_by must be lineno, filename or traceback"}), 400
+    
+    try:
+        return jsonify({"success": True, **memory_snapshots.summary(snapshot_id, limit, group_by)})
+    except ProfilingError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+
+@debug_bp.route('/memory/diff', methods=['GET'])
+def diff_memory_snapshots():
+    """API endpoint with what grew between two snapshots (?from=&to=)"""
+    from_id = request.args.get('from', type=int)
+    to_id = request.args.get('to', type=int)
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    group_by = request.args.get('group_by', 'lineno')
+    
+    if from_id is None or to_id is None:
+        return jsonify({"success": False, "error": "from and to snapshot ids are required"}), 400
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({"success": False, "error": "group_by must be lineno, filename or traceback"}), 400
+    
+    try:
+        return jsonify({"success": True, **memory_snapshots.diff(from_id, to_id, limit, group_by)})
+    except ProfilingError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+
+@debug_bp.route('/memory/snapshots/clear', methods=['POST'])
+def clear_memory_snapshots():
+    """API endpoint dropping every snapshot and stopping tracemalloc"""
+    memory_snapshots.clear()
+    return jsonify({"success": True})
@@ -1,12 +1,15 @@
 from datetime import datetime
-from flask import Blueprint, request, jsonify, render_template, abort
-from backend.models import db, EmergencyCall
-from backend.services.location_service import LocationService
-from backend.services.ambulance_service import AmbulanceService
+from flask import Blueprint, request, jsonify, render_template, abort, current_app as app
+from backend.models import db, EmergencyCall, CLOSED_CALL_STATUSES
+from backend.services import service_proxy
+from backend.utils.caller_location import INITIAL, MOVED, IGNORED, classify_fix, parse_location_fix
+from backend.utils.rooms import rooms_for
+from backend.utils.tracing import dispatch_trace, span
 
 location_bp = Blueprint('location', __name__)
-location_service = LocationService()
-ambulance_service = AmbulanceService()
+location_service = service_proxy('location')
+ambulance_service = service_proxy('ambulance')
+sms_location_service = service_proxy('sms_location')
 
 @location_bp.route('/share-location/<location_link_id>')
 def share_location_page(location_link_id):
@@ -24,12 +27,23 @@ def share_location_page(location_link_id):
 
 @location_bp.route('/api/location/submit', methods=['POST'])
 def submit_location():
-    """API endpoint to receive the shared location from the victim"""
+    """
+    API endpoint to receive the shared location from the victim. The share
+    page sends a coarse fix first and then more accurate ones, each with its
+    accuracy in metres; the call keeps the best fix. The first fix dispatches
+    the nearest ambulance, later ones are pushed to the assigned unit and only
+    re-run dispatch when the caller turns out to be somewhere else.
+    """
     data = request.get_json()
     
     if not data or 'location_link_id' not in data or 'latitude' not in data or 'longitude' not in data:
         return jsonify({"success": False, "error": "Missing required data"}), 400
     
+    try:
+        fix = parse_location_fix(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     # Find the emergency call with the provided location_link_id
     emergency_call = EmergencyCall.query.filter_by(
         location_link_id=data['location_link_id']
@@ -38,27 +52,68 @@ def submit_location():
     if not emergency_call:
         return jsonify({"success": False, "error": "Invalid location link"}), 404
     
+    outcome, moved_m = classify_fix(
+        emergency_call.latitude,
+        emergency_call.longitude,
+        emergency_call.location_accuracy,
+        fix,
+        app.config.get('LOCATION_REDISPATCH_DISTANCE_M', 500)
+    )
+    if emergency_call.status in CLOSED_CALL_STATUSES:
+        outcome = IGNORED
+    
+    if outcome == IGNORED:
+        return jsonify({
+            "success": True,
+            "message": "A more accurate location is already known",
+            "outcome": outcome,
+            "accuracy": emergency_call.location_accuracy,
+            "ambulance_assigned": emergency_call.assigned_ambulance_id is not None
+        })
+    
     # Update the emergency call with location data
-    emergency_call.latitude = data['latitude']
-    emergency_call.longitude = data['longitude']
-    emergency_call.status = 'location_shared'
-    emergency_call.location_shared_time = datetime.utcnow()
+    emergency_call.latitude = fix['latitude']
+    emergency_call.longitude = fix['longitude']
+    emergency_call.location_accuracy = fix['accuracy']
+    if outcome == INITIAL:
+        emergency_call.status = 'location_shared'
+        emergency_call.location_shared_time = datetime.utcnow()
     
     # Get address based on coordinates
     address = location_service.get_address_from_coordinates(
-        data['latitude'], 
-        data['longitude']
+        fix['latitude'], 
+        fix['longitude']
     )
     emergency_call.address = address
     
     db.session.commit()
     
-    # Automatically assign the nearest ambulance
-    ambulance_result = ambulance_service.assign_nearest_ambulance(emergency_call.id)
+    # Dashboards, the caller's page and the assigned unit follow the position
+    socketio = app.extensions.get('socketio')
+    if socketio:
+        socketio.emit('location_update', {
+            'emergency_call_id': emergency_call.id,
+            'latitude': fix['latitude'],
+            'longitude': fix['longitude'],
+            'accuracy': fix['accuracy'],
+            'phase': fix['phase'],
+            'address': address
+        }, to=rooms_for(call_id=emergency_call.id, ambulance_pk=emergency_call.assigned_ambulance_id))
+    
+    if outcome == INITIAL:
+        # Automatically assign the nearest ambulance
+        ambulance_result = ambulance_service.assign_nearest_ambulance(emergency_call.id)
+    elif outcome == MOVED and emergency_call.assigned_ambulance_id and not emergency_call.pickup_time:
+        app.logger.info(f"Caller of call {emergency_call.id} moved {moved_m:.0f} m, dispatching again")
+        ambulance_result = ambulance_service.redispatch_emergency(emergency_call)
+    else:
+        ambulance_result = {"success": emergency_call.assigned_ambulance_id is not None}
     
     return jsonify({
         "success": True,
         "message": "Location shared successfully",
+        "outcome": outcome,
+        "accuracy": fix['accuracy'],
         "ambulance_assigned": ambulance_result["success"] if "success" in ambulance_result else False
     })
 
@@ -101,10 +156,6 @@ def sms_webhook():
     
     app.logger.info(f"Received SMS from {from_number}: {message_body}")
     
-    # Initialize SMS location service
-    from backend.services.sms_location_service import SMSLocationService
-    sms_location_service = SMSLocationService()
-    
     # Check if this is a MENU command
     if message_body.strip().upper() == 'MENU':
         sms_location_service.handle_sms_menu(from_number, message_body)
@@ -113,27 +164,26 @@ def sms_webhook():
     # Check if this contains the location reply keyword
     keyword = app.config['SMS_REPLY_KEYWORD']
     if keyword in message_body.upper():
-        # This is likely a location response
-        result = sms_location_service.process_location_sms(from_number, message_body)
-        
-        if result["success"]:
-            # Attempt to assign an ambulance automatically
-            from backend.services.ambulance_service import AmbulanceService
-            ambulance_service = AmbulanceService()
+        # This is likely a location response; one trace covers it through dispatch
+        with dispatch_trace('sms_dispatch'):
+            result = sms_location_service.process_location_sms(from_number, message_body)
             
-            ambulance_result = ambulance_service.assign_nearest_ambulance(result["emergency_call_id"])
-            
-            if ambulance_result["success"]:
-                # Send ambulance dispatch confirmation via SMS
-                eta_minutes = ambulance_result.get("eta_minutes", "")
-                ambulance_id = ambulance_result.get("ambulance_id", "")
-                
-                confirmation_msg = f"An ambulance ({ambulance_id}) has been dispatched to your location. "
-                if eta_minutes:
-                    confirmation_msg += f"Estimated arrival time: {eta_minutes} minutes. "
-                confirmation_msg += "Please stay where you are."
+            if result["success"]:
+                # Attempt to assign an ambulance automatically
+                ambulance_result = ambulance_service.assign_nearest_ambulance(result["emergency_call_id"])
                 
-                sms_service.send_sms(from_number, confirmation_msg)
+                if ambulance_result["success"]:
+                    # Send ambulance dispatch confirmation via SMS
+                    eta_minutes = ambulance_result.get("eta_minutes", "")
+                    ambulance_id = ambulance_result.get("ambulance_id", "")
+                    
+                    confirmation_msg = f"An ambulance ({ambulance_id}) has been dispatched to your location. "
+                    if eta_minutes:
+                        confirmation_msg += f"Estimated arrival time: {eta_minutes} minutes. "
+                    confirmation_msg += "Please stay where you are."
+                    
+                    with span('sms_dispatch_confirmation'):
+                        sms_location_service.sms_service.send_sms(from_number, confirmation_msg)
         
         return '', 200
     
@@ -149,8 +199,7 @@ def sms_webhook():
             # Create a new emergency call
             emergency_call = EmergencyCall(
                 caller_phone=from_number,
-                status='initiated',
-                source='sms'
+                status='initiated'
             )
             
             if location_data["success"]:
@@ -162,8 +211,6 @@ def sms_webhook():
                 emergency_call.location_method = 'sms'
                 
                 # Try to get address
-                from backend.services.location_service import LocationService
-                location_service = LocationService()
                 address = location_service.get_address_from_coordinates(
                     location_data["latitude"], 
                     location_data["longitude"]
@@ -177,15 +224,12 @@ def sms_webhook():
             
             if location_data["success"]:
                 # Send confirmation and try to assign ambulance
-                sms_service.send_sms(
+                sms_location_service.sms_service.send_sms(
                     from_number, 
                     "Your location has been received. Emergency services are being dispatched."
                 )
                 
                 # Try to assign ambulance
-                from backend.services.ambulance_service import AmbulanceService
-                ambulance_service = AmbulanceService()
-                
                 ambulance_result = ambulance_service.assign_nearest_ambulance(emergency_call.id)
                 
                 if ambulance_result["success"]:
@@ -198,7 +242,7 @@ def sms_webhook():
                         confirmation_msg += f"Estimated arrival time: {eta_minutes} minutes. "
                     confirmation_msg += "Please stay where you are."
                     
-                    sms_service.send_sms(from_number, confirmation_msg)
+                    sms_location_service.sms_service.send_sms(from_number, confirmation_msg)
             else:
                 # Initiate SMS location protocol to get location
                 sms_location_service.initiate_sms_location_protocol(emergency_call)
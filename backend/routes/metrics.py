@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from backend.utils.metrics import CONTENT_TYPE, registry
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint with this process's metrics"""
+    return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,56 @@
+from flask import Blueprint, request, jsonify, current_app as app
+from backend.utils.tiles import parse_bbox, tile_response
+
+tiles_bp = Blueprint('tiles', __name__, url_prefix='/api/tiles')
+
+@tiles_bp.route('/<int:z>/<int:x>/<int:y>.<ext>', methods=['GET'])
+def get_tile(z, x, y, ext):
+    """API endpoint serving a map tile from the region tile pack"""
+    store = app.extensions.get('tile_store')
+    if not store:
+        return jsonify({"success": False, "error": "No tile pack configured"}), 404
+    
+    return tile_response(store, z, x, y, app.config.get('TILE_CACHE_MAX_AGE', 604800))
+
+@tiles_bp.route('/manifest', methods=['GET'])
+def get_manifest():
+    """API endpoint describing the region tile pack: bounds, zooms, format and version"""
+    store = app.extensions.get('tile_store')
+    if not store:
+        return jsonify({"success": False, "error": "No tile pack configured"}), 404
+    
+    return jsonify({
+        "success": True,
+        "manifest": store.manifest(f'/api/tiles/{{z}}/{{x}}/{{y}}.{store.format}')
+    })
+
+@tiles_bp.route('/keys', methods=['GET'])
+def get_tile_keys():
+    """
+    API endpoint listing the "z/x/y" keys of the tiles the pack holds inside
+    `bbox` (west,south,east,north) between `minzoom` and `maxzoom`, so the
+    service worker can prefetch a whole region. Defaults to the whole pack.
+    """
+    store = app.extensions.get('tile_store')
+    if not store:
+        return jsonify({"success": False, "error": "No tile pack configured"}), 404
+    
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    keys, truncated = store.tile_keys(
+        bbox,
+        request.args.get('minzoom', type=int),
+        request.args.get('maxzoom', type=int),
+        limit=app.config.get('TILE_KEYS_MAX', 100000)
+    )
+    
+    return jsonify({
+        "success": True,
+        "version": store.version,
+        "count": len(keys),
+        "truncated": truncated,
+        "keys": keys
+    })
@@ -1,47 +1,123 @@
 """
 Services package for the Emergency Response System.
 This package contains service classes that implement the core business logic.
+
+Each app gets a ServiceContainer in app.extensions['services'] from
+create_app(). A service is built the first time it is used, inside the app's
+context, and shared by every request after that; its module (and heavy
+dependencies such as twilio) is only imported then. Route modules use
+service_proxy() so importing them builds nothing and needs no app context.
 """
 
-from .location_service import LocationService
-from .sms_service import SMSService
-from .ambulance_service import AmbulanceService
+import threading
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+
+def _location(services):
+    from .location_service import LocationService
+    return LocationService()
+
+def _sms(services):
+    from .sms_service import SMSService
+    return SMSService()
+
+def _ambulance(services):
+    from .ambulance_service import AmbulanceService
+    return AmbulanceService(location_service=services.location, sms_service=services.sms, reads=services.reads)
+
+def _sms_location(services):
+    from .sms_location_service import SMSLocationService
+    return SMSLocationService(sms_service=services.sms, location_service=services.location)
+
+def _reads(services):
+    from .read_service import ReadService
+    return ReadService(spatial_index=bool(services.app.extensions.get('spatial_index')))
+
+def _archive(services):
+    from .archive_service import CallArchiveService
+    return CallArchiveService()
+
+def _idempotency(services):
+    from .idempotency_service import IdempotencyService
+    return IdempotencyService()
+
+SERVICE_FACTORIES = {
+    'location': _location,
+    'sms': _sms,
+    'ambulance': _ambulance,
+    'sms_location': _sms_location,
+    'reads': _reads,
+    'archive': _archive,
+    'idempotency': _idempotency
+}
+
+
+class ServiceContainer:
+    def __init__(self, app):
+        self.app = app
+        self._instances = {}
+        # Reentrant: building a service may build the ones it depends on
+        self._lock = threading.RLock()
+
+    def get(self, name):
+        """
+        Get a service of this app, building it on first use.
+
+        Args:
+            name: Key of SERVICE_FACTORIES, e.g. 'ambulance'
+
+        Returns:
+            The shared service instance
+        """
+        service = self._instances.get(name)
+        if service is not None:
+            return service
+
+        with self._lock:
+            if name not in self._instances:
+                if name not in SERVICE_FACTORIES:
+                    raise KeyError(f"Unknown service: {name}")
+                with self.app.app_context():
+                    self._instances[name] = SERVICE_FACTORIES[name](self)
+            return self._instances[name]
+
+    def __getattr__(self, name):
+        if name in SERVICE_FACTORIES:
+            return self.get(name)
+        raise AttributeError(name)
 
-# Create service instances
-location_service = None
-sms_service = None
-ambulance_service = None
 
 def init_services(app):
     """
-    Initialize all service classes with the Flask application context.
+    Attach a lazy service container to the Flask application.
     This should be called after the Flask app is created.
-    
+
     Args:
         app: Flask application instance
+
+    Returns:
+        The ServiceContainer
     """
-    global location_service, sms_service, ambulance_service
-    
-    # Initialize services with application context
-    with app.app_context():
-        location_service = LocationService()
-        sms_service = SMSService()
-        ambulance_service = AmbulanceService()
-    
-    return {
-        'location_service': location_service,
-        'sms_service': sms_service,
-        'ambulance_service': ambulance_service
-    }
+    services = app.extensions['services'] = ServiceContainer(app)
+    return services
+
+def get_service(name):
+    """Get a service of the current app"""
+    return current_app.extensions['services'].get(name)
+
+def service_proxy(name):
+    """Module-level stand-in for a service of whichever app is current"""
+    return LocalProxy(lambda: get_service(name))
 
 def get_location_service():
     """Get the LocationService instance"""
-    return location_service
+    return get_service('location')
 
 def get_sms_service():
     """Get the SMSService instance"""
-    return sms_service
+    return get_service('sms')
 
 def get_ambulance_service():
     """Get the AmbulanceService instance"""
-    return ambulance_service
\ No newline at end of file
+    return get_service('ambulance')
@@ -1,13 +1,29 @@
 from datetime import datetime
 from flask import current_app as app
-from backend.models import db, Ambulance, EmergencyCall
+from sqlalchemy.orm import joinedload
+from backend.models import db, Ambulance, EmergencyCall, CLOSED_CALL_STATUSES
 from backend.services.location_service import LocationService
 from backend.services.sms_service import SMSService
+from backend.services.read_service import POSITION_FIELDS, ReadService
+from backend.services.location_history_service import LocationHistoryService, ms_to_datetime
+from backend.services.route_service import RouteService
+from backend.utils.assignment_notifier import publish_assignment_update
+from backend.utils.location_batch import plan_batch
+from backend.utils.metrics import DISPATCHES, REDISPATCHES, WAITLIST_WAIT
+from backend.utils.tracing import dispatch_trace, span
+from backend.utils.spatial_index import SEARCH_RADII_KM
+from backend.utils.waitlist import queue_key, rank_by_reach, wait_seconds
+
+# Searches for the nearest unit when other dispatches keep taking it first
+ASSIGN_ATTEMPTS = 3
 
 class AmbulanceService:
-    def __init__(self):
-        self.location_service = LocationService()
-        self.sms_service = SMSService()
+    def __init__(self, location_service=None, sms_service=None, reads=None):
+        self.location_service = location_service or LocationService()
+        self.sms_service = sms_service or SMSService()
+        self.reads = reads or ReadService(spatial_index=bool(app.extensions.get('spatial_index')))
+        self.location_history = LocationHistoryService()
+        self.route_service = RouteService()
     
     def update_ambulance_location(self, ambulance_id, latitude, longitude):
         """Update ambulance location in the database"""
@@ -17,78 +33,389 @@ class AmbulanceService:
             ambulance.longitude = longitude
             ambulance.last_updated = datetime.utcnow()
             db.session.commit()
+            
+            # Keep the trail, not just the latest position
+            self.location_history.record_position(
+                ambulance.id, latitude, longitude, ambulance.last_updated
+            )
             return True
         return False
     
+    def update_locations_batch(self, items):
+        """
+        Apply a batch of location updates for any number of ambulances.
+        An ambulance's current position moves only to its newest point, and
+        points that are not newer than the current one are reported as stale.
+        Changes are staged on the session; the caller commits them in one
+        transaction and then passes the track points to
+        location_history.record_positions().
+        
+        Args:
+            items: List of {ambulance_id, lat, lon, ts, seq} dicts
+        
+        Returns:
+            Tuple of (per-item results in request order, updated ambulances,
+            track points of the accepted items)
+        """
+        ids = {str(item['ambulance_id']) for item in items if isinstance(item, dict) and item.get('ambulance_id')}
+        ambulances = {
+            ambulance.ambulance_id: ambulance
+            for ambulance in Ambulance.query.filter(Ambulance.ambulance_id.in_(ids))
+        } if ids else {}
+        
+        results, accepted, latest = plan_batch(
+            items,
+            {ambulance_id: ambulance.last_updated for ambulance_id, ambulance in ambulances.items()}
+        )
+        
+        track_points = [
+            (ambulances[item['ambulance_id']].id, item['latitude'], item['longitude'], item['timestamp'])
+            for _, item in accepted
+        ]
+        
+        for ambulance_id, item in latest.items():
+            ambulance = ambulances[ambulance_id]
+            ambulance.latitude = item['latitude']
+            ambulance.longitude = item['longitude']
+            ambulance.last_updated = item['timestamp']
+        
+        return results, [ambulances[ambulance_id] for ambulance_id in latest], track_points
+    
+    def ingest_telemetry(self, ambulance_pk, points):
+        """
+        Store a batch of decoded telemetry points. Every point goes into the
+        location history; the current position only moves forward in time, so
+        points buffered during a connectivity gap don't rewind it.
+        
+        Args:
+            ambulance_pk: Primary key of the ambulance
+            points: Point dicts from backend.utils.telemetry.decode_frame
+        
+        Returns:
+            The ambulance, or None if it does not exist
+        """
+        ambulance = Ambulance.query.get(ambulance_pk)
+        if not ambulance or not points:
+            return ambulance
+        
+        latest = max(points, key=lambda p: p['timestamp_ms'])
+        latest_time = ms_to_datetime(latest['timestamp_ms'])
+        if ambulance.last_updated is None or latest_time > ambulance.last_updated:
+            ambulance.latitude = latest['latitude']
+            ambulance.longitude = latest['longitude']
+            ambulance.last_updated = latest_time
+        
+        db.session.commit()
+        
+        self.location_history.record_positions(
+            (ambulance.id, point['latitude'], point['longitude'], ms_to_datetime(point['timestamp_ms']))
+            for point in points
+        )
+        return ambulance
+    
     def get_available_ambulances(self):
         """Get list of all available ambulances"""
         return Ambulance.query.filter_by(is_available=True).all()
     
+    def get_ambulances_in_radius(self, latitude, longitude, radius_km, available_only=True,
+                                 fields=Ambulance.SERIALIZED_FIELDS):
+        """
+        Get ambulances inside the bounding box of a radius around a point, as
+        read-only rows (see ReadService.ambulances_in_radius). Callers still
+        need to check the exact distance of each candidate.
+        """
+        return self.reads.ambulances_in_radius(latitude, longitude, radius_km, available_only, fields)
+    
+    def find_nearest_available_ambulance(self, latitude, longitude):
+        """
+        Find the nearest available ambulance by searching growing radii, so
+        only nearby candidates are loaded and scored. Candidates are scored as
+        position rows; only the winner is loaded as a model object.
+        
+        Returns:
+            Tuple of (ambulance, distance_km), or (None, None) if none is available
+        """
+        nearest = None
+        for radius_km in SEARCH_RADII_KM:
+            with span('fleet_query'):
+                candidates = self.get_ambulances_in_radius(latitude, longitude, radius_km, fields=POSITION_FIELDS)
+            nearest, distance = self.location_service.find_nearest_ambulance(latitude, longitude, candidates)
+            
+            # Anything outside the box is further than radius_km away
+            if nearest and distance <= radius_km:
+                break
+        else:
+            with span('fleet_query'):
+                candidates = self.reads.ambulances(POSITION_FIELDS, available_only=True)
+            nearest, distance = self.location_service.find_nearest_ambulance(latitude, longitude, candidates)
+        
+        if not nearest:
+            return None, None
+        return Ambulance.query.get(nearest.id), distance
+    
     def assign_nearest_ambulance(self, emergency_call_id):
         """Find and assign the nearest available ambulance to the emergency"""
-        emergency_call = EmergencyCall.query.get(emergency_call_id)
+        # Stage timings go to the dispatch trace buffer (/api/debug/dispatches)
+        with dispatch_trace('assign', call_id=emergency_call_id) as trace:
+            result = self._assign_nearest_ambulance(emergency_call_id)
+            trace.attributes.setdefault('outcome', 'assigned' if result["success"] else result["error"])
+            return result
+    
+    def _assign_nearest_ambulance(self, emergency_call_id):
+        with span('call_lookup'):
+            emergency_call = EmergencyCall.query.get(emergency_call_id)
         if not emergency_call or not emergency_call.latitude or not emergency_call.longitude:
+            DISPATCHES.inc(outcome='invalid_call')
             return {"success": False, "error": "Invalid emergency call or location not shared"}
         
-        # Get all available ambulances
-        available_ambulances = self.get_available_ambulances()
-        if not available_ambulances:
-            return {"success": False, "error": "No ambulances available"}
-        
-        # Find the nearest ambulance
-        nearest_ambulance, distance = self.location_service.find_nearest_ambulance(
-            emergency_call.latitude, 
-            emergency_call.longitude, 
-            available_ambulances
-        )
+        assigned_to = emergency_call.assigned_ambulance_id
+        for _ in range(ASSIGN_ATTEMPTS):
+            # Find the nearest available ambulance
+            nearest_ambulance, distance = self.find_nearest_available_ambulance(
+                emergency_call.latitude, 
+                emergency_call.longitude
+            )
+            if not nearest_ambulance:
+                break
+            
+            result = self._assign_ambulance(emergency_call, nearest_ambulance, distance, assigned_to=assigned_to)
+            if result:
+                return result
+            
+            # Another dispatch took the unit or the call while this one was
+            # routing; the rollback expired the call, so this reads it afresh
+            if (emergency_call.assigned_ambulance_id != assigned_to
+                    or emergency_call.status in CLOSED_CALL_STATUSES):
+                DISPATCHES.inc(outcome='call_taken')
+                return {"success": False, "error": "Call was assigned or closed by another dispatch"}
         
-        if not nearest_ambulance:
-            return {"success": False, "error": "Could not find a suitable ambulance"}
+        DISPATCHES.inc(outcome='no_ambulance')
+        # The next unit to become free is offered to the waitlist
+        queued = self.enqueue_call(emergency_call) is not None
+        return {"success": False, "error": "No ambulances available", "queued": queued}
+    
+    def _assign_ambulance(self, emergency_call, ambulance, distance, claim=False, assigned_to=None):
+        """
+        Assign an available ambulance to a call, commit, and notify everyone.
+        The unit and the call are claimed in the commit's transaction; if
+        another dispatch took either while this one was routing, nothing is
+        assigned.
         
-        # Calculate ETA (rough estimate: assume 40 km/h average speed in city traffic)
-        eta_minutes = int((distance / 40) * 60)
+        Args:
+            claim: Take the call off the waitlist in the same transaction, and
+                give up if another worker already did
+            assigned_to: Primary key of the unit the call had when it was
+                read (None for an unassigned call); the call is only updated
+                if it still has that unit and is still open
         
+        Returns:
+            The dispatch result, or None if the unit or the call was taken
+        """
         # Generate route URL
         route_url = self.location_service.get_route_url(
-            nearest_ambulance.latitude,
-            nearest_ambulance.longitude,
+            ambulance.latitude,
+            ambulance.longitude,
             emergency_call.latitude,
             emergency_call.longitude
         )
         
-        # Update emergency call with assigned ambulance
-        emergency_call.assigned_ambulance_id = nearest_ambulance.id
-        emergency_call.assigned_time = datetime.utcnow()
-        emergency_call.status = "assigned"
+        # Offline route bundle for the driver app, committed with the assignment.
+        # Its ETA comes from the router, or 40 km/h along the straight line.
+        with span('route_bundle'):
+            bundle = self.route_service.create_bundle(emergency_call, ambulance)
+        eta_minutes = int(bundle['duration_s'] / 60)
         
-        # Mark ambulance as unavailable
-        nearest_ambulance.is_available = False
+        with span('commit'):
+            # Claimed only now, so the write lock is not held across the router round trip
+            waited = emergency_call.queued_time
+            open_call = [
+                EmergencyCall.id == emergency_call.id,
+                EmergencyCall.status.notin_(CLOSED_CALL_STATUSES),
+                EmergencyCall.assigned_ambulance_id == assigned_to if assigned_to is not None
+                else EmergencyCall.assigned_ambulance_id.is_(None)
+            ]
+            if claim:
+                open_call.append(EmergencyCall.queue_key.isnot(None))
+            if not EmergencyCall.query.filter(*open_call).update({
+                EmergencyCall.assigned_ambulance_id: ambulance.id,
+                EmergencyCall.assigned_time: datetime.utcnow(),
+                EmergencyCall.status: "assigned",
+                # Leave the waitlist, if the call was on it
+                EmergencyCall.queued_time: None,
+                EmergencyCall.queue_key: None
+            }, synchronize_session=False):
+                db.session.rollback()
+                return None
+            if not Ambulance.query.filter(
+                Ambulance.id == ambulance.id,
+                Ambulance.is_available.is_(True)
+            ).update({Ambulance.is_available: False}, synchronize_session=False):
+                db.session.rollback()
+                return None
+            
+            db.session.commit()
+        if waited is not None:
+            WAITLIST_WAIT.observe(wait_seconds(waited))
+        DISPATCHES.inc(outcome='assigned')
         
-        db.session.commit()
+        # Push the dispatch to the ambulance app and dashboards
+        with span('publish'):
+            publish_assignment_update(emergency_call.id, ambulance.id)
         
         # Notify ambulance driver
-        self.sms_service.notify_ambulance_driver(
-            nearest_ambulance.driver_phone,
-            emergency_call.latitude,
-            emergency_call.longitude,
-            emergency_call.address,
-            route_url
-        )
+        with span('sms_driver'):
+            self.sms_service.notify_ambulance_driver(
+                ambulance.driver_phone,
+                emergency_call.latitude,
+                emergency_call.longitude,
+                emergency_call.address,
+                route_url
+            )
         
         # Send confirmation to victim
-        self.sms_service.send_confirmation_to_victim(
-            emergency_call.caller_phone,
-            nearest_ambulance.ambulance_id,
-            nearest_ambulance.driver_name,
-            eta_minutes
-        )
+        with span('sms_victim'):
+            self.sms_service.send_confirmation_to_victim(
+                emergency_call.caller_phone,
+                ambulance.ambulance_id,
+                ambulance.driver_name,
+                eta_minutes
+            )
         
         return {
             "success": True,
-            "ambulance_id": nearest_ambulance.ambulance_id,
-            "driver_name": nearest_ambulance.driver_name,
+            "emergency_call_id": emergency_call.id,
+            "ambulance_id": ambulance.ambulance_id,
+            "driver_name": ambulance.driver_name,
             "distance_km": round(distance, 2),
-            "eta_minutes": eta_minutes
+            "eta_minutes": eta_minutes,
+            "route_source": bundle['source']
+        }
+    
+    def enqueue_call(self, emergency_call):
+        """
+        Put a call that found no free unit on the dispatch waitlist. A call
+        already on it keeps its place; one that still has a unit (a failed
+        re-dispatch) is not queued.
+        
+        Returns:
+            The call's queue key, or None if it was not queued
+        """
+        if emergency_call.assigned_ambulance_id is not None:
+            return None
+        if emergency_call.queue_key is None:
+            emergency_call.queued_time = datetime.utcnow()
+            emergency_call.queue_key = queue_key(
+                emergency_call.queued_time,
+                emergency_call.severity,
+                app.config.get('DISPATCH_WAITLIST_SEVERITY_STEP_SECONDS', 300)
+            )
+            db.session.commit()
+        return emergency_call.queue_key
+    
+    def dispatch_waitlist(self, ambulance):
+        """
+        Offer a unit that just became free to the dispatch waitlist. It goes
+        to the call it reaches fastest among the first
+        DISPATCH_WAITLIST_CANDIDATES calls of the queue.
+        
+        Args:
+            ambulance: The freed or newly registered Ambulance
+        
+        Returns:
+            The dispatch result, or None if the unit stays free
+        """
+        if not ambulance or not ambulance.is_available:
+            return None
+        
+        with dispatch_trace('waitlist', ambulance_id=ambulance.id) as trace:
+            with span('queue_lookup'):
+                head = self.reads.waitlist_head(app.config.get('DISPATCH_WAITLIST_CANDIDATES', 5))
+            if not head:
+                trace.attributes['outcome'] = 'empty'
+                return None
+            
+            for distance, call_id in rank_by_reach(ambulance.latitude, ambulance.longitude, head):
+                # Another worker may be offering the same call a unit; only
+                # one of them claims it
+                emergency_call = db.session.get(EmergencyCall, call_id, populate_existing=True)
+                result = self._assign_ambulance(emergency_call, ambulance, distance, claim=True)
+                if result:
+                    trace.attributes.setdefault('call_id', call_id)
+                    trace.attributes['outcome'] = 'assigned'
+                    return result
+                # The rollback expired the unit; if another dispatch took it,
+                # every further candidate would fail after its router round trip
+                if not ambulance.is_available:
+                    break
+            
+            trace.attributes['outcome'] = 'claimed_elsewhere'
+            return None
+    
+    def redispatch_emergency(self, emergency_call):
+        """
+        Re-run dispatch after the caller's position moved. The call goes to a
+        closer available ambulance if there is one; otherwise the assigned
+        ambulance keeps it and gets a route bundle to the new position.
+        
+        Returns:
+            Dict with success, ambulance_id and whether the call was reassigned
+        """
+        with dispatch_trace('redispatch', call_id=emergency_call.id) as trace:
+            result = self._redispatch_emergency(emergency_call)
+            if not result["success"]:
+                trace.attributes['outcome'] = result["error"]
+            elif "reassigned" in result:
+                trace.attributes['outcome'] = 'reassigned' if result["reassigned"] else 'rerouted'
+            return result
+    
+    def _redispatch_emergency(self, emergency_call):
+        current = emergency_call.assigned_ambulance
+        if not current:
+            return self.assign_nearest_ambulance(emergency_call.id)
+        
+        nearest_ambulance, distance = self.find_nearest_available_ambulance(
+            emergency_call.latitude,
+            emergency_call.longitude
+        )
+        current_distance = self.location_service.calculate_distance(
+            emergency_call.latitude, emergency_call.longitude,
+            current.latitude, current.longitude
+        )
+        
+        if nearest_ambulance and distance < current_distance:
+            result = self.assign_nearest_ambulance(emergency_call.id)
+            if not result["success"]:
+                db.session.rollback()
+                REDISPATCHES.inc(outcome='failed')
+                return result
+            
+            # Released once the call has its new unit
+            current.is_available = True
+            db.session.commit()
+            
+            # The released unit's app drops the call on its next fetch
+            REDISPATCHES.inc(outcome='reassigned')
+            publish_assignment_update(emergency_call.id, current.id, reassigned=True)
+            self.dispatch_waitlist(current)
+            return {**result, "reassigned": True}
+        
+        with span('route_bundle'):
+            bundle = self.route_service.create_bundle(emergency_call, current)
+        with span('commit'):
+            db.session.commit()
+        REDISPATCHES.inc(outcome='rerouted')
+        
+        # The unit fetches the new bundle when it sees the version change
+        with span('publish'):
+            publish_assignment_update(emergency_call.id, current.id, rerouted=True)
+        
+        return {
+            "success": True,
+            "ambulance_id": current.ambulance_id,
+            "distance_km": round(current_distance, 2),
+            "eta_minutes": int(bundle['duration_s'] / 60),
+            "route_source": bundle['source'],
+            "reassigned": False
         }
     
     def mark_ambulance_arrived(self, ambulance_id, emergency_call_id):
@@ -100,19 +427,54 @@ class AmbulanceService:
             return True
         return False
     
+    def release_ambulance(self, emergency_call):
+        """
+        Make the unit of a closing call available again, unless another open
+        call holds it. The caller commits.
+        
+        Returns:
+            The freed Ambulance, or None
+        """
+        ambulance = emergency_call.assigned_ambulance
+        if not ambulance:
+            return None
+        
+        other_call = db.session.query(EmergencyCall.id).filter(
+            EmergencyCall.assigned_ambulance_id == ambulance.id,
+            EmergencyCall.id != emergency_call.id,
+            EmergencyCall.status.notin_(CLOSED_CALL_STATUSES)
+        ).first()
+        if other_call:
+            return None
+        
+        ambulance.is_available = True
+        return ambulance
+    
     def complete_emergency(self, emergency_call_id):
         """Mark emergency as complete and free up the ambulance"""
-        emergency_call = EmergencyCall.query.get(emergency_call_id)
+        emergency_call = db.session.get(
+            EmergencyCall, emergency_call_id, options=[joinedload(EmergencyCall.assigned_ambulance)]
+        )
         if not emergency_call:
             return False
+        
+        # A repeated completion must not free a unit that has moved on
+        if emergency_call.status in CLOSED_CALL_STATUSES:
+            return True
             
         # Update emergency call status
         emergency_call.status = "completed"
         emergency_call.completion_time = datetime.utcnow()
+        emergency_call.queued_time = None
+        emergency_call.queue_key = None
         
         # Make ambulance available again
-        if emergency_call.assigned_ambulance:
-            emergency_call.assigned_ambulance.is_available = True
+        ambulance = self.release_ambulance(emergency_call)
             
         db.session.commit()
+        
+        publish_assignment_update(emergency_call.id, emergency_call.assigned_ambulance_id, completed=True)
+        
+        # The freed unit goes straight to a queued call, if any
+        self.dispatch_waitlist(ambulance)
         return True
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Call archival service.
+Moves closed emergency calls out of the hot emergency_calls table into the
+archive so the active-call queries only ever scan live work.
+"""
+
+from datetime import datetime, timedelta
+from flask import current_app as app
+from sqlalchemy import func
+from backend.models import db, EmergencyCall, EmergencyCallArchive, RouteBundle, CLOSED_CALL_STATUSES
+
+
+class CallArchiveService:
+    def archive_closed_calls(self, older_than_hours=None, batch_size=None, max_batches=None):
+        """
+        Archive completed and cancelled calls that closed more than
+        older_than_hours ago. Batches are small so the hot table is never
+        locked for long, and a batch interrupted between copy and delete is
+        safely picked up again by the next run.
+
+        Args:
+            older_than_hours: Minimum age of a closed call (defaults to config)
+            batch_size: Calls moved per transaction (defaults to config)
+            max_batches: Optional cap on the number of batches for this run
+
+        Returns:
+            Number of calls archived
+        """
+        if older_than_hours is None:
+            older_than_hours = app.config.get('CALL_ARCHIVE_AFTER_HOURS', 24)
+        batch_size = batch_size or app.config.get('CALL_ARCHIVE_BATCH_SIZE', 500)
+        cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+
+        archived = 0
+        batches = 0
+        # Calls whose id an older archived call already holds (ids reused
+        # before emergency_calls had AUTOINCREMENT); they stay in the hot table
+        conflicting = set()
+        while max_batches is None or batches < max_batches:
+            query = EmergencyCall.query.filter(
+                EmergencyCall.status.in_(CLOSED_CALL_STATUSES),
+                func.coalesce(EmergencyCall.completion_time, EmergencyCall.call_time) < cutoff
+            )
+            if conflicting:
+                query = query.filter(EmergencyCall.id.notin_(conflicting))
+            calls = query.order_by(EmergencyCall.id).limit(batch_size).all()
+
+            if not calls:
+                break
+
+            # A previous run may have copied rows and then failed to delete them.
+            # The id alone does not identify the call, so compare the row too.
+            archived_rows = {
+                row.id: (row.location_link_id, row.call_time) for row in
+                db.session.query(
+                    EmergencyCallArchive.id, EmergencyCallArchive.location_link_id, EmergencyCallArchive.call_time
+                ).filter(EmergencyCallArchive.id.in_([call.id for call in calls]))
+            }
+
+            ids = []
+            for call in calls:
+                if call.id not in archived_rows:
+                    db.session.add(EmergencyCallArchive.from_call(call))
+                elif archived_rows[call.id] != (call.location_link_id, call.call_time):
+                    app.logger.warning(f"Not archiving call {call.id}: archived call {call.id} is a different call")
+                    conflicting.add(call.id)
+                    continue
+                ids.append(call.id)
+            
+            # Copy and delete commit separately: when the archive shares the main
+            # SQLite file, two open write transactions on it would deadlock.
+            # Only calls that are now in the archive are deleted.
+            db.session.commit()
+            if ids:
+                RouteBundle.query.filter(RouteBundle.emergency_call_id.in_(ids)).delete(synchronize_session=False)
+                EmergencyCall.query.filter(EmergencyCall.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+            db.session.expunge_all()
+
+            archived += len(ids)
+            batches += 1
+
+            if len(calls) < batch_size:
+                break
+
+        if archived:
+            app.logger.info(f"Archived {archived} closed emergency calls")
+
+        return archived
+
+    def search_history(self, caller_phone=None, status=None, since=None, until=None, limit=50, offset=0):
+        """Query archived calls, newest first"""
+        query = EmergencyCallArchive.query
+
+        if caller_phone:
+            query = query.filter(EmergencyCallArchive.caller_phone == caller_phone)
+        if status:
+            query = query.filter(EmergencyCallArchive.status == status)
+        if since:
+            query = query.filter(EmergencyCallArchive.call_time >= since)
+        if until:
+            query = query.filter(EmergencyCallArchive.call_time <= until)
+
+        return query.order_by(EmergencyCallArchive.call_time.desc()).offset(offset).limit(limit).all()
+
+    def get_archived_call(self, call_id):
+        return EmergencyCallArchive.query.get(call_id)
+
+
+def archive_periodically(app, socketio):
+    """Background task that archives closed calls every CALL_ARCHIVE_INTERVAL_SECONDS"""
+    interval = app.config['CALL_ARCHIVE_INTERVAL_SECONDS']
+    service = CallArchiveService()
+
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                service.archive_closed_calls()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Error archiving calls: {str(e)}")
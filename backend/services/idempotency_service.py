@@ -0,0 +1,47 @@
+"""
+Idempotency key service.
+Stores the response of a write request under the client's Idempotency-Key so
+that a retry (e.g. a replay after reconnecting) returns the original result
+without applying the request again.
+"""
+
+import json
+from datetime import datetime, timedelta
+from flask import current_app as app
+from backend.models import db, IdempotencyRecord
+
+MAX_KEY_LENGTH = 128
+
+
+class IdempotencyService:
+    def get_response(self, key, endpoint):
+        """
+        Look up the stored response for a key.
+        
+        Returns:
+            Tuple of (body dict, status code), or None if the key is new
+        """
+        record = IdempotencyRecord.query.get((key, endpoint))
+        if not record:
+            return None
+        return json.loads(record.response), record.status_code
+
+    def save_response(self, key, endpoint, body, status_code=200):
+        """
+        Stage the response for a key. It is committed together with the
+        caller's changes, so either both are stored or neither is.
+        """
+        db.session.add(IdempotencyRecord(
+            key=key,
+            endpoint=endpoint,
+            status_code=status_code,
+            response=json.dumps(body)
+        ))
+
+    def prune(self, ttl_hours=None):
+        """Delete keys older than IDEMPOTENCY_KEY_TTL_HOURS; returns the number deleted"""
+        ttl_hours = ttl_hours or app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24)
+        cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+        return IdempotencyRecord.query.filter(
+            IdempotencyRecord.created_time < cutoff
+        ).delete(synchronize_session=False)
@@ -0,0 +1,255 @@
+"""
+Ambulance location history service.
+Buffers GPS pings in memory, appends them to the database in batches as
+day-partitioned, delta-encoded track segments, and plays tracks back for a
+time window with server-side downsampling.
+
+Points are buffered once the position they come from is committed. A buffer
+is written when it is full, when a background task finds it older than
+LOCATION_HISTORY_FLUSH_SECONDS (so a unit that stops pinging is written too),
+and at interpreter exit.
+"""
+
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app as app
+from sqlalchemy.exc import SQLAlchemyError
+from backend.models import db, AmbulanceTrackSegment
+from backend.utils.track_encoding import (
+    encode_track,
+    decode_track,
+    to_micro_degrees,
+    from_micro_degrees,
+    MAX_POINTS_PER_BLOB
+)
+from backend.utils.simplify import simplify_to_count
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_ms(value):
+    """Convert a naive UTC datetime to epoch milliseconds"""
+    return int((value - EPOCH).total_seconds() * 1000)
+
+
+def ms_to_datetime(value):
+    """Convert epoch milliseconds to a naive UTC datetime"""
+    return EPOCH + timedelta(milliseconds=value)
+
+
+class TrackBuffer:
+    """Process-wide buffer of GPS points that have not been written yet"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._points = {}
+        self._oldest = {}
+
+    def add(self, ambulance_pk, point):
+        with self._lock:
+            self._points.setdefault(ambulance_pk, []).append(point)
+            self._oldest.setdefault(ambulance_pk, time.monotonic())
+
+    def peek(self, ambulance_pk):
+        with self._lock:
+            return list(self._points.get(ambulance_pk, ()))
+
+    def take(self, ambulance_pk=None):
+        """Remove and return buffered points for one ambulance, or for all of them"""
+        with self._lock:
+            if ambulance_pk is None:
+                taken = self._points
+                self._points = {}
+                self._oldest = {}
+                return taken
+            self._oldest.pop(ambulance_pk, None)
+            points = self._points.pop(ambulance_pk, None)
+            return {ambulance_pk: points} if points else {}
+
+    def restore(self, taken):
+        """Put back points that were taken but could not be written"""
+        now = time.monotonic()
+        with self._lock:
+            for pk, points in taken.items():
+                self._points[pk] = points + self._points.get(pk, [])
+                self._oldest.setdefault(pk, now)
+
+    def take_due(self, batch_size, max_age_seconds):
+        """Remove and return buffers that are full or have waited long enough"""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                pk for pk, points in self._points.items()
+                if len(points) >= batch_size or now - self._oldest[pk] >= max_age_seconds
+            ]
+            taken = {}
+            for pk in due:
+                taken[pk] = self._points.pop(pk)
+                del self._oldest[pk]
+            return taken
+
+
+# Shared by every LocationHistoryService instance in this process
+_track_buffer = TrackBuffer()
+
+
+class LocationHistoryService:
+    def __init__(self, buffer=None):
+        self.buffer = buffer or _track_buffer
+
+    def record_position(self, ambulance_pk, latitude, longitude, timestamp=None):
+        """
+        Buffer a GPS point of a committed position and write any batches that
+        are ready, in a transaction of their own.
+
+        Args:
+            ambulance_pk: Primary key of the ambulance
+            latitude, longitude: Position in decimal degrees
+            timestamp: Naive UTC datetime of the fix (defaults to now)
+
+        Returns:
+            Number of track segments written
+        """
+        return self.record_positions([(ambulance_pk, latitude, longitude, timestamp)])
+
+    def record_positions(self, points):
+        """
+        Buffer several committed GPS points, then write the batches that are ready.
+
+        Args:
+            points: Iterable of (ambulance_pk, latitude, longitude, timestamp)
+
+        Returns:
+            Number of track segments written
+        """
+        for ambulance_pk, latitude, longitude, timestamp in points:
+            self.buffer.add(ambulance_pk, (
+                datetime_to_ms(timestamp or datetime.utcnow()),
+                to_micro_degrees(latitude),
+                to_micro_degrees(longitude)
+            ))
+        return self.flush_due()
+
+    def flush_due(self):
+        """Write buffers that are full or older than LOCATION_HISTORY_FLUSH_SECONDS"""
+        return self._write(self.buffer.take_due(
+            app.config.get('LOCATION_HISTORY_BATCH_SIZE', 30),
+            app.config.get('LOCATION_HISTORY_FLUSH_SECONDS', 300)
+        ))
+
+    def flush(self, ambulance_pk=None):
+        """Write buffered points for one ambulance (or all) and commit"""
+        return self._write(self.buffer.take(ambulance_pk))
+
+    def _write(self, buffered):
+        if not buffered:
+            return 0
+        try:
+            written = 0
+            for ambulance_pk, points in buffered.items():
+                for segment in self._build_segments(ambulance_pk, points):
+                    db.session.add(segment)
+                    written += 1
+            db.session.commit()
+            return written
+        except SQLAlchemyError as e:
+            # Kept for the next attempt; the positions themselves are committed
+            db.session.rollback()
+            self.buffer.restore(buffered)
+            app.logger.error(f"Error writing track segments: {str(e)}")
+            return 0
+
+    def _build_segments(self, ambulance_pk, points):
+        """Split points into segments that never span a UTC day"""
+        points = sorted(set(points))
+
+        by_day = {}
+        for point in points:
+            by_day.setdefault(ms_to_datetime(point[0]).date(), []).append(point)
+
+        for day, day_points in by_day.items():
+            for i in range(0, len(day_points), MAX_POINTS_PER_BLOB):
+                chunk = day_points[i:i + MAX_POINTS_PER_BLOB]
+                yield AmbulanceTrackSegment(
+                    ambulance_id=ambulance_pk,
+                    day=day,
+                    start_time=ms_to_datetime(chunk[0][0]),
+                    end_time=ms_to_datetime(chunk[-1][0]),
+                    point_count=len(chunk),
+                    data=encode_track(chunk)
+                )
+
+    def get_track(self, ambulance_pk, start, end):
+        """
+        Get the raw track of an ambulance for a time window.
+
+        Args:
+            ambulance_pk: Primary key of the ambulance
+            start, end: Naive UTC datetimes bounding the window
+
+        Returns:
+            List of (timestamp_ms, lat_e6, lon_e6) tuples ordered by time
+        """
+        segments = AmbulanceTrackSegment.query.filter(
+            AmbulanceTrackSegment.ambulance_id == ambulance_pk,
+            AmbulanceTrackSegment.day >= start.date(),
+            AmbulanceTrackSegment.day <= end.date(),
+            AmbulanceTrackSegment.end_time >= start,
+            AmbulanceTrackSegment.start_time <= end
+        ).order_by(AmbulanceTrackSegment.start_time).all()
+
+        start_ms = datetime_to_ms(start)
+        end_ms = datetime_to_ms(end)
+
+        points = []
+        for segment in segments:
+            points.extend(p for p in decode_track(segment.data) if start_ms <= p[0] <= end_ms)
+
+        # Include points that are still waiting in the buffer
+        points.extend(p for p in self.buffer.peek(ambulance_pk) if start_ms <= p[0] <= end_ms)
+
+        return sorted(set(points))
+
+    def playback(self, ambulance_pk, start, end, max_points=None):
+        """
+        Get a track for playback, downsampled with Douglas-Peucker when it
+        holds more than max_points points.
+
+        Returns:
+            Dict with points as [timestamp_ms, latitude, longitude] lists,
+            the raw point count and the tolerance used for downsampling
+        """
+        max_points = max_points or app.config.get('TRACK_PLAYBACK_MAX_POINTS', 500)
+
+        raw = self.get_track(ambulance_pk, start, end)
+        points = [[ts, from_micro_degrees(lat), from_micro_degrees(lon)] for ts, lat, lon in raw]
+        simplified, tolerance = simplify_to_count(points, max_points, lat_index=1, lon_index=2)
+
+        return {
+            "points": simplified,
+            "raw_point_count": len(points),
+            "downsampled": len(simplified) < len(points),
+            "tolerance_m": tolerance
+        }
+
+
+def flush_tracks_periodically(app, socketio):
+    """Background task that writes stale track buffers every LOCATION_HISTORY_FLUSH_INTERVAL_SECONDS"""
+    interval = app.config['LOCATION_HISTORY_FLUSH_INTERVAL_SECONDS']
+    service = LocationHistoryService()
+
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            service.flush_due()
+
+
+def flush_tracks_at_exit(app):
+    """Write every buffered point when the process exits"""
+    def flush():
+        with app.app_context():
+            LocationHistoryService().flush()
+
+    atexit.register(flush)
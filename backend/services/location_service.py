@@ -1,7 +1,8 @@
 import uuid
 import requests
-from geopy.distance import geodesic
 from flask import current_app as app
+from backend.utils.metrics import track_dependency
+from backend.utils.tracing import span
 
 class LocationService:
     def __init__(self):
@@ -18,11 +19,17 @@ class LocationService:
     
     def get_address_from_coordinates(self, latitude, longitude):
         """Reverse geocoding using OpenStreetMap Nominatim API"""
-        url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={latitude}&lon={longitude}"
+        base_url = app.config.get('NOMINATIM_URL')
+        if not base_url:
+            return None
+        
+        url = f"{base_url.rstrip('/')}/reverse?format=json&lat={latitude}&lon={longitude}"
         headers = {'User-Agent': self.user_agent}
         
         try:
-            response = requests.get(url, headers=headers)
+            with span('reverse_geocode'), track_dependency('nominatim') as call:
+                response = requests.get(url, headers=headers, timeout=app.config.get('NOMINATIM_TIMEOUT_SECONDS', 5))
+                call.failed = response.status_code != 200
             if response.status_code == 200:
                 data = response.json()
                 if 'display_name' in data:
@@ -34,30 +41,35 @@ class LocationService:
     
     def calculate_distance(self, lat1, lon1, lat2, lon2):
         """Calculate distance between two coordinates in kilometers"""
+        from geopy.distance import geodesic  # slow to import; only needed here
         return geodesic((lat1, lon1), (lat2, lon2)).kilometers
     
     def find_nearest_ambulance(self, victim_lat, victim_lon, ambulances):
         """Find the nearest available ambulance to the victim's location"""
         if not ambulances:
-            return None
+            return None, None
             
         nearest_ambulance = None
         min_distance = float('inf')
         
-        for ambulance in ambulances:
-            if not ambulance.is_available:
-                continue
+        with span('distance_scoring'):
+            for ambulance in ambulances:
+                if not ambulance.is_available:
+                    continue
+                    
+                distance = self.calculate_distance(
+                    victim_lat, victim_lon,
+                    ambulance.latitude, ambulance.longitude
+                )
                 
-            distance = self.calculate_distance(
-                victim_lat, victim_lon,
-                ambulance.latitude, ambulance.longitude
-            )
-            
-            if distance < min_distance:
-                min_distance = distance
-                nearest_ambulance = ambulance
+                if distance < min_distance:
+                    min_distance = distance
+                    nearest_ambulance = ambulance
+        
+        if not nearest_ambulance:
+            return None, None
         
-        return nearest_ambulance, min_distance if nearest_ambulance else (None, None)
+        return nearest_ambulance, min_distance
     
     def get_route_url(self, start_lat, start_lon, end_lat, end_lon):
         """Generate an OpenStreetMap route URL"""
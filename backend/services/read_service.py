@@ -0,0 +1,148 @@
+"""
+Read-side queries for list endpoints and candidate searches.
+Loading ORM instances costs an identity-map entry, attribute instrumentation
+and change tracking per row, only for the rows to be serialized and dropped.
+These queries select just the requested columns with Core statements and
+return SQLAlchemy Row tuples, which the session does not track; fields of a
+row are read by position or name (row.latitude). Write paths keep the ORM.
+"""
+
+from sqlalchemy import and_, column, func, select, table
+from backend.models import db, Ambulance, EmergencyCall, CLOSED_CALL_STATUSES
+from backend.utils.serialization import model_columns
+from backend.utils.spatial_index import bounding_box
+from backend.utils.waitlist import WAITLIST_FIELDS, wait_seconds
+
+# The R*Tree tables of backend.utils.spatial_index, for joins
+ambulance_rtree = table('ambulance_rtree', column('id'), column('min_lat'), column('max_lat'),
+                        column('min_lon'), column('max_lon'))
+call_rtree = table('call_rtree', column('id'), column('min_lat'), column('max_lat'),
+                   column('min_lon'), column('max_lon'))
+
+# Enough to rank dispatch candidates by distance
+POSITION_FIELDS = ('id', 'latitude', 'longitude', 'is_available')
+
+
+def _in_box(rtree, box):
+    return and_(
+        rtree.c.min_lat <= box['max_lat'], rtree.c.max_lat >= box['min_lat'],
+        rtree.c.min_lon <= box['max_lon'], rtree.c.max_lon >= box['min_lon']
+    )
+
+
+class ReadService:
+    def __init__(self, spatial_index=False):
+        """
+        Args:
+            spatial_index: Whether the database has the R*Tree index tables
+        """
+        self.spatial_index = spatial_index
+
+    def _rows(self, statement):
+        return db.session.execute(statement).all()
+
+    def active_calls(self, fields=EmergencyCall.SERIALIZED_FIELDS):
+        """Calls not yet closed, newest first"""
+        return self._rows(
+            select(*model_columns(EmergencyCall, fields))
+            .where(EmergencyCall.status.notin_(CLOSED_CALL_STATUSES))
+            .order_by(EmergencyCall.call_time.desc())
+        )
+
+    def active_calls_with_units(self, fields=EmergencyCall.SERIALIZED_FIELDS,
+                                unit_fields=Ambulance.SUMMARY_FIELDS):
+        """
+        Calls not yet closed, newest first, each row followed by the columns
+        of its assigned ambulance (all None when unassigned). One LEFT JOIN
+        instead of a query per assigned call.
+
+        Args:
+            fields: Tuple of EmergencyCall fields to select
+            unit_fields: Tuple of Ambulance fields to append, id first
+        """
+        return self._rows(
+            select(*model_columns(EmergencyCall, fields), *model_columns(Ambulance, unit_fields))
+            .outerjoin(Ambulance, EmergencyCall.assigned_ambulance_id == Ambulance.id)
+            .where(EmergencyCall.status.notin_(CLOSED_CALL_STATUSES))
+            .order_by(EmergencyCall.call_time.desc())
+        )
+
+    def active_calls_in_box(self, box, fields=EmergencyCall.SERIALIZED_FIELDS):
+        """
+        Calls not yet closed inside a bounding box.
+
+        Args:
+            box: Dict with min_lat, max_lat, min_lon and max_lon
+            fields: Tuple of EmergencyCall fields to select
+        """
+        statement = select(*model_columns(EmergencyCall, fields)).where(
+            EmergencyCall.status.notin_(CLOSED_CALL_STATUSES)
+        )
+        if self.spatial_index:
+            statement = statement.join(call_rtree, call_rtree.c.id == EmergencyCall.id).where(_in_box(call_rtree, box))
+        else:
+            statement = statement.where(
+                EmergencyCall.latitude.between(box['min_lat'], box['max_lat']),
+                EmergencyCall.longitude.between(box['min_lon'], box['max_lon'])
+            )
+        return self._rows(statement)
+
+    def calls_by_ids(self, ids, fields=EmergencyCall.SERIALIZED_FIELDS):
+        return self._rows(select(*model_columns(EmergencyCall, fields)).where(EmergencyCall.id.in_(ids)))
+
+    def ambulances(self, fields=Ambulance.SERIALIZED_FIELDS, available_only=False):
+        statement = select(*model_columns(Ambulance, fields))
+        if available_only:
+            statement = statement.where(Ambulance.is_available.is_(True))
+        return self._rows(statement)
+
+    def ambulances_by_ids(self, ids, fields=Ambulance.SERIALIZED_FIELDS):
+        return self._rows(select(*model_columns(Ambulance, fields)).where(Ambulance.id.in_(ids)))
+
+    def ambulances_in_radius(self, latitude, longitude, radius_km, available_only=True,
+                             fields=Ambulance.SERIALIZED_FIELDS):
+        """
+        Ambulances inside the bounding box of a radius around a point. Uses
+        the R*Tree index when the database has one; callers still need to
+        check the exact distance of each candidate.
+
+        Args:
+            latitude, longitude: Centre of the search
+            radius_km: Search radius
+            available_only: Skip ambulances already assigned
+            fields: Tuple of Ambulance fields to select
+        """
+        box = bounding_box(latitude, longitude, radius_km)
+        statement = select(*model_columns(Ambulance, fields))
+        if self.spatial_index:
+            statement = statement.join(ambulance_rtree, ambulance_rtree.c.id == Ambulance.id).where(
+                _in_box(ambulance_rtree, box))
+        else:
+            statement = statement.where(
+                Ambulance.latitude.between(box['min_lat'], box['max_lat']),
+                Ambulance.longitude.between(box['min_lon'], box['max_lon'])
+            )
+        if available_only:
+            statement = statement.where(Ambulance.is_available.is_(True))
+        return self._rows(statement)
+
+    def waitlist_head(self, limit):
+        """
+        The first calls of the dispatch waitlist, by queue key (indexed).
+
+        Returns:
+            Rows of WAITLIST_FIELDS
+        """
+        return self._rows(
+            select(*model_columns(EmergencyCall, WAITLIST_FIELDS))
+            .where(EmergencyCall.queue_key.isnot(None))
+            .order_by(EmergencyCall.queue_key)
+            .limit(limit)
+        )
+
+    def waitlist_stats(self):
+        """Tuple of (queued calls, seconds the oldest has waited)"""
+        count, oldest = db.session.execute(
+            select(func.count(), func.min(EmergencyCall.queued_time)).where(EmergencyCall.queue_key.isnot(None))
+        ).one()
+        return count, wait_seconds(oldest) if oldest else 0.0
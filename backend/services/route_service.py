@@ -0,0 +1,48 @@
+"""
+Route bundle service.
+Builds the offline route bundle for a dispatch and stores it next to the
+call, so the assignment payload can carry it to the ambulance app.
+"""
+
+import json
+from flask import current_app as app
+from backend.models import db, RouteBundle
+from backend.utils.route_bundle import build_route_bundle
+
+
+class RouteService:
+    def create_bundle(self, emergency_call, ambulance):
+        """
+        Build and stage the route bundle from the ambulance to the emergency.
+        The row is committed with the caller's assignment.
+
+        Returns:
+            The bundle dict
+        """
+        bundle = build_route_bundle(
+            (ambulance.latitude, ambulance.longitude),
+            (emergency_call.latitude, emergency_call.longitude),
+            router_url=app.config.get('ROUTING_URL') or None,
+            timeout=app.config.get('ROUTING_TIMEOUT_SECONDS', 3),
+            tolerance_m=app.config.get('ROUTE_BUNDLE_TOLERANCE_M', 5),
+            buffer_m=app.config.get('ROUTE_BUNDLE_BUFFER_M', 300),
+            checkpoint_spacing_m=app.config.get('ROUTE_BUNDLE_CHECKPOINT_M', 1000),
+            max_tiles=app.config.get('ROUTE_BUNDLE_MAX_TILES', 4000)
+        )
+
+        db.session.add(RouteBundle(
+            emergency_call_id=emergency_call.id,
+            ambulance_id=ambulance.id,
+            source=bundle['source'],
+            distance_m=bundle['distance_m'],
+            duration_s=bundle['duration_s'],
+            data=json.dumps(bundle, separators=(',', ':'))
+        ))
+        return bundle
+
+    def get_bundle(self, emergency_call_id):
+        """Latest route bundle of a call, or None"""
+        record = RouteBundle.query.filter_by(
+            emergency_call_id=emergency_call_id
+        ).order_by(RouteBundle.id.desc()).first()
+        return json.loads(record.data) if record else None
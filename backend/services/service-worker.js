@@ -3,15 +3,24 @@ const CACHE_NAME = 'ers-ambulance-app-v1';
 const OFFLINE_URL = '/frontend/ambulance_app/offline.html';
 const TILE_CACHE_NAME = 'map-tiles-cache';
 
+// Route corridor prefetch and tile cache limits
+const PREFETCH_ZOOMS = [13, 14, 15, 16, 17];
+const PREFETCH_CONCURRENCY = 6;
+const PREFETCH_BUFFER_METERS = 300;
+const PREFETCH_MAX_TILES = 4000;
+const OSM_PREFETCH_MAX_TILES = 250;
+const TILE_CACHE_MAX_ENTRIES = 20000;
+const TILE_QUOTA_HIGH_WATER = 0.8; // evict above this share of the storage quota...
+const TILE_QUOTA_LOW_WATER = 0.7; // ...down to this one
+const TILE_QUOTA_CHECK_EVERY = 100; // cache puts between quota checks
+const TILE_TOUCH_FLUSH_MS = 2000;
+const TILE_ASSUMED_BYTES = 20000;
+
 // Assets to cache for offline use
 const STATIC_ASSETS = [
-  '/frontend/ambulance_app/index.html',
-  '/frontend/ambulance_app/css/styles.css',
-  '/frontend/ambulance_app/js/app.js',
+  '/api/ambulance/app',
+  '/frontend/ambulance_app/offline-map.js',
   '/frontend/ambulance_app/offline.html',
-  '/frontend/ambulance_app/images/ambulance-marker.png',
-  '/frontend/ambulance_app/images/emergency-marker.png',
-  '/frontend/ambulance_app/images/offline-map.png',
   'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.7.1/leaflet.css',
   'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.7.1/leaflet.js',
   'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.7.1/images/marker-icon.png',
@@ -43,22 +52,313 @@ self.addEventListener('activate', event => {
           return caches.delete(name);
         })
       );
-    }).then(() => self.clients.claim())
+    })
+    .then(() => backfillTileUsage())
+    .then(() => self.clients.claim())
   );
 });
 
 // Helper to determine if a request is for a map tile
 function isMapTile(url) {
-  return url.includes('tile.openstreetmap.org');
+  return url.includes('tile.openstreetmap.org') || isRegionTile(url);
+}
+
+// Tiles from our own region pack (/api/tiles/{z}/{x}/{y}.{ext})
+function isRegionTile(url) {
+  return /\/api\/tiles\/\d+\/\d+\/\d+\.\w+$/.test(new URL(url).pathname);
+}
+
+// Cache key for a tile URL; OSM's a/b/c subdomains serve the same tiles
+function tileCacheKey(url) {
+  return url.replace(/^https:\/\/[abc]\.tile\.openstreetmap\.org\//, 'https://tile.openstreetmap.org/');
 }
 
 // Cache a copy of map tiles as they're requested
 async function cacheMapTile(request, response) {
+  const url = tileCacheKey(typeof request === 'string' ? request : request.url);
   const cache = await caches.open(TILE_CACHE_NAME);
-  cache.put(request, response.clone());
+  const size = response.type === 'opaque' ? 0 : (await response.clone().blob()).size;
+  await cache.put(url, response.clone());
+  touchTile(url, size);
   return response;
 }
 
+// Serve a tile from the cache, recording the hit for LRU eviction
+async function matchCachedTile(url) {
+  const key = tileCacheKey(url);
+  const cachedResponse = await caches.match(key, { cacheName: TILE_CACHE_NAME });
+  if (cachedResponse) touchTile(key);
+  return cachedResponse;
+}
+
+// Tile usage (last use and size per URL) lives in IndexedDB so the least
+// recently used tiles can be evicted. Touches are buffered and written in
+// one transaction, not one per tile drawn.
+const pendingTouches = new Map();
+let touchFlushTimer = null;
+let cachePutsSinceQuotaCheck = 0;
+
+function touchTile(url, size) {
+  const previous = pendingTouches.get(url);
+  pendingTouches.set(url, {
+    url: url,
+    lastUsed: Date.now(),
+    size: size !== undefined ? size : (previous ? previous.size : undefined)
+  });
+  if (size !== undefined && ++cachePutsSinceQuotaCheck >= TILE_QUOTA_CHECK_EVERY) {
+    cachePutsSinceQuotaCheck = 0;
+    flushTouches().then(enforceTileQuota);
+  } else if (!touchFlushTimer) {
+    touchFlushTimer = setTimeout(flushTouches, TILE_TOUCH_FLUSH_MS);
+  }
+}
+
+async function flushTouches() {
+  clearTimeout(touchFlushTimer);
+  touchFlushTimer = null;
+  if (!pendingTouches.size) return;
+  
+  const touches = Array.from(pendingTouches.values());
+  pendingTouches.clear();
+  try {
+    const db = await openOfflineDB();
+    const store = db.transaction('tile-usage', 'readwrite').objectStore('tile-usage');
+    await Promise.all(touches.map(async touch => {
+      if (touch.size === undefined) {
+        // A cache hit only moves lastUsed; keep the recorded size
+        const existing = await promisifyRequest(store.get(touch.url));
+        touch.size = existing ? existing.size : 0;
+      }
+      return promisifyRequest(store.put(touch));
+    }));
+  } catch (error) {
+    console.error('Error recording tile usage:', error);
+  }
+}
+
+// Tiles cached before usage tracking existed are recorded as least recently used
+async function backfillTileUsage() {
+  const cache = await caches.open(TILE_CACHE_NAME);
+  const requests = await cache.keys();
+  const db = await openOfflineDB();
+  const store = db.transaction('tile-usage', 'readwrite').objectStore('tile-usage');
+  const known = new Set(await promisifyRequest(store.getAllKeys()));
+  await Promise.all(requests
+    .filter(request => !known.has(request.url))
+    .map(request => promisifyRequest(store.put({ url: request.url, lastUsed: 0, size: 0 }))));
+}
+
+// Evict least recently used tiles once storage nears the quota or the tile
+// count passes its cap. Tiles of the active route corridor are kept.
+let evicting = false;
+
+async function enforceTileQuota() {
+  if (evicting) return 0;
+  evicting = true;
+  try {
+    const db = await openOfflineDB();
+    const count = await promisifyRequest(db.transaction('tile-usage').objectStore('tile-usage').count());
+    const excessTiles = Math.max(0, count - TILE_CACHE_MAX_ENTRIES);
+    
+    let bytesToFree = 0;
+    if (self.navigator.storage && self.navigator.storage.estimate) {
+      const { usage, quota } = await self.navigator.storage.estimate();
+      if (quota && usage > quota * TILE_QUOTA_HIGH_WATER) {
+        bytesToFree = usage - quota * TILE_QUOTA_LOW_WATER;
+      }
+    }
+    if (!excessTiles && !bytesToFree) return 0;
+    
+    // Oldest first along the lastUsed index
+    const victims = await new Promise((resolve, reject) => {
+      const found = [];
+      let freed = 0;
+      const request = db.transaction('tile-usage').objectStore('tile-usage').index('lastUsed').openCursor();
+      request.onsuccess = () => {
+        const cursor = request.result;
+        if (!cursor || (found.length >= excessTiles && freed >= bytesToFree)) {
+          resolve(found);
+          return;
+        }
+        if (!activeCorridor.has(cursor.value.url)) {
+          found.push(cursor.value.url);
+          // Opaque responses have no readable size; assume a typical tile
+          freed += cursor.value.size || TILE_ASSUMED_BYTES;
+        }
+        cursor.continue();
+      };
+      request.onerror = () => reject(request.error);
+    });
+    
+    const cache = await caches.open(TILE_CACHE_NAME);
+    await Promise.all(victims.map(url => cache.delete(url)));
+    const store = db.transaction('tile-usage', 'readwrite').objectStore('tile-usage');
+    await Promise.all(victims.map(url => promisifyRequest(store.delete(url))));
+    
+    console.log(`Evicted ${victims.length} map tiles`);
+    return victims.length;
+  } catch (error) {
+    console.error('Error evicting map tiles:', error);
+    return 0;
+  } finally {
+    evicting = false;
+  }
+}
+
+// Region tile pack manifest, if the server has one (null otherwise)
+async function getRegionManifest() {
+  try {
+    const response = await fetch('/api/tiles/manifest');
+    const data = await response.json();
+    return data.success ? data.manifest : null;
+  } catch (error) {
+    const cached = await caches.match('/api/tiles/manifest');
+    const data = cached ? await cached.json() : null;
+    return data && data.success ? data.manifest : null;
+  }
+}
+
+function latLngToTile(lat, lng, zoom) {
+  const n = Math.pow(2, zoom);
+  const latRad = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+  const x = Math.floor((lng + 180) / 360 * n);
+  const y = Math.floor((1 - Math.log(Math.tan(latRad) + 1 / Math.cos(latRad)) / Math.PI) / 2 * n);
+  return { x: Math.min(Math.max(x, 0), n - 1), y: Math.min(Math.max(y, 0), n - 1) };
+}
+
+// "z/x/y" keys of the tiles within bufferMeters of a route path at the prefetch
+// zooms. The path is sampled at half-tile steps and every tile around each
+// sample is taken. Route bundles carry the same keys precomputed by the server.
+function corridorTileKeys(path, bufferMeters) {
+  const keys = [];
+  const seen = new Set();
+  
+  for (const zoom of PREFETCH_ZOOMS) {
+    // A single point is treated as a zero-length segment
+    for (let i = 0; i < Math.max(1, path.length - 1); i++) {
+      const [lat1, lng1] = path[i];
+      const [lat2, lng2] = path[Math.min(i + 1, path.length - 1)];
+      const tileMeters = 40075016 * Math.cos(lat1 * Math.PI / 180) / Math.pow(2, zoom);
+      const segmentMeters = Math.hypot((lat2 - lat1) * 111320, (lng2 - lng1) * 111320 * Math.cos(lat1 * Math.PI / 180));
+      const steps = Math.max(1, Math.ceil(segmentMeters / (tileMeters / 2)));
+      
+      for (let step = 0; step <= steps; step++) {
+        const lat = lat1 + (lat2 - lat1) * step / steps;
+        const lng = lng1 + (lng2 - lng1) * step / steps;
+        const dLat = bufferMeters / 111320;
+        const dLng = bufferMeters / (111320 * Math.cos(lat * Math.PI / 180));
+        const nw = latLngToTile(lat + dLat, lng - dLng, zoom);
+        const se = latLngToTile(lat - dLat, lng + dLng, zoom);
+        
+        for (let x = nw.x; x <= se.x; x++) {
+          for (let y = nw.y; y <= se.y; y++) {
+            const key = `${zoom}/${x}/${y}`;
+            if (seen.has(key)) continue;
+            seen.add(key);
+            keys.push(key);
+          }
+        }
+      }
+    }
+  }
+  return keys;
+}
+
+// Tile URLs for "z/x/y" keys: the region pack where it covers the zoom, OSM elsewhere
+function tileKeyUrls(keys, manifest) {
+  const urls = [];
+  let osmTiles = 0;
+  
+  for (const key of keys) {
+    const [z, x, y] = key.split('/');
+    if (manifest && z >= manifest.minzoom && z <= manifest.maxzoom) {
+      urls.push(self.location.origin + manifest.tile_url.replace('{z}', z).replace('{x}', x).replace('{y}', y));
+    } else if (osmTiles < OSM_PREFETCH_MAX_TILES) {
+      // OSM's tile policy forbids bulk downloads; only top up a little
+      urls.push(`https://tile.openstreetmap.org/${key}.png`);
+      osmTiles++;
+    }
+  }
+  return urls.slice(0, PREFETCH_MAX_TILES);
+}
+
+// Prefetch the tiles along an assignment's route with bounded concurrency, then
+// report how much of the corridor is available offline to the dispatcher
+let activeCorridor = new Set();
+let currentPrefetch = null;
+
+async function prefetchCorridor(job) {
+  currentPrefetch = job;
+  const manifest = await getRegionManifest();
+  const keys = job.tiles || corridorTileKeys(job.path, job.buffer_meters || PREFETCH_BUFFER_METERS);
+  const urls = tileKeyUrls(keys, manifest);
+  activeCorridor = new Set(urls);
+  
+  const cache = await caches.open(TILE_CACHE_NAME);
+  const result = { total: urls.length, cached: 0, fetched: 0, failed: 0 };
+  let next = 0;
+  
+  const worker = async () => {
+    while (next < urls.length && currentPrefetch === job) {
+      const url = urls[next++];
+      if (await cache.match(url)) {
+        touchTile(url);
+        result.cached++;
+        continue;
+      }
+      try {
+        const response = await fetch(url);
+        if (response.ok) {
+          await cacheMapTile(url, response);
+          result.fetched++;
+        } else {
+          result.failed++;
+        }
+      } catch (error) {
+        result.failed++;
+      }
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(PREFETCH_CONCURRENCY, urls.length) }, worker));
+  
+  // A newer assignment took over; it reports for itself
+  if (currentPrefetch !== job) return;
+  
+  await flushTouches();
+  await enforceTileQuota();
+  await reportCoverage(job, result);
+}
+
+async function reportCoverage(job, result) {
+  const report = {
+    ambulance_id: job.ambulance_id,
+    emergency_call_id: job.emergency_call_id,
+    total: result.total,
+    cached: result.cached + result.fetched,
+    failed: result.failed
+  };
+  if (self.navigator.storage && self.navigator.storage.estimate) {
+    const { usage, quota } = await self.navigator.storage.estimate();
+    report.usage = usage;
+    report.quota = quota;
+  }
+  
+  const clients = await self.clients.matchAll();
+  for (const client of clients) {
+    client.postMessage({ type: 'tile-coverage', ...report });
+  }
+  
+  try {
+    await fetch('/api/ambulance/tile-coverage', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(report)
+    });
+  } catch (error) {
+    console.warn('Could not report tile coverage:', error);
+  }
+}
+
 // Fetch event - serve cached content when offline
 self.addEventListener('fetch', event => {
   // Skip cross-origin requests
@@ -67,13 +367,23 @@ self.addEventListener('fetch', event => {
     return;
   }
 
+  // Region pack tiles only change with a new pack: serve from cache first
+  if (isRegionTile(event.request.url)) {
+    event.respondWith(
+      matchCachedTile(event.request.url)
+        .then(cachedResponse => cachedResponse || fetch(event.request)
+          .then(response => response.ok ? cacheMapTile(event.request, response) : response))
+    );
+    return;
+  }
+
   // Special handling for map tiles
   if (isMapTile(event.request.url)) {
     event.respondWith(
       fetch(event.request)
         .then(response => cacheMapTile(event.request, response))
         .catch(() => {
-          return caches.match(event.request);
+          return matchCachedTile(event.request.url);
         })
     );
     return;
@@ -193,12 +503,12 @@ async function storeRequestForSync(request) {
   const tx = db.transaction('outbox', 'readwrite');
   const store = tx.objectStore('outbox');
   
-  await store.add({
+  await promisifyRequest(store.add({
     url: request.url,
     method: request.method,
     data: requestData,
     timestamp: Date.now()
-  });
+  }));
   
   // Request background sync if supported
   if ('SyncManager' in self) {
@@ -209,7 +519,7 @@ async function storeRequestForSync(request) {
 // Open the offline database
 function openOfflineDB() {
   return new Promise((resolve, reject) => {
-    const request = indexedDB.open('ers-offline-db', 1);
+    const request = indexedDB.open('ers-offline-db', 2);
     
     request.onerror = event => {
       reject('IndexedDB error');
@@ -236,6 +546,12 @@ function openOfflineDB() {
       if (!db.objectStoreNames.contains('location-updates')) {
         db.createObjectStore('location-updates', { keyPath: 'timestamp' });
       }
+      
+      // Create store for map tile usage (LRU eviction)
+      if (!db.objectStoreNames.contains('tile-usage')) {
+        const tileUsage = db.createObjectStore('tile-usage', { keyPath: 'url' });
+        tileUsage.createIndex('lastUsed', 'lastUsed');
+      }
     };
   });
 }
@@ -247,15 +563,76 @@ self.addEventListener('sync', event => {
   }
 });
 
+// Resolve an IndexedDB request as a promise
+function promisifyRequest(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+// Delete synced entries from the outbox
+async function deleteFromOutbox(db, timestamps) {
+  const tx = db.transaction('outbox', 'readwrite');
+  const store = tx.objectStore('outbox');
+  await Promise.all(timestamps.map(timestamp => promisifyRequest(store.delete(timestamp))));
+}
+
+// Queued positions are replayed as one batched request instead of one POST each.
+// The idempotency key is derived from the entries, so a retry after a lost
+// response is not applied twice.
+const LOCATION_BATCH_SIZE = 500;
+
+async function syncLocationUpdates(db, entries) {
+  let synced = 0;
+  for (let i = 0; i < entries.length; i += LOCATION_BATCH_SIZE) {
+    const batch = entries.slice(i, i + LOCATION_BATCH_SIZE);
+    const first = batch[0].timestamp;
+    const last = batch[batch.length - 1].timestamp;
+    
+    try {
+      const response = await fetch('/api/ambulance/update-locations', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': `outbox-${first}-${last}-${batch.length}`
+        },
+        body: JSON.stringify(batch.map(entry => ({
+          ambulance_id: entry.data.ambulance_id,
+          lat: entry.data.latitude,
+          lon: entry.data.longitude,
+          ts: entry.timestamp
+        })))
+      });
+      
+      // Keep the batch for the next sync attempt unless the server took it
+      if (!response.ok) {
+        console.error('Error syncing location batch:', response.status);
+        continue;
+      }
+      
+      await deleteFromOutbox(db, batch.map(entry => entry.timestamp));
+      synced += batch.length;
+    } catch (error) {
+      console.error('Error syncing location batch:', error);
+    }
+  }
+  return synced;
+}
+
 // Sync the outbox store
 async function syncOutbox() {
   try {
     const db = await openOfflineDB();
     const tx = db.transaction('outbox', 'readonly');
     const store = tx.objectStore('outbox');
-    const requests = await store.getAll();
+    const requests = await promisifyRequest(store.getAll());
+    
+    const locationUpdates = requests.filter(request => new URL(request.url).pathname === '/api/ambulance/update-location');
+    const otherRequests = requests.filter(request => !locationUpdates.includes(request));
+    let count = await syncLocationUpdates(db, locationUpdates);
     
-    for (const request of requests) {
+    for (const request of otherRequests) {
       try {
         await fetch(request.url, {
           method: request.method,
@@ -266,9 +643,8 @@ async function syncOutbox() {
         });
         
         // If successful, delete from outbox
-        const deleteTx = db.transaction('outbox', 'readwrite');
-        const deleteStore = deleteTx.objectStore('outbox');
-        await deleteStore.delete(request.timestamp);
+        await deleteFromOutbox(db, [request.timestamp]);
+        count++;
       } catch (error) {
         console.error('Error syncing request:', error);
         // Keep in outbox for next sync attempt
@@ -280,7 +656,7 @@ async function syncOutbox() {
     for (const client of clients) {
       client.postMessage({
         type: 'sync-complete',
-        count: requests.length
+        count: count
       });
     }
   } catch (error) {
@@ -290,6 +666,11 @@ async function syncOutbox() {
 
 // Cache current emergency assignment
 self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'prefetch-corridor') {
+    event.waitUntil(prefetchCorridor(event.data));
+    return;
+  }
+  
   if (event.data && event.data.type === 'cache-emergency') {
     caches.open(CACHE_NAME)
       .then(cache => {
@@ -8,14 +8,18 @@ import string
 import re
 from datetime import datetime, timedelta
 from flask import current_app as app
+from sqlalchemy.orm import joinedload
 from backend.models import db, EmergencyCall
+from backend.services import get_service
 from backend.services.sms_service import SMSService
 from backend.services.location_service import LocationService
+from backend.utils.assignment_notifier import publish_assignment_update
+from backend.utils.tracing import dispatch_trace, span
 
 class SMSLocationService:
-    def __init__(self):
-        self.sms_service = SMSService()
-        self.location_service = LocationService()
+    def __init__(self, sms_service=None, location_service=None):
+        self.sms_service = sms_service or SMSService()
+        self.location_service = location_service or LocationService()
     
     def generate_location_code(self):
         """Generate a unique random code for SMS location sharing"""
@@ -80,23 +84,32 @@ class SMSLocationService:
         Returns:
             Dict with processing results
         """
+        with dispatch_trace('sms_location') as trace:
+            result = self._process_location_sms(from_number, message_body)
+            trace.attributes.setdefault('call_id', result.get("emergency_call_id"))
+            if not result["success"]:
+                trace.attributes['outcome'] = result["error"]
+            return result
+    
+    def _process_location_sms(self, from_number, message_body):
         # Look for location code in the message
         location_code = self.extract_location_code(message_body)
         
-        if location_code:
-            # Find emergency call by location code
-            emergency_call = EmergencyCall.query.filter_by(
-                sms_location_code=location_code
-            ).filter(
-                EmergencyCall.status.in_(['initiated', 'location_requested'])
-            ).first()
-        else:
-            # If no code found, try to find by phone number (most recent call)
-            emergency_call = EmergencyCall.query.filter_by(
-                caller_phone=from_number
-            ).filter(
-                EmergencyCall.status.in_(['initiated', 'location_requested'])
-            ).order_by(EmergencyCall.call_time.desc()).first()
+        with span('call_lookup'):
+            if location_code:
+                # Find emergency call by location code
+                emergency_call = EmergencyCall.query.filter_by(
+                    sms_location_code=location_code
+                ).filter(
+                    EmergencyCall.status.in_(['initiated', 'location_requested'])
+                ).first()
+            else:
+                # If no code found, try to find by phone number (most recent call)
+                emergency_call = EmergencyCall.query.filter_by(
+                    caller_phone=from_number
+                ).filter(
+                    EmergencyCall.status.in_(['initiated', 'location_requested'])
+                ).order_by(EmergencyCall.call_time.desc()).first()
         
         if not emergency_call:
             app.logger.warning(f"Received location SMS but no matching emergency call found: {from_number}")
@@ -108,7 +121,8 @@ class SMSLocationService:
             return {"success": False, "error": "Location code expired"}
         
         # Extract coordinates using various methods
-        location_data = self.extract_location_from_sms(message_body)
+        with span('parse_location'):
+            location_data = self.extract_location_from_sms(message_body)
         
         if location_data["success"]:
             # Update emergency call with location data
@@ -127,11 +141,13 @@ class SMSLocationService:
             if address:
                 emergency_call.address = address
             
-            db.session.commit()
+            with span('commit'):
+                db.session.commit()
             
             # Send confirmation SMS
             confirmation_text = "Thank you. Your location has been received. Emergency services have been dispatched to your location. Stay where you are if possible."
-            self.sms_service.send_sms(from_number, confirmation_text)
+            with span('sms_confirmation'):
+                self.sms_service.send_sms(from_number, confirmation_text)
             
             return {
                 "success": True,
@@ -284,19 +300,18 @@ class SMSLocationService:
                 caller_phone=from_number
             ).filter(
                 EmergencyCall.status.in_(['initiated', 'location_shared', 'assigned'])
+            ).options(
+                joinedload(EmergencyCall.assigned_ambulance)
             ).order_by(EmergencyCall.call_time.desc()).first()
             
             if emergency_call:
                 if emergency_call.status == 'assigned' and emergency_call.assigned_ambulance_id:
-                    # Get ambulance info
-                    from backend.models import Ambulance
-                    ambulance = Ambulance.query.get(emergency_call.assigned_ambulance_id)
+                    # Loaded with the call
+                    ambulance = emergency_call.assigned_ambulance
                     
                     if ambulance:
                         # Calculate ETA
-                        from backend.services.ambulance_service import AmbulanceService
-                        ambulance_service = AmbulanceService()
-                        eta_minutes = ambulance_service.calculate_eta(emergency_call.id)
+                        eta_minutes = get_service('ambulance').calculate_eta(emergency_call.id)
                         
                         status_text = f"Ambulance {ambulance.ambulance_id} is on the way. " \
                                     f"Driver: {ambulance.driver_name}. " \
@@ -319,21 +334,26 @@ class SMSLocationService:
                 caller_phone=from_number
             ).filter(
                 EmergencyCall.status.in_(['initiated', 'location_shared', 'assigned'])
+            ).options(
+                joinedload(EmergencyCall.assigned_ambulance)
             ).order_by(EmergencyCall.call_time.desc()).first()
             
             if emergency_call:
                 # Add cancellation logic here
                 emergency_call.status = 'cancelled'
                 emergency_call.completion_time = datetime.utcnow()
-                db.session.commit()
+                emergency_call.queued_time = None
+                emergency_call.queue_key = None
                 
                 # If ambulance was assigned, make it available again
-                if emergency_call.assigned_ambulance_id:
-                    from backend.models import Ambulance
-                    ambulance = Ambulance.query.get(emergency_call.assigned_ambulance_id)
-                    if ambulance:
-                        ambulance.is_available = True
-                        db.session.commit()
+                ambulance = get_service('ambulance').release_ambulance(emergency_call)
+                db.session.commit()
+                
+                publish_assignment_update(emergency_call.id, emergency_call.assigned_ambulance_id, cancelled=True)
+                
+                # The freed unit goes straight to a queued call, if any
+                if ambulance:
+                    get_service('ambulance').dispatch_waitlist(ambulance)
                 
                 self.sms_service.send_sms(from_number, "Your emergency request has been cancelled.")
             else:
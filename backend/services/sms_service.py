@@ -1,12 +1,24 @@
-from twilio.rest import Client
 from flask import current_app as app
+from backend.utils.metrics import track_dependency
+from backend.utils.tracing import span
 
 class SMSService:
     def __init__(self):
         self.account_sid = app.config['TWILIO_ACCOUNT_SID']
         self.auth_token = app.config['TWILIO_AUTH_TOKEN']
         self.twilio_phone = app.config['TWILIO_PHONE_NUMBER']
-        self.client = Client(self.account_sid, self.auth_token)
+        self.api_url = app.config.get('TWILIO_API_URL')
+        self._client = None
+    
+    @property
+    def client(self):
+        """Twilio client, built on the first send so the app boots without credentials"""
+        if self._client is None:
+            if not (self.account_sid and self.auth_token):
+                raise RuntimeError("Twilio credentials are not configured")
+            from backend.services.twilio_client import create_twilio_client
+            self._client = create_twilio_client(self.account_sid, self.auth_token, self.api_url)
+        return self._client
     
     def send_location_share_link(self, to_phone, location_link):
         """Send location sharing link to the victim"""
@@ -34,29 +46,28 @@ class SMSService:
         )
         return self._send_sms(victim_phone, message)
     
+    def send_sms(self, to_phone, message):
+        """Send a free-form SMS, e.g. replies of the SMS location protocol"""
+        return self._send_sms(to_phone, message)
+    
     def _send_sms(self, to_phone, message):
         """Private method to send SMS using Twilio"""
+        if not app.config.get('SMS_ENABLED', True):
+            app.logger.info(f"SMS disabled, not sending to {to_phone}: {message}")
+            return {"success": False, "error": "SMS sending is disabled"}
+        
         try:
             # Make sure phone number starts with "+"
             if not to_phone.startswith('+'):
                 to_phone = '+' + to_phone
                 
-            message = self.client.messages.create(
-                body=message,
-                from_=self.twilio_phone,
-                to=to_phone
-            )
+            with span('twilio'), track_dependency('twilio'):
+                message = self.client.messages.create(
+                    body=message,
+                    from_=self.twilio_phone,
+                    to=to_phone
+                )
             return {"success": True, "message_sid": message.sid}
         except Exception as e:
             app.logger.error(f"Error sending SMS: {str(e)}")
             return {"success": False, "error": str(e)}
-        
-
-        # Add this method to the SMSService class
-def send_location_share_link(self, to_phone, location_share_url):
-    """Send location sharing link to the victim"""
-    message = (
-        f"Emergency Response: Please click on this link to share your exact location: "
-        f"{location_share_url}"
-    )
-    return self._send_sms(to_phone, message)
\ No newline at end of file
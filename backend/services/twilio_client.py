@@ -0,0 +1,36 @@
+"""
+Twilio REST client construction.
+Kept apart from sms_service so twilio, which is slow to import, is only
+loaded when the first SMS is sent.
+"""
+
+from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+
+TWILIO_API_BASE = 'https://api.twilio.com'
+
+class RedirectedHttpClient(TwilioHttpClient):
+    """Twilio HTTP client that sends API requests to another base URL"""
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+    
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(TWILIO_API_BASE):
+            url = self.base_url + url[len(TWILIO_API_BASE):]
+        return super().request(method, url, *args, **kwargs)
+
+def create_twilio_client(account_sid, auth_token, api_url=None):
+    """
+    Build a Twilio REST client.
+    
+    Args:
+        account_sid: Twilio account SID
+        auth_token: Twilio auth token
+        api_url: Base URL replacing https://api.twilio.com, e.g. a local fake
+    
+    Returns:
+        twilio.rest.Client
+    """
+    http_client = RedirectedHttpClient(api_url) if api_url else None
+    return Client(account_sid, auth_token, http_client=http_client)
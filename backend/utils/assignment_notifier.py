@@ -0,0 +1,157 @@
+"""
+Assignment change notifications for ambulance apps.
+Every assignment change bumps a per-ambulance version and wakes long-poll
+requests waiting on that unit, so drivers learn about a dispatch as soon as it
+is committed rather than on their next poll. Connected apps also get an
+`assignment_update` event in their ambulance room. Shared by the SQLAlchemy
+backend and simple_app.py.
+
+Waiters sleep on events of the Socket.IO async mode (eventlet, gevent or
+threading), so a held request does not stall the server when the standard
+library is not monkey-patched. When the app sets
+app.extensions['assignment_versions'] to a function returning a new DB-API
+connection, versions are kept in the assignment_versions table, so every
+worker process numbers them alike. Only when
+app.extensions['assignment_recheck'] is set (the app runs several processes
+behind a message queue) do waiters also re-read the table every
+RECHECK_SECONDS to see changes made by other workers; a single process wakes
+them directly and never polls. Otherwise versions live in process memory.
+"""
+
+import threading
+import time
+from flask import current_app
+from backend.utils.rooms import rooms_for
+
+ASSIGNMENT_VERSIONS_SQL = (
+    'CREATE TABLE IF NOT EXISTS assignment_versions ('
+    'ambulance_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)'
+)
+BUMP_VERSION_SQL = (
+    'INSERT INTO assignment_versions (ambulance_id, version) VALUES (?, 1) '
+    'ON CONFLICT (ambulance_id) DO UPDATE SET version = version + 1'
+)
+VERSION_SQL = 'SELECT version FROM assignment_versions WHERE ambulance_id = ?'
+
+# How often a waiter looks for changes made by other worker processes
+RECHECK_SECONDS = 1.0
+
+
+class AssignmentNotifier:
+    def __init__(self):
+        # Never held across a wait, so it cannot stall other green threads
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._waiters = {}
+        self.waiting = 0
+
+    def _connect(self):
+        connect = current_app.extensions.get('assignment_versions')
+        return connect() if connect else None
+
+    def _create_event(self):
+        socketio = current_app.extensions.get('socketio')
+        if socketio is not None and getattr(socketio, 'server', None) is not None:
+            return socketio.server.eio.create_event()
+        return threading.Event()
+
+    def version(self, ambulance_pk):
+        conn = self._connect()
+        if conn is None:
+            with self._lock:
+                return self._versions.get(ambulance_pk, 0)
+        try:
+            row = conn.execute(VERSION_SQL, (ambulance_pk,)).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    def notify(self, ambulance_pk):
+        """
+        Record that the assignment of an ambulance changed and wake its waiters.
+
+        Returns:
+            The new version number
+        """
+        conn = self._connect()
+        if conn is None:
+            with self._lock:
+                version = self._versions[ambulance_pk] = self._versions.get(ambulance_pk, 0) + 1
+        else:
+            try:
+                conn.execute(BUMP_VERSION_SQL, (ambulance_pk,))
+                version = conn.execute(VERSION_SQL, (ambulance_pk,)).fetchone()[0]
+                conn.commit()
+            finally:
+                conn.close()
+
+        with self._lock:
+            for event in self._waiters.get(ambulance_pk, ()):
+                event.set()
+        return version
+
+    def wait(self, ambulance_pk, since, timeout):
+        """
+        Wait until the version of an ambulance differs from `since` or the
+        timeout passes.
+
+        Args:
+            ambulance_pk: Primary key of the ambulance
+            since: Version the client already has
+            timeout: Maximum seconds to wait
+
+        Returns:
+            Tuple of (current version, whether it changed)
+        """
+        deadline = time.monotonic() + timeout
+        recheck = (current_app.extensions.get('assignment_versions') is not None
+                   and current_app.extensions.get('assignment_recheck'))
+        event = self._create_event()
+        # Registered before the first read, so a change in between still wakes it
+        with self._lock:
+            self._waiters.setdefault(ambulance_pk, set()).add(event)
+            self.waiting += 1
+        try:
+            while True:
+                version = self.version(ambulance_pk)
+                remaining = deadline - time.monotonic()
+                if version != since or remaining <= 0:
+                    return version, version != since
+                event.wait(min(remaining, RECHECK_SECONDS) if recheck else remaining)
+                event.clear()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                waiters = self._waiters[ambulance_pk]
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[ambulance_pk]
+
+
+# Shared by every request handler in this process
+assignment_notifier = AssignmentNotifier()
+
+
+def publish_assignment_update(call_id, ambulance_pk, socketio=None, **extra):
+    """
+    Wake long-poll waiters of an ambulance and push `assignment_update` to the
+    dispatchers, the ambulance and the caller. Call after the change is committed.
+
+    Args:
+        call_id: Emergency call whose assignment changed
+        ambulance_pk: Primary key of the ambulance involved, if any
+        socketio: Flask-SocketIO instance (defaults to the current app's)
+        **extra: Additional fields for the event payload (e.g. completed=True)
+
+    Returns:
+        The event payload that was sent
+    """
+    payload = {'emergency_call_id': call_id, 'ambulance_id': ambulance_pk, **extra}
+    if ambulance_pk:
+        payload['version'] = assignment_notifier.notify(ambulance_pk)
+
+    socketio = socketio or current_app.extensions.get('socketio')
+    if socketio:
+        socketio.emit('assignment_update', payload, to=rooms_for(call_id=call_id, ambulance_pk=ambulance_pk))
+
+    return payload
@@ -0,0 +1,82 @@
+"""
+Progressive location fixes from the caller's share page.
+The page submits a coarse network fix as soon as it has one, so dispatch can
+start, and then streams more accurate GPS fixes as they arrive. Every fix is
+tagged with its accuracy radius; a call keeps the most accurate fix it has
+seen, and only a fix that moves the caller far enough re-runs dispatch.
+Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+from backend.utils.distance import haversine_distance
+
+INITIAL = 'initial'  # first fix of the call: dispatch as usual
+REFINED = 'refined'  # more accurate fix close to the last one: update the unit
+MOVED = 'moved'      # more accurate fix far from the last one: dispatch again
+IGNORED = 'ignored'  # no better than the fix already stored
+
+PHASES = ('coarse', 'fine')
+
+
+def parse_location_fix(data):
+    """
+    Validate a location submission.
+
+    Args:
+        data: Dict with latitude, longitude and optionally accuracy (metres,
+            as reported by the Geolocation API) and phase (coarse or fine)
+
+    Returns:
+        Dict with latitude, longitude, accuracy (None when not given) and phase
+
+    Raises:
+        ValueError: If a field is malformed
+    """
+    try:
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("latitude and longitude must be numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("latitude/longitude out of range")
+
+    accuracy = data.get('accuracy')
+    if accuracy is not None:
+        try:
+            accuracy = float(accuracy)
+        except (TypeError, ValueError):
+            raise ValueError("accuracy must be a number of metres")
+        if not accuracy > 0:
+            raise ValueError("accuracy must be positive")
+
+    phase = data.get('phase')
+    if phase is not None and phase not in PHASES:
+        raise ValueError(f"phase must be one of {', '.join(PHASES)}")
+
+    return {'latitude': latitude, 'longitude': longitude, 'accuracy': accuracy, 'phase': phase}
+
+
+def classify_fix(latitude, longitude, accuracy, fix, redispatch_distance_m):
+    """
+    Decide what a new fix means for a call.
+
+    Args:
+        latitude, longitude: Position stored on the call (None before the first fix)
+        accuracy: Accuracy of the stored position in metres (None if unknown)
+        fix: Parsed fix from parse_location_fix
+        redispatch_distance_m: Distance from the stored position beyond which
+            a better fix counts as a move
+
+    Returns:
+        Tuple of (outcome, metres between the stored position and the fix)
+    """
+    if latitude is None or longitude is None:
+        return INITIAL, None
+
+    moved_m = haversine_distance(latitude, longitude, fix['latitude'], fix['longitude']) * 1000
+
+    # Fixes without an accuracy (older pages, manual entry) always replace
+    # one without; they never replace a fix whose accuracy is known
+    if accuracy is not None and (fix['accuracy'] is None or fix['accuracy'] >= accuracy):
+        return IGNORED, moved_m
+
+    return (MOVED if moved_m >= redispatch_distance_m else REFINED), moved_m
@@ -0,0 +1,149 @@
+"""
+Versioned change feed for ambulances and emergency calls.
+Triggers append a row to change_log on every insert, update and delete, so the
+log's autoincrement sequence is a monotonic version of both tables no matter
+which write path touched them. Clients pass the last sequence they saw and get
+back only the rows that changed since. The log prunes itself from a trigger
+too, so it stays bounded whether or not anyone reads it and the read path
+never writes. Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+import sqlite3
+
+CALL = 'call'
+AMBULANCE = 'ambulance'
+
+
+def _change_triggers(table, entity):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_change_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('{entity}', NEW.id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_change_update AFTER UPDATE ON {table}
+        BEGIN
+            INSERT INTO change_log (entity, entity_id) VALUES ('{entity}', NEW.id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_change_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO change_log (entity, entity_id, deleted) VALUES ('{entity}', OLD.id, 1);
+        END""",
+    ]
+
+
+CHANGE_FEED_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0
+    )""",
+    *_change_triggers('ambulances', AMBULANCE),
+    *_change_triggers('emergency_calls', CALL),
+]
+
+# Gives rows written before the log existed a version, so clients of a seeded
+# database get a non-zero sequence to sync from
+CHANGE_FEED_BACKFILL = [
+    f"INSERT INTO change_log (entity, entity_id) SELECT '{AMBULANCE}', id FROM ambulances",
+    f"INSERT INTO change_log (entity, entity_id) SELECT '{CALL}', id FROM emergency_calls",
+]
+
+# Every `keep` inserts, drop the rows older than the newest `keep`: the log
+# holds between `keep` and twice that many rows. Recreated at startup, so a
+# changed retention applies to existing databases.
+_PRUNE_TRIGGER = """CREATE TRIGGER change_log_prune AFTER INSERT ON change_log
+        WHEN NEW.seq % {keep} = 0
+        BEGIN
+            DELETE FROM change_log WHERE seq <= NEW.seq - {keep};
+        END"""
+
+# SQLite returns the other columns from the row holding MAX(seq)
+_LATEST_CHANGES_SQL = """
+    SELECT entity, entity_id, deleted, MAX(seq) FROM change_log
+    WHERE seq > ? AND seq <= ?
+    GROUP BY entity, entity_id
+"""
+
+
+def ensure_change_feed(conn, keep=10000):
+    """
+    Create the change log and its triggers if they do not exist yet.
+
+    Args:
+        conn: DB-API connection to the SQLite database
+        keep: Change log rows retained; clients older than that get a reset
+            (0 keeps everything)
+
+    Returns:
+        True if the change feed is available
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")
+        is_new = cursor.fetchone() is None
+
+        for statement in CHANGE_FEED_SCHEMA:
+            cursor.execute(statement)
+
+        if is_new:
+            for statement in CHANGE_FEED_BACKFILL:
+                cursor.execute(statement)
+
+        cursor.execute("DROP TRIGGER IF EXISTS change_log_prune")
+        if keep > 0:
+            cursor.execute(_PRUNE_TRIGGER.format(keep=int(keep)))
+
+        conn.commit()
+        return True
+    except sqlite3.OperationalError:
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+
+def read_changes(conn, since, max_changes=5000):
+    """
+    Read what changed after sequence number `since`.
+
+    Args:
+        conn: DB-API connection to the SQLite database
+        since: Last sequence number the client has seen (0 for none)
+        max_changes: Above this many changed rows a full reload is cheaper
+
+    Returns:
+        Dict with the new sequence number, a reset flag telling the client to
+        drop its state and reload, and per-entity sets of changed and deleted ids
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MIN(seq), MAX(seq) FROM change_log")
+        oldest, current = cursor.fetchone()
+        current = current or 0
+
+        result = {
+            'seq': current,
+            'reset': False,
+            'changed': {CALL: set(), AMBULANCE: set()},
+            'deleted': {CALL: set(), AMBULANCE: set()}
+        }
+
+        # Unknown client state, a pruned gap, or a sequence from another database
+        if since <= 0 or since > current or (oldest is not None and since < oldest - 1):
+            result['reset'] = True
+            return result
+
+        cursor.execute(_LATEST_CHANGES_SQL, (since, current))
+        rows = cursor.fetchall()
+        if len(rows) > max_changes:
+            result['reset'] = True
+            return result
+
+        for entity, entity_id, deleted, _ in rows:
+            if entity in result['changed']:
+                (result['deleted'] if deleted else result['changed'])[entity].add(entity_id)
+
+        return result
+    finally:
+        cursor.close()
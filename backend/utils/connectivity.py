@@ -0,0 +1,86 @@
+"""
+Caller connectivity probing.
+The share page times a tiny ping and, when that comes back, a download of a
+fixed-size incompressible payload. The server turns the measured latency and
+throughput into a connectivity status for the call, so dispatch can move a
+caller on a poor link to the SMS protocol before the web flow stalls. Shared
+by the SQLAlchemy backend and simple_app.py.
+"""
+
+import os
+
+ONLINE = 'online'
+LOW_BANDWIDTH = 'low_bandwidth'
+VERY_LOW_BANDWIDTH = 'very_low_bandwidth'
+OFFLINE = 'offline'
+UNKNOWN = 'unknown'
+
+# (status, max round trip in ms, min throughput in kbit/s), best first
+THRESHOLDS = (
+    (ONLINE, 500, 256),
+    (LOW_BANDWIDTH, 2000, 32)
+)
+
+MAX_PROBE_BYTES = 256 * 1024
+
+# Random bytes can't be compressed on the way, so the transfer time is honest
+_PROBE_PAYLOAD = os.urandom(MAX_PROBE_BYTES)
+
+
+def probe_payload(size, limit=MAX_PROBE_BYTES):
+    """
+    Get the body of a throughput probe.
+
+    Args:
+        size: Requested number of bytes
+        limit: Largest probe served
+
+    Returns:
+        Bytes of length min(size, limit)
+    """
+    return _PROBE_PAYLOAD[:max(0, min(size, limit, MAX_PROBE_BYTES))]
+
+
+def classify_connection(latency_ms, bandwidth_kbps=None):
+    """
+    Classify a caller's link.
+
+    Args:
+        latency_ms: Round trip of the ping in milliseconds
+        bandwidth_kbps: Measured download throughput, if the probe ran
+
+    Returns:
+        online, low_bandwidth or very_low_bandwidth
+    """
+    for status, max_latency_ms, min_kbps in THRESHOLDS:
+        if latency_ms < max_latency_ms and (bandwidth_kbps is None or bandwidth_kbps >= min_kbps):
+            return status
+    return VERY_LOW_BANDWIDTH
+
+
+def parse_connectivity_report(data):
+    """
+    Validate a connectivity report from the share page.
+
+    Args:
+        data: Dict with latency_ms and optionally bandwidth_kbps
+
+    Returns:
+        Dict with latency_ms, bandwidth_kbps (None if not measured) and the
+        derived connectivity_status
+
+    Raises:
+        ValueError: If a measurement is missing or malformed
+    """
+    report = {}
+    for field in ('latency_ms', 'bandwidth_kbps'):
+        value = data.get(field)
+        if value is None and field == 'bandwidth_kbps':
+            report[field] = None
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{field} must be a non-negative number")
+        report[field] = round(float(value), 1)
+
+    report['connectivity_status'] = classify_connection(report['latency_ms'], report['bandwidth_kbps'])
+    return report
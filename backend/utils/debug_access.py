@@ -0,0 +1,28 @@
+"""
+Access check for debug endpoints.
+Debug endpoints expose internals (dispatch traces, profiles, memory), so they
+are off unless a token is configured, and then only answer requests that
+present it in the X-Debug-Token header. Shared by the SQLAlchemy backend and
+simple_app.py.
+"""
+
+import hmac
+
+DEBUG_TOKEN_HEADER = 'X-Debug-Token'
+
+
+def debug_access_allowed(expected_token, headers):
+    """
+    Check a request's debug token.
+
+    Args:
+        expected_token: Configured token; empty or None disables debug endpoints
+        headers: Request headers
+
+    Returns:
+        True if the request may use debug endpoints
+    """
+    if not expected_token:
+        return False
+    provided = headers.get(DEBUG_TOKEN_HEADER, '')
+    return hmac.compare_digest(provided.encode(), expected_token.encode())
@@ -4,7 +4,6 @@ Provides functions to calculate distances between coordinates and estimate trave
 """
 
 import math
-from geopy.distance import geodesic
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -42,6 +41,7 @@ def geodesic_distance(lat1, lon1, lat2, lon2):
     Returns:
         Distance in kilometers
     """
+    from geopy.distance import geodesic  # slow to import; only needed here
     return geodesic((lat1, lon1), (lat2, lon2)).kilometers
 
 def estimate_travel_time(distance_km, avg_speed_kmh=40):
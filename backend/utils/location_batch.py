@@ -0,0 +1,163 @@
+"""
+Validation and ordering of batched ambulance location updates.
+Used by the batched update-locations endpoint of both the SQLAlchemy backend
+and simple_app.py: items are normalised, grouped per ambulance and replayed in
+(timestamp, sequence) order, and any point that is not newer than the last
+applied one is reported as stale instead of moving the ambulance backwards.
+Points stamped further ahead than MAX_CLOCK_SKEW are rejected, as one would
+otherwise become the watermark and mark every later real point stale.
+"""
+
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+
+# How far ahead of the server clock a device timestamp may be
+MAX_CLOCK_SKEW = timedelta(seconds=30)
+
+APPLIED = 'applied'
+STALE = 'stale'
+INVALID = 'invalid'
+UNKNOWN_AMBULANCE = 'unknown_ambulance'
+
+
+def _first(item, *keys):
+    for key in keys:
+        if item.get(key) is not None:
+            return item[key]
+    return None
+
+
+def parse_timestamp(value):
+    """
+    Parse an item timestamp: epoch milliseconds or an ISO 8601 string.
+
+    Returns:
+        Naive UTC datetime, or None if no timestamp was given
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("ts must be epoch milliseconds or an ISO 8601 string")
+    if isinstance(value, (int, float)):
+        return EPOCH + timedelta(milliseconds=value)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def normalize_item(item, default_time):
+    """
+    Validate one batch item.
+
+    Args:
+        item: Dict with ambulance_id, lat/latitude, lon/lng/longitude and
+            optional ts and seq
+        default_time: Timestamp used when the item has none
+
+    Returns:
+        Dict with ambulance_id, latitude, longitude, timestamp and seq
+
+    Raises:
+        ValueError: If the item is malformed
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+
+    ambulance_id = item.get('ambulance_id')
+    if not ambulance_id:
+        raise ValueError("ambulance_id is required")
+
+    latitude = _first(item, 'lat', 'latitude')
+    longitude = _first(item, 'lon', 'lng', 'longitude')
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError("lat and lon must be numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("lat/lon out of range")
+
+    seq = item.get('seq')
+    if seq is not None and (isinstance(seq, bool) or not isinstance(seq, int)):
+        raise ValueError("seq must be an integer")
+
+    try:
+        timestamp = parse_timestamp(item.get('ts'))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("ts must be epoch milliseconds or an ISO 8601 string")
+
+    return {
+        'ambulance_id': str(ambulance_id),
+        'latitude': latitude,
+        'longitude': longitude,
+        'timestamp': timestamp or default_time,
+        'seq': seq
+    }
+
+
+def plan_batch(items, last_updated, default_time=None):
+    """
+    Decide what to do with every item of a batch.
+
+    Args:
+        items: Raw items from the request body
+        last_updated: Dict of ambulance_id -> last_updated datetime for the
+            ambulances that exist (missing ids are reported as unknown)
+        default_time: Timestamp for items without one (defaults to now)
+
+    Returns:
+        Tuple of (results, accepted, latest): a result dict per item in request
+        order; the (index, item) pairs to record in the location history, in
+        time order; and ambulance_id -> the newest applied item
+    """
+    now = datetime.utcnow()
+    default_time = default_time or now
+    results = [None] * len(items)
+    by_ambulance = {}
+
+    for index, raw in enumerate(items):
+        try:
+            item = normalize_item(raw, default_time)
+        except ValueError as e:
+            results[index] = {'index': index, 'status': INVALID, 'error': str(e)}
+            continue
+
+        if item['timestamp'] > now + MAX_CLOCK_SKEW:
+            results[index] = {'index': index, 'status': INVALID, 'error': "ts is in the future"}
+            continue
+
+        if item['ambulance_id'] not in last_updated:
+            results[index] = {'index': index, 'ambulance_id': item['ambulance_id'], 'status': UNKNOWN_AMBULANCE}
+            continue
+
+        by_ambulance.setdefault(item['ambulance_id'], []).append((index, item))
+
+    accepted = []
+    latest = {}
+    for ambulance_id, entries in by_ambulance.items():
+        entries.sort(key=lambda e: (e[1]['timestamp'], -1 if e[1]['seq'] is None else e[1]['seq'], e[0]))
+
+        watermark = (last_updated[ambulance_id], None)
+        for index, item in entries:
+            mark_time, mark_seq = watermark
+            newer = (
+                mark_time is None
+                or item['timestamp'] > mark_time
+                or (item['timestamp'] == mark_time and item['seq'] is not None
+                    and mark_seq is not None and item['seq'] > mark_seq)
+            )
+
+            status = APPLIED if newer else STALE
+            results[index] = {'index': index, 'ambulance_id': ambulance_id, 'status': status}
+
+            # Late points from a gap still belong in the history; exact repeats don't
+            if newer or item['timestamp'] != mark_time:
+                accepted.append((index, item))
+            if newer:
+                watermark = (item['timestamp'], item['seq'])
+                latest[ambulance_id] = item
+
+    accepted.sort(key=lambda e: e[1]['timestamp'])
+    return results, accepted, latest
@@ -0,0 +1,360 @@
+"""
+In-process metrics exposed in the Prometheus text format.
+A small registry of counters, gauges and histograms with fixed label sets,
+cheap enough to leave on under load: recording is a dict lookup and a bisect
+under a per-metric lock, and nothing is formatted until /metrics is scraped.
+Values are per process; with several workers scrape each one, or sum them.
+
+Covers HTTP request latency per route, database statements per request,
+calls to Nominatim, Twilio and the router, Socket.IO clients and emits, the
+position broadcast and long-poll queues, dispatch outcomes and the dispatch
+waitlist. Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+import bisect
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+from backend.utils.assignment_notifier import assignment_notifier
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+WAIT_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, label values, extra label pairs, value) tuples"""
+        with self._lock:
+            values = list(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        for key, value in values:
+            yield '', key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_labels(self.labelnames, key, extra)} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', key, (('le', _number(float(bound))),), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), cumulative
+
+
+class CallbackMetric(Metric):
+    def __init__(self, name, documentation, collect, labelnames=(), kind='gauge'):
+        """
+        Args:
+            collect: Function returning the current value, or a dict of values
+                keyed by tuples of label values
+        """
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield '', key, (), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        # Re-registering a name replaces it, e.g. when a second app is created
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, collect, labelnames=(), kind='gauge'):
+        return self.register(CallbackMetric(name, documentation, collect, labelnames, kind))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Shared by every request handler in this process
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+HTTP_REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route'))
+HTTP_REQUEST_DB_QUERIES = registry.histogram(
+    'http_request_db_queries', 'Database statements per HTTP request', ('route',), buckets=COUNT_BUCKETS)
+HTTP_REQUEST_DB_DURATION = registry.histogram(
+    'http_request_db_duration_seconds', 'Time spent in database statements per HTTP request', ('route',))
+DB_QUERY_DURATION = registry.histogram(
+    'db_query_duration_seconds', 'Database statement execution time', buckets=QUERY_BUCKETS)
+DEPENDENCY_REQUESTS = registry.counter(
+    'dependency_requests_total', 'Calls to external services by outcome', ('dependency', 'outcome'))
+DEPENDENCY_DURATION = registry.histogram(
+    'dependency_request_duration_seconds', 'Latency of calls to external services', ('dependency',))
+SOCKETIO_CLIENTS = registry.gauge(
+    'socketio_connected_clients', 'Socket.IO clients connected to this process')
+SOCKETIO_EMITS = registry.counter(
+    'socketio_emits_total', 'Socket.IO events emitted by event name', ('event',))
+DISPATCHES = registry.counter(
+    'dispatches_total', 'Ambulance dispatch attempts by outcome', ('outcome',))
+REDISPATCHES = registry.counter(
+    'redispatches_total', 'Dispatches re-run after the caller moved, by outcome', ('outcome',))
+WAITLIST_WAIT = registry.histogram(
+    'dispatch_waitlist_wait_seconds', 'Time calls spent on the dispatch waitlist before a unit was assigned',
+    buckets=WAIT_BUCKETS)
+registry.callback(
+    'assignment_waiters', 'Ambulance long-poll requests waiting for an assignment change',
+    lambda: assignment_notifier.waiting)
+
+
+def record_query(seconds):
+    """Count one database statement, against the current request if there is one"""
+    DB_QUERY_DURATION.observe(seconds)
+    if has_request_context():
+        totals = g.get('_metrics_db')
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += seconds
+
+
+class _DependencyCall:
+    failed = False
+
+
+@contextmanager
+def track_dependency(dependency):
+    """
+    Time a call to an external service. An exception, or setting `failed` on
+    the yielded object, counts it as an error.
+
+        with track_dependency('nominatim') as call:
+            response = requests.get(url)
+            call.failed = response.status_code != 200
+    """
+    call = _DependencyCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.failed = True
+        raise
+    finally:
+        DEPENDENCY_DURATION.observe(time.perf_counter() - start, dependency=dependency)
+        DEPENDENCY_REQUESTS.inc(dependency=dependency, outcome='error' if call.failed else 'ok')
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times every statement; pass as factory= to sqlite3.connect"""
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _finish_request(status):
+    if g.get('_metrics_done'):
+        return
+    g._metrics_done = True
+    start = g.get('_metrics_start')
+    if start is None:
+        return
+
+    route = _route()
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+    HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=request.method, route=route)
+    queries, seconds = g.get('_metrics_db') or (0, 0.0)
+    HTTP_REQUEST_DB_QUERIES.observe(queries, route=route)
+    HTTP_REQUEST_DB_DURATION.observe(seconds, route=route)
+
+
+def install_metrics(app, socketio=None, coalescer=None, waitlist=None):
+    """
+    Record request metrics for an app and count its Socket.IO emits and
+    position broadcast queue.
+
+    Args:
+        app: Flask application
+        socketio: Flask-SocketIO instance whose emits are counted
+        coalescer: PositionCoalescer whose queue is reported, if enabled
+        waitlist: Function returning (queued calls, seconds the oldest has
+            waited) of the dispatch waitlist; called during a /metrics request
+    """
+    @app.before_request
+    def start_request_metrics():
+        g._metrics_start = time.perf_counter()
+        g._metrics_db = [0, 0.0]
+
+    @app.after_request
+    def record_request_metrics(response):
+        _finish_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request_metrics(exception=None):
+        # after_request does not run when a view raised
+        if exception is not None:
+            _finish_request(500)
+
+    if socketio is not None:
+        emit = socketio.emit
+
+        def counted_emit(event, *args, **kwargs):
+            SOCKETIO_EMITS.inc(event=event)
+            return emit(event, *args, **kwargs)
+
+        socketio.emit = counted_emit
+
+    if coalescer is not None:
+        registry.callback(
+            'position_broadcast_pending', 'Ambulance positions waiting for the next dashboard frame',
+            lambda: coalescer.stats()['pending'])
+        registry.callback(
+            'position_broadcast_subscribers', 'Dashboards subscribed to position frames',
+            lambda: coalescer.stats()['subscribers'])
+        registry.callback(
+            'position_broadcast_events_total', 'Position coalescer activity by kind',
+            lambda: {(kind,): value for kind, value in coalescer.stats().items()
+                     if kind not in ('pending', 'subscribers')},
+            labelnames=('kind',), kind='counter')
+
+    if waitlist is not None:
+        registry.callback(
+            'dispatch_waitlist_calls', 'Calls waiting on the dispatch waitlist',
+            lambda: waitlist()[0])
+        registry.callback(
+            'dispatch_waitlist_oldest_wait_seconds', 'Time the longest-waiting queued call has waited',
+            lambda: waitlist()[1])
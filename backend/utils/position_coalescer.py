@@ -0,0 +1,189 @@
+"""
+Coalescing, rate-limited broadcast of ambulance positions.
+Pings are not re-emitted as they arrive. The coalescer keeps the latest
+position per unit and, once per tick, sends each subscribed dashboard a single
+batched `ambulance_update` frame. A dashboard that has not acknowledged its
+previous frames is skipped; its pending positions keep being overwritten in
+place, so a slow client costs at most one entry per ambulance. Shared by the
+SQLAlchemy backend and simple_app.py.
+
+With several worker processes behind a message queue, dashboards are spread
+over processes that each see only their own pings. In that case pass `room`:
+each process then flushes one frame per tick to the room through the queue,
+trading per-client backpressure for cross-process delivery.
+"""
+
+import threading
+import time
+
+
+class _Subscriber:
+    __slots__ = ('pending', 'in_flight', 'last_sent')
+
+    def __init__(self):
+        self.pending = {}
+        self.in_flight = 0
+        self.last_sent = 0.0
+
+
+class PositionCoalescer:
+    def __init__(self, socketio, interval=1.0, max_in_flight=2, ack_timeout=10.0, event='ambulance_update',
+                 room=None):
+        """
+        Args:
+            socketio: Flask-SocketIO instance used to emit frames
+            interval: Seconds between flushes (1.0 gives 1 Hz)
+            max_in_flight: Unacknowledged frames allowed per subscriber
+            ack_timeout: Seconds after which unacknowledged frames are written
+                off, so clients that never ack are not starved forever
+            event: Name of the emitted event
+            room: Emit one shared frame per tick to this room instead of
+                per-subscriber frames (for multi-process deployments)
+        """
+        self.socketio = socketio
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.event = event
+        self.room = room
+
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._subscribers = {}
+        self._started = False
+
+        self.received = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.frames_sent = 0
+        self.positions_sent = 0
+
+    def subscribe(self, sid):
+        with self._lock:
+            self._subscribers.setdefault(sid, _Subscriber())
+
+    def unsubscribe(self, sid):
+        with self._lock:
+            self._subscribers.pop(sid, None)
+
+    def submit(self, position):
+        """
+        Record the latest position of a unit. A position that has not been
+        flushed yet is superseded rather than queued.
+
+        Args:
+            position: Dict holding at least ambulance_id, latitude and longitude
+        """
+        key = position.get('ambulance_id')
+        if key is None:
+            return
+        if not self._started:
+            self.start()
+        with self._lock:
+            self.received += 1
+            if key in self._latest:
+                self.coalesced += 1
+            self._latest[key] = position
+
+    def tick(self):
+        """
+        Flush positions received since the last tick to every subscriber
+        that has room for another frame.
+
+        Returns:
+            Number of frames emitted
+        """
+        if self.room:
+            return self._tick_room()
+
+        now = time.monotonic()
+        frames = []
+        with self._lock:
+            latest = self._latest
+            self._latest = {}
+
+            for sid, subscriber in self._subscribers.items():
+                for key, position in latest.items():
+                    # A position still waiting for a slow client is replaced, never queued
+                    if key in subscriber.pending:
+                        self.dropped += 1
+                    subscriber.pending[key] = position
+
+                if not subscriber.pending:
+                    continue
+
+                if subscriber.in_flight and now - subscriber.last_sent > self.ack_timeout:
+                    subscriber.in_flight = 0
+
+                if subscriber.in_flight >= self.max_in_flight:
+                    self.deferred += 1
+                    continue
+
+                frames.append((sid, list(subscriber.pending.values())))
+                subscriber.pending = {}
+                subscriber.in_flight += 1
+                subscriber.last_sent = now
+                self.frames_sent += 1
+                self.positions_sent += len(frames[-1][1])
+
+        # Emit outside the lock; acks arrive on other greenlets/threads
+        for sid, positions in frames:
+            self.socketio.emit(
+                self.event,
+                {'positions': positions},
+                to=sid,
+                callback=self._ack_callback(sid)
+            )
+
+        return len(frames)
+
+    def _tick_room(self):
+        with self._lock:
+            positions = list(self._latest.values())
+            self._latest = {}
+            if not positions:
+                return 0
+            self.frames_sent += 1
+            self.positions_sent += len(positions)
+
+        self.socketio.emit(self.event, {'positions': positions}, to=self.room)
+        return 1
+
+    def _ack_callback(self, sid):
+        def ack(*args):
+            with self._lock:
+                subscriber = self._subscribers.get(sid)
+                if subscriber and subscriber.in_flight:
+                    subscriber.in_flight -= 1
+        return ack
+
+    def run(self):
+        """Background task flushing every interval seconds"""
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error broadcasting ambulance positions: {e}")
+
+    def start(self):
+        """Start the background flush task once"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.socketio.start_background_task(self.run)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'received': self.received,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'deferred': self.deferred,
+                'frames_sent': self.frames_sent,
+                'positions_sent': self.positions_sent,
+                'pending': len(self._latest)
+            }
@@ -0,0 +1,463 @@
+"""
+On-demand CPU and memory profiling for a long-running server process.
+Three tools, all idle until switched on from the debug endpoints, so they can
+stay installed in production:
+
+- RequestProfiler runs cProfile on one in N requests and merges the results,
+  giving per-function call counts and times across many real requests.
+- StackSampler samples the stack of every other thread from a real OS thread
+  at a fixed interval for a time window; the function counts show where the
+  process spends CPU without slowing it down much. Under eventlet all
+  greenlets run on the main thread, so its samples show whichever greenlet
+  was running (or the hub, when idle).
+- MemorySnapshots takes tracemalloc snapshots plus live object counts by type
+  and diffs two of them, to find what grows between them (e.g. an identity
+  map or Socket.IO sessions that are never released).
+
+Under eventlet a sampled request's profile also catches whatever other
+greenlets ran while it waited on I/O. Shared by the SQLAlchemy backend and
+simple_app.py.
+"""
+
+import cProfile
+import gc
+import sys
+import tracemalloc
+from collections import Counter, deque
+from datetime import datetime
+from functools import lru_cache
+
+from flask import g
+
+if 'eventlet' in sys.modules:
+    # The sampler must be a real thread and sleep for real, not a greenlet.
+    # Checked rather than imported: eventlet alone takes a quarter second to load
+    from eventlet.patcher import original
+    _threading = original('threading')
+    _time = original('time')
+else:
+    import threading as _threading
+    import time as _time
+
+MAX_STACK_DEPTH = 64
+PROFILE_SORT_KEYS = {'cumulative': 3, 'tottime': 2, 'calls': 1}  # columns of the merged stats
+
+
+class ProfilingError(Exception):
+    pass
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename):
+    # Drop the sys.path entry so frames read like module paths
+    for prefix in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(prefix.rstrip('/') + '/'):
+            return filename[len(prefix.rstrip('/')) + 1:]
+    return filename
+
+
+def _function_name(filename, lineno, name):
+    if filename == '~':
+        return name  # built-in, e.g. <method 'execute' of 'sqlite3.Cursor' objects>
+    return f'{name} ({_short_path(filename)}:{lineno})'
+
+
+class RequestProfiler:
+    def __init__(self, sample_every=0):
+        """
+        Args:
+            sample_every: Profile one in this many requests; 0 is off
+        """
+        self.sample_every = sample_every
+        self._lock = _threading.Lock()
+        # cProfile hooks the interpreter, so one profile runs at a time
+        self._active = _threading.Lock()
+        self._seen = 0
+        self._reset()
+
+    def _reset(self):
+        # (primitive calls, calls, total time, cumulative time) per function;
+        # pstats.Stats.add also merges the caller graph, which costs more than
+        # the profiled request
+        self._stats = {}
+        self._sampled = 0
+        self._started_at = datetime.utcnow()
+
+    def configure(self, sample_every):
+        """Start sampling one in sample_every requests (0 stops) and clear the stats"""
+        with self._lock:
+            self.sample_every = sample_every
+            self._seen = 0
+            self._reset()
+
+    def start(self):
+        """Start profiling the current request if it is sampled; returns the profile or None"""
+        if not self.sample_every:
+            return None
+        with self._lock:
+            self._seen += 1
+            if self._seen % self.sample_every:
+                return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile):
+        profile.disable()
+        self._active.release()
+        profile.create_stats()
+        with self._lock:
+            for key, (primitive_calls, calls, total, cumulative, _) in profile.stats.items():
+                merged = self._stats.get(key)
+                if merged is None:
+                    self._stats[key] = [primitive_calls, calls, total, cumulative]
+                else:
+                    merged[0] += primitive_calls
+                    merged[1] += calls
+                    merged[2] += total
+                    merged[3] += cumulative
+            self._sampled += 1
+
+    def stats(self, limit=30, sort='cumulative'):
+        """
+        The merged profile of every sampled request.
+
+        Args:
+            limit: Number of functions to list
+            sort: 'cumulative', 'tottime' or 'calls'
+
+        Returns:
+            Dict with the sampling state and the top functions
+        """
+        column = PROFILE_SORT_KEYS[sort]
+        with self._lock:
+            rows = sorted(self._stats.items(), key=lambda item: item[1][column], reverse=True)[:limit]
+            sampled, started_at = self._sampled, self._started_at
+        return {
+            'sample_every': self.sample_every,
+            'sampled_requests': sampled,
+            'since': started_at.isoformat(),
+            'sort': sort,
+            'functions': [
+                {
+                    'function': _function_name(*key),
+                    'calls': calls,
+                    'primitive_calls': primitive_calls,
+                    'total_ms': round(total * 1000, 3),
+                    'cumulative_ms': round(cumulative * 1000, 3),
+                    'cumulative_ms_per_request': round(cumulative * 1000 / sampled, 3) if sampled else None
+                }
+                for key, (primitive_calls, calls, total, cumulative) in rows
+            ]
+        }
+
+
+class StackSampler:
+    def __init__(self):
+        self._lock = _threading.Lock()
+        self._thread = None
+        self._stop = None
+        self._window = {}
+        self._samples = 0
+        self._stacks = Counter()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration, interval):
+        """
+        Sample every thread's stack for a time window.
+
+        Args:
+            duration: Window length in seconds
+            interval: Seconds between samples
+        """
+        with self._lock:
+            if self.running:
+                raise ProfilingError('Stack sampler already running')
+            self._samples = 0
+            self._stacks = Counter()
+            self._window = {
+                'started_at': datetime.utcnow().isoformat(),
+                'duration_s': duration,
+                'interval_ms': interval * 1000,
+                'ended_at': None
+            }
+            self._stop = _threading.Event()
+            self._thread = _threading.Thread(
+                target=self._run, args=(duration, interval), name='stack-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """End the window early; the samples so far are kept"""
+        if self._stop is not None:
+            self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, duration, interval):
+        me = _threading.get_ident()
+        deadline = _time.monotonic() + duration
+        while _time.monotonic() < deadline and not self._stop.wait(interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(_function_name(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                stacks.append(tuple(reversed(stack)))
+            with self._lock:
+                self._samples += 1
+                self._stacks.update(stacks)
+        self._window['ended_at'] = datetime.utcnow().isoformat()
+
+    def results(self, limit=30):
+        """
+        The samples of the current or last window.
+
+        Args:
+            limit: Number of functions and stacks to list
+
+        Returns:
+            Dict with the window, the functions seen most often at the top of
+            a stack (self) or anywhere in it (total), and the commonest stacks
+            in folded 'root;...;leaf' form for flame graph tools
+        """
+        with self._lock:
+            samples = self._samples
+            stacks = list(self._stacks.items())
+
+        own, total = Counter(), Counter()
+        for stack, count in stacks:
+            if stack:
+                own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+
+        def share(count):
+            return round(100.0 * count / samples, 1) if samples else 0.0
+
+        return {
+            'running': self.running,
+            **self._window,
+            'samples': samples,
+            'functions': [
+                {'function': name, 'self_samples': own[name], 'self_percent': share(own[name]),
+                 'total_samples': count, 'total_percent': share(count)}
+                for name, count in total.most_common(limit)
+            ],
+            'hot_spots': [
+                {'function': name, 'samples': count, 'percent': share(count)}
+                for name, count in own.most_common(limit)
+            ],
+            'stacks': [
+                {'stack': ';'.join(stack), 'samples': count}
+                for stack, count in sorted(stacks, key=lambda item: item[1], reverse=True)[:limit]
+            ]
+        }
+
+
+class MemorySnapshots:
+    # Allocations made by tracemalloc itself are not the app's
+    FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    )
+
+    def __init__(self, keep=10):
+        self._lock = _threading.Lock()
+        self._snapshots = deque(maxlen=keep)
+        self._next_id = 1
+
+    def take(self, frames=1):
+        """
+        Snapshot traced allocations and live objects by type. The first
+        snapshot starts tracemalloc, so it is the baseline for later ones.
+
+        Args:
+            frames: Stack frames stored per allocation when tracing starts
+
+        Returns:
+            Id of the new snapshot
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        types = Counter(f'{type(obj).__module__}.{type(obj).__qualname__}' for obj in gc.get_objects())
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self._snapshots.append({
+                'id': snapshot_id,
+                'taken_at': datetime.utcnow().isoformat(),
+                'traced_bytes': current,
+                'peak_traced_bytes': peak,
+                'snapshot': snapshot,
+                'types': types
+            })
+        return snapshot_id
+
+    def _get(self, snapshot_id):
+        with self._lock:
+            for record in self._snapshots:
+                if record['id'] == snapshot_id:
+                    return record
+        raise ProfilingError(f'No snapshot {snapshot_id}')
+
+    def list(self):
+        with self._lock:
+            records = list(self._snapshots)
+        return [
+            {key: record[key] for key in ('id', 'taken_at', 'traced_bytes', 'peak_traced_bytes')}
+            for record in records
+        ]
+
+    def summary(self, snapshot_id, limit=20, group_by='lineno'):
+        """
+        The largest allocation sites and most numerous object types of one snapshot.
+
+        Args:
+            snapshot_id: Snapshot to describe
+            limit: Number of sites and types to list
+            group_by: 'lineno', 'filename' or 'traceback'
+        """
+        record = self._get(snapshot_id)
+        return {
+            **{key: record[key] for key in ('id', 'taken_at', 'traced_bytes', 'peak_traced_bytes')},
+            'allocations': [
+                {'where': self._where(stat.traceback), 'size_bytes': stat.size, 'count': stat.count}
+                for stat in record['snapshot'].statistics(group_by)[:limit]
+            ],
+            'types': [{'type': name, 'count': count} for name, count in record['types'].most_common(limit)]
+        }
+
+    def diff(self, from_id, to_id, limit=20, group_by='lineno'):
+        """
+        What grew (or shrank) between two snapshots, largest change first.
+
+        Args:
+            from_id: Earlier snapshot
+            to_id: Later snapshot
+            limit: Number of sites and types to list
+            group_by: 'lineno', 'filename' or 'traceback'
+        """
+        before, after = self._get(from_id), self._get(to_id)
+        type_changes = Counter(after['types'])
+        type_changes.subtract(before['types'])
+        changed_types = sorted(
+            ((name, change) for name, change in type_changes.items() if change),
+            key=lambda item: abs(item[1]), reverse=True
+        )
+        return {
+            'from': from_id,
+            'to': to_id,
+            'traced_bytes_change': after['traced_bytes'] - before['traced_bytes'],
+            'allocations': [
+                {
+                    'where': self._where(stat.traceback),
+                    'size_bytes': stat.size,
+                    'size_change_bytes': stat.size_diff,
+                    'count': stat.count,
+                    'count_change': stat.count_diff
+                }
+                for stat in after['snapshot'].compare_to(before['snapshot'], group_by)[:limit]
+            ],
+            'types': [
+                {'type': name, 'count': after['types'][name], 'count_change': change}
+                for name, change in changed_types[:limit]
+            ]
+        }
+
+    def clear(self):
+        """Drop every snapshot and stop tracing allocations"""
+        with self._lock:
+            self._snapshots.clear()
+        tracemalloc.stop()
+
+    @staticmethod
+    def _where(traceback):
+        return [f'{_short_path(frame.filename)}:{frame.lineno}' for frame in traceback]
+
+
+def parse_sample_every(data):
+    """
+    Validate a request to start or stop request sampling.
+
+    Args:
+        data: Parsed JSON body with sample_every, 0 to stop
+
+    Returns:
+        The sampling rate
+
+    Raises:
+        ValueError: If sample_every is missing or negative
+    """
+    try:
+        sample_every = int(data['sample_every'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('sample_every must be a whole number')
+    if sample_every < 0:
+        raise ValueError('sample_every must not be negative')
+    return sample_every
+
+
+def parse_sampler_window(data, max_duration=300):
+    """
+    Validate a request to start the stack sampler.
+
+    Args:
+        data: Parsed JSON body with optional duration_s (default 10) and
+            interval_ms (default 10)
+        max_duration: Longest window allowed, in seconds
+
+    Returns:
+        (duration, interval) in seconds
+
+    Raises:
+        ValueError: If either value is out of range
+    """
+    try:
+        duration = float(data.get('duration_s', 10))
+        interval = float(data.get('interval_ms', 10)) / 1000
+    except (TypeError, ValueError):
+        raise ValueError('duration_s and interval_ms must be numbers')
+    if not 0 < duration <= max_duration:
+        raise ValueError(f'duration_s must be between 0 and {max_duration}')
+    # stop() joins the sampler, which blocks the eventlet hub for up to one interval
+    if not 0.001 <= interval <= min(duration, 1):
+        raise ValueError('interval_ms must be between 1 and 1000 and no longer than the window')
+    return duration, interval
+
+
+# Shared by every request handler in this process
+request_profiler = RequestProfiler()
+stack_sampler = StackSampler()
+memory_snapshots = MemorySnapshots()
+
+
+def install_request_profiler(app, profiler=request_profiler):
+    """
+    Profile sampled requests of an app. Costs one attribute check per
+    request while sampling is off.
+
+    Args:
+        app: Flask application
+        profiler: RequestProfiler collecting the profiles
+    """
+    @app.before_request
+    def start_request_profile():
+        g._profile = profiler.start()
+
+    @app.teardown_request
+    def finish_request_profile(exception=None):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profiler.finish(profile)
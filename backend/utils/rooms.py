@@ -0,0 +1,35 @@
+"""
+Socket.IO room names for targeted fan-out.
+Dispatch dashboards join the dispatchers room, each ambulance tablet joins the
+room of its own unit and each location share page joins the room of its call,
+so an event only reaches the clients it concerns. Shared by the SQLAlchemy
+backend and simple_app.py.
+"""
+
+DISPATCHERS_ROOM = 'dispatchers'
+
+
+def ambulance_room(ambulance_pk):
+    """Room of one ambulance, keyed by its primary key"""
+    return f'ambulance:{ambulance_pk}'
+
+
+def call_room(call_id):
+    """Room of one emergency call, joined by the caller's share page"""
+    return f'call:{call_id}'
+
+
+def rooms_for(call_id=None, ambulance_pk=None):
+    """
+    Get the rooms an event about a call and/or an ambulance should reach.
+    Dispatchers always get it; the call and ambulance rooms only when known.
+
+    Returns:
+        List of room names
+    """
+    rooms = [DISPATCHERS_ROOM]
+    if call_id:
+        rooms.append(call_room(call_id))
+    if ambulance_pk:
+        rooms.append(ambulance_room(ambulance_pk))
+    return rooms
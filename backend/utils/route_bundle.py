@@ -0,0 +1,279 @@
+"""
+Offline route bundles for ambulance assignments.
+A bundle holds everything the driver app needs to keep navigating without a
+connection: the route as a simplified polyline6 string, the turn list, ETA
+checkpoints along the way and the map tile keys covering the corridor. It is
+built once at dispatch time from an OSRM-compatible router, or from the
+straight line when no router answers, and shipped in the assignment payload.
+Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+import bisect
+import math
+from datetime import datetime
+
+import requests
+
+from backend.utils.distance import haversine_distance
+from backend.utils.metrics import track_dependency
+from backend.utils.tracing import span
+from backend.utils.simplify import douglas_peucker
+from backend.utils.tiles import lat_lng_to_tile
+
+BUNDLE_VERSION = 1
+ROUTE_ZOOMS = (13, 14, 15, 16, 17)
+FALLBACK_SPEED_KMH = 40  # city traffic, as used for dispatch ETAs
+
+SOURCE_ROUTER = 'router'
+SOURCE_STRAIGHT_LINE = 'straight_line'
+
+
+def encode_polyline(points, precision=6):
+    """
+    Encode (latitude, longitude) points with the Google polyline algorithm.
+
+    Args:
+        points: Sequence of (latitude, longitude) pairs
+        precision: Decimal digits kept (6 gives polyline6, as used by OSRM)
+
+    Returns:
+        Encoded string
+    """
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat_i = int(round(lat * factor))
+        lon_i = int(round(lon * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return ''.join(out)
+
+
+def decode_polyline(encoded, precision=6):
+    """
+    Decode a Google polyline string.
+
+    Returns:
+        List of (latitude, longitude) tuples
+    """
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def fetch_route(start, end, base_url, timeout=3.0):
+    """
+    Ask an OSRM-compatible router for the driving route between two points.
+
+    Args:
+        start, end: (latitude, longitude) pairs
+        base_url: Router base URL, e.g. http://localhost:5001
+        timeout: Seconds to wait before giving up
+
+    Returns:
+        Dict with points, distance_m, duration_s and steps (OSRM step objects),
+        or None if the router could not be reached or found no route
+    """
+    url = (f"{base_url.rstrip('/')}/route/v1/driving/"
+           f"{start[1]},{start[0]};{end[1]},{end[0]}")
+    try:
+        with span('router'), track_dependency('routing') as call:
+            response = requests.get(
+                url,
+                params={'overview': 'full', 'geometries': 'polyline6', 'steps': 'true'},
+                timeout=timeout
+            )
+            data = response.json()
+            call.failed = data.get('code') != 'Ok'
+    except (requests.RequestException, ValueError):
+        return None
+
+    if data.get('code') != 'Ok' or not data.get('routes'):
+        return None
+
+    route = data['routes'][0]
+    return {
+        'points': decode_polyline(route['geometry']),
+        'distance_m': route['distance'],
+        'duration_s': route['duration'],
+        'steps': [step for leg in route.get('legs', ()) for step in leg.get('steps', ())]
+    }
+
+
+def _cumulative_distances(points):
+    distances = [0.0]
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        distances.append(distances[-1] + haversine_distance(lat1, lon1, lat2, lon2) * 1000)
+    return distances
+
+
+def _nearest_index(points, lat, lon, start=0):
+    # Maneuvers come in route order, so searching forward keeps loops unambiguous
+    best, best_distance = start, float('inf')
+    for i in range(start, len(points)):
+        distance = haversine_distance(points[i][0], points[i][1], lat, lon)
+        if distance < best_distance:
+            best, best_distance = i, distance
+    return best
+
+
+def corridor_tile_keys(points, buffer_m, zooms=ROUTE_ZOOMS, limit=None):
+    """
+    List the "z/x/y" keys of the tiles within buffer_m of a polyline. The line
+    is sampled at half-tile steps and the tiles around each sample are taken.
+
+    Returns:
+        Tuple of (keys, truncated flag); lower zooms come first
+    """
+    keys = []
+    seen = set()
+    for zoom in zooms:
+        for i in range(max(1, len(points) - 1)):
+            lat1, lon1 = points[i]
+            lat2, lon2 = points[min(i + 1, len(points) - 1)]
+            tile_m = 40075016 * math.cos(math.radians(lat1)) / 2 ** zoom
+            segment_m = haversine_distance(lat1, lon1, lat2, lon2) * 1000
+            steps = max(1, math.ceil(segment_m / (tile_m / 2)))
+
+            for step in range(steps + 1):
+                lat = lat1 + (lat2 - lat1) * step / steps
+                lon = lon1 + (lon2 - lon1) * step / steps
+                d_lat = buffer_m / 111320
+                d_lon = buffer_m / (111320 * math.cos(math.radians(lat)))
+                min_x, min_y = lat_lng_to_tile(lat + d_lat, lon - d_lon, zoom)
+                max_x, max_y = lat_lng_to_tile(lat - d_lat, lon + d_lon, zoom)
+
+                for x in range(min_x, max_x + 1):
+                    for y in range(min_y, max_y + 1):
+                        key = f'{zoom}/{x}/{y}'
+                        if key in seen:
+                            continue
+                        if limit is not None and len(keys) >= limit:
+                            return keys, True
+                        seen.add(key)
+                        keys.append(key)
+    return keys, False
+
+
+def build_route_bundle(start, end, router_url=None, timeout=3.0, tolerance_m=5, buffer_m=300,
+                       checkpoint_spacing_m=1000, max_tiles=4000, zooms=ROUTE_ZOOMS):
+    """
+    Build the offline route bundle for a dispatch.
+
+    Args:
+        start: (latitude, longitude) of the ambulance
+        end: (latitude, longitude) of the emergency
+        router_url: OSRM-compatible router base URL; None uses the straight line
+        timeout: Router timeout in seconds
+        tolerance_m: Douglas-Peucker tolerance for the shipped polyline
+        buffer_m: Corridor half-width for the tile keys
+        checkpoint_spacing_m: Distance between ETA checkpoints
+        max_tiles: Cap on the number of tile keys
+        zooms: Zoom levels to list tiles for
+
+    Returns:
+        JSON-serialisable bundle dict
+    """
+    route = fetch_route(start, end, router_url, timeout) if router_url else None
+
+    if route and len(route['points']) >= 2:
+        source = SOURCE_ROUTER
+        full_points = route['points']
+        distance_m = route['distance_m']
+        duration_s = route['duration_s']
+        steps = route['steps']
+    else:
+        source = SOURCE_STRAIGHT_LINE
+        full_points = [tuple(start), tuple(end)]
+        distance_m = haversine_distance(start[0], start[1], end[0], end[1]) * 1000
+        duration_s = distance_m / (FALLBACK_SPEED_KMH / 3.6)
+        steps = []
+
+    points = douglas_peucker(full_points, tolerance_m)
+    cumulative = _cumulative_distances(points)
+    path_m = cumulative[-1] or 1.0
+
+    # Turns, with the time the router expects to be there
+    turns = []
+    known_etas = [(0, 0.0)]
+    elapsed_s = 0.0
+    index = 0
+    for step in steps:
+        maneuver = step.get('maneuver', {})
+        lon, lat = maneuver.get('location', (None, None))
+        if lat is None:
+            continue
+        index = _nearest_index(points, lat, lon, index)
+        if maneuver.get('type') not in ('depart',):
+            turns.append({
+                'index': index,
+                'type': maneuver.get('type'),
+                'modifier': maneuver.get('modifier'),
+                'name': step.get('name') or '',
+                'lat': round(lat, 6),
+                'lon': round(lon, 6),
+                'distance_m': int(round(cumulative[index]))
+            })
+            known_etas.append((index, elapsed_s))
+        elapsed_s += step.get('duration', 0)
+
+    # ETA checkpoints every checkpoint_spacing_m along the path, interpolated
+    # between the router's timings (or at constant speed for the straight line)
+    timings = sorted({(cumulative[i], eta) for i, eta in known_etas} | {(path_m, duration_s)})
+    marks = [d for d in range(int(checkpoint_spacing_m), int(path_m), int(checkpoint_spacing_m))] + [path_m]
+    checkpoints = []
+    for mark in marks:
+        position = bisect.bisect_left(timings, (mark, -1))
+        after = timings[min(position, len(timings) - 1)]
+        before = timings[max(position - 1, 0)]
+        gap = after[0] - before[0]
+        share = (mark - before[0]) / gap if gap else 1.0
+        checkpoints.append({
+            'index': max(0, bisect.bisect_right(cumulative, mark) - 1),
+            'distance_m': int(round(mark)),
+            'eta_s': int(round(before[1] + (after[1] - before[1]) * share))
+        })
+
+    tile_keys, truncated = corridor_tile_keys(points, buffer_m, zooms, limit=max_tiles)
+
+    return {
+        'version': BUNDLE_VERSION,
+        'source': source,
+        'created_at': datetime.utcnow().isoformat(),
+        'encoding': 'polyline6',
+        'polyline': encode_polyline(points),
+        'distance_m': int(round(distance_m)),
+        'path_distance_m': int(round(path_m)),
+        'duration_s': int(round(duration_s)),
+        'turns': turns,
+        'checkpoints': checkpoints,
+        'tiles': {
+            'zooms': list(zooms),
+            'buffer_m': buffer_m,
+            'keys': tile_keys,
+            'truncated': truncated
+        }
+    }
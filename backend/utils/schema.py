@@ -0,0 +1,33 @@
+"""
+Additive schema upgrades for existing SQLite databases.
+CREATE TABLE IF NOT EXISTS and SQLAlchemy's create_all leave tables that
+already exist untouched, so columns introduced later are added here at
+startup. Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+
+def ensure_columns(conn, table, columns):
+    """
+    Add any missing columns to an existing table.
+
+    Args:
+        conn: DB-API connection to the SQLite database
+        table: Table name
+        columns: Dict of column name -> column definition (type and default)
+
+    Returns:
+        List of the columns that were added
+    """
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if not existing:
+        return []
+
+    added = []
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            added.append(name)
+
+    if added:
+        conn.commit()
+    return added
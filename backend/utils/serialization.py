@@ -0,0 +1,114 @@
+"""
+Fast JSON responses for list endpoints.
+Building a dict per model object (to_dict) and encoding it with jsonify
+dominates the dashboard endpoints once the tables grow. Instead, a request's
+fields are resolved once into a projection: only those columns are selected
+(see backend.services.read_service), rows are zipped straight into dicts, and
+datetimes are left for the encoder.
+
+Responses are encoded with orjson when it is installed (pip install orjson),
+which also writes datetimes natively; otherwise with the standard library,
+giving the same output. A request may pick a sparse fieldset with
+?fields=id,status,latitude,longitude; id is always included so clients can
+key the rows. Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+import json
+from datetime import date, datetime
+from functools import lru_cache
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(payload):
+        """Encode a payload as compact JSON bytes"""
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    _encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+    def dumps(payload):
+        """Encode a payload as compact JSON bytes"""
+        return _encoder.encode(payload).encode()
+
+
+def json_response(payload, status=200):
+    """A JSON response encoded with the fast backend, in place of jsonify"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+@lru_cache(maxsize=256)
+def parse_fields(value, available):
+    """
+    Resolve a ?fields= parameter into the fields to return.
+
+    Args:
+        value: Comma-separated field names, or None/empty for all of them
+        available: Tuple of the fields the endpoint serves, in output order
+
+    Returns:
+        Tuple of field names, id first
+
+    Raises:
+        ValueError: If a requested field is not available
+    """
+    if not value:
+        return available
+
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    fields = ['id'] if 'id' in available else []
+    for name in requested:
+        if name not in fields:
+            fields.append(name)
+    return tuple(fields)
+
+
+@lru_cache(maxsize=256)
+def model_columns(model, fields):
+    """The column attributes of a SQLAlchemy model for a tuple of field names"""
+    return tuple(getattr(model, name) for name in fields)
+
+
+def rows_to_dicts(fields, rows):
+    """Zip result rows (tuples or sqlite3.Row) into dicts keyed by field name"""
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def rows_to_embedded_dicts(fields, key, embedded_fields, rows):
+    """
+    Zip rows of a LEFT JOIN into dicts with the joined record nested.
+
+    Args:
+        fields: Field names of the leading columns of each row
+        key: Name the joined record is nested under
+        embedded_fields: Field names of the trailing columns, id first
+        rows: Result rows (tuples or sqlite3.Row)
+
+    Returns:
+        List of dicts; key is None where the join found no record
+    """
+    split = len(fields)
+    result = []
+    for row in rows:
+        values = tuple(row)
+        item = dict(zip(fields, values[:split]))
+        item[key] = dict(zip(embedded_fields, values[split:])) if values[split] is not None else None
+        result.append(item)
+    return result
@@ -0,0 +1,96 @@
+"""
+Polyline simplification utilities for the Emergency Response System.
+Used to downsample long ambulance tracks and routes before sending them to clients.
+"""
+
+import math
+
+EARTH_RADIUS_M = 6371000
+
+
+def _project(points, lat_index, lon_index):
+    """Project coordinates onto a local equirectangular plane in meters"""
+    mean_lat = sum(p[lat_index] for p in points) / len(points)
+    kx = math.cos(math.radians(mean_lat)) * math.pi / 180 * EARTH_RADIUS_M
+    ky = math.pi / 180 * EARTH_RADIUS_M
+    return [(p[lon_index] * kx, p[lat_index] * ky) for p in points]
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    """Distance in meters from point P to segment AB on the projected plane"""
+    dx = bx - ax
+    dy = by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def douglas_peucker(points, tolerance_m, lat_index=0, lon_index=1):
+    """
+    Simplify a polyline with the Douglas-Peucker algorithm.
+
+    Args:
+        points: Sequence of points (tuples or lists) holding latitude and longitude
+        tolerance_m: Maximum allowed deviation in meters
+        lat_index, lon_index: Positions of latitude and longitude in each point
+
+    Returns:
+        List of the retained points, in their original order
+    """
+    if len(points) <= 2:
+        return list(points)
+
+    projected = _project(points, lat_index, lon_index)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+
+    # Iterative to stay clear of the recursion limit on day-long tracks
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        ax, ay = projected[start]
+        bx, by = projected[end]
+
+        max_distance = -1.0
+        index = None
+        for i in range(start + 1, end):
+            px, py = projected[i]
+            distance = _segment_distance(px, py, ax, ay, bx, by)
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+
+        if index is not None and max_distance > tolerance_m:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_to_count(points, max_points, initial_tolerance_m=5, lat_index=0, lon_index=1):
+    """
+    Simplify a polyline until it holds at most max_points points.
+    The tolerance starts small and doubles until the result fits.
+
+    Args:
+        points: Sequence of points holding latitude and longitude
+        max_points: Upper bound on the number of returned points (minimum 2)
+        initial_tolerance_m: Tolerance to start from, in meters
+
+    Returns:
+        Tuple of (simplified points, tolerance used in meters)
+    """
+    max_points = max(2, max_points)
+    if len(points) <= max_points:
+        return list(points), 0
+
+    tolerance = initial_tolerance_m
+    simplified = douglas_peucker(points, tolerance, lat_index, lon_index)
+    while len(simplified) > max_points:
+        tolerance *= 2
+        simplified = douglas_peucker(simplified, tolerance, lat_index, lon_index)
+
+    return simplified, tolerance
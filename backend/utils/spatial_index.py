@@ -0,0 +1,126 @@
+"""
+SQLite R*Tree spatial index for ambulances and emergency calls.
+The index tables mirror the latitude/longitude columns and are kept in sync by
+triggers, so every write path (SQLAlchemy or raw SQL) updates them. Shared by
+the SQLAlchemy backend and simple_app.py.
+"""
+
+import math
+import sqlite3
+
+# Radii tried in turn when looking for the nearest candidate
+SEARCH_RADII_KM = (2, 5, 15, 50)
+
+KM_PER_DEGREE_LAT = 111.32
+
+SPATIAL_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ambulance_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS call_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+
+    """CREATE TRIGGER IF NOT EXISTS ambulances_rtree_insert AFTER INSERT ON ambulances
+    BEGIN
+        INSERT OR REPLACE INTO ambulance_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ambulances_rtree_update AFTER UPDATE OF latitude, longitude ON ambulances
+    BEGIN
+        INSERT OR REPLACE INTO ambulance_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ambulances_rtree_delete AFTER DELETE ON ambulances
+    BEGIN
+        DELETE FROM ambulance_rtree WHERE id = OLD.id;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS calls_rtree_insert AFTER INSERT ON emergency_calls
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT OR REPLACE INTO call_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS calls_rtree_update AFTER UPDATE OF latitude, longitude ON emergency_calls
+    BEGIN
+        DELETE FROM call_rtree WHERE id = OLD.id;
+        INSERT INTO call_rtree SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS calls_rtree_delete AFTER DELETE ON emergency_calls
+    BEGIN
+        DELETE FROM call_rtree WHERE id = OLD.id;
+    END""",
+]
+
+# Fills the index from rows written before it existed
+SPATIAL_BACKFILL = [
+    """INSERT OR REPLACE INTO ambulance_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM ambulances""",
+    """INSERT OR REPLACE INTO call_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM emergency_calls
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL""",
+]
+
+# Bounding-box queries; parameters come from bounding_box()
+AMBULANCES_IN_BOX_SQL = """
+    SELECT ambulances.* FROM ambulance_rtree
+    JOIN ambulances ON ambulances.id = ambulance_rtree.id
+    WHERE ambulance_rtree.min_lat <= :max_lat AND ambulance_rtree.max_lat >= :min_lat
+      AND ambulance_rtree.min_lon <= :max_lon AND ambulance_rtree.max_lon >= :min_lon
+"""
+
+AVAILABLE_AMBULANCES_IN_BOX_SQL = AMBULANCES_IN_BOX_SQL + " AND ambulances.is_available = 1"
+
+CALLS_IN_BOX_SQL = """
+    SELECT emergency_calls.* FROM call_rtree
+    JOIN emergency_calls ON emergency_calls.id = call_rtree.id
+    WHERE call_rtree.min_lat <= :max_lat AND call_rtree.max_lat >= :min_lat
+      AND call_rtree.min_lon <= :max_lon AND call_rtree.max_lon >= :min_lon
+"""
+
+ACTIVE_CALLS_IN_BOX_SQL = CALLS_IN_BOX_SQL + " AND emergency_calls.status NOT IN ('completed', 'cancelled')"
+
+
+def ensure_spatial_index(conn):
+    """
+    Create the R*Tree tables and sync triggers if they do not exist yet.
+
+    Args:
+        conn: DB-API connection to the SQLite database
+
+    Returns:
+        True if the index is available, False if SQLite lacks the R*Tree module
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ambulance_rtree'")
+        is_new = cursor.fetchone() is None
+
+        for statement in SPATIAL_SCHEMA:
+            cursor.execute(statement)
+
+        if is_new:
+            for statement in SPATIAL_BACKFILL:
+                cursor.execute(statement)
+
+        conn.commit()
+        return True
+    except sqlite3.OperationalError:
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Get the bounding box that contains a circle of radius_km around a point.
+
+    Returns:
+        Dict with min_lat, max_lat, min_lon and max_lon
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+
+    return {
+        'min_lat': max(-90.0, latitude - dlat),
+        'max_lat': min(90.0, latitude + dlat),
+        'min_lon': max(-180.0, longitude - dlon),
+        'max_lon': min(180.0, longitude + dlon)
+    }
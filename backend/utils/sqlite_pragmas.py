@@ -0,0 +1,36 @@
+"""
+SQLite connection settings for concurrent access.
+WAL lets readers run alongside a writer, and the busy timeout makes a writer
+wait for the lock instead of failing at once, which matters as soon as more
+than one worker process opens the same database file. Shared by the
+SQLAlchemy backend and simple_app.py.
+"""
+
+BUSY_TIMEOUT_MS = 5000
+
+# FULL syncs the WAL on every commit. NORMAL skips that fsync: faster, but an
+# OS crash or power loss can drop the last committed dispatches.
+SYNCHRONOUS_MODES = ('FULL', 'NORMAL', 'EXTRA')
+
+
+def apply_sqlite_pragmas(conn, busy_timeout_ms=BUSY_TIMEOUT_MS, synchronous='FULL'):
+    """
+    Configure a new DB-API connection to a SQLite database.
+
+    Args:
+        conn: DB-API connection to the SQLite database
+        busy_timeout_ms: How long a write waits for a lock held by another process
+        synchronous: One of SYNCHRONOUS_MODES
+    """
+    synchronous = synchronous.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        # Persistent per database file; a no-op for in-memory databases
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute(f"PRAGMA synchronous = {synchronous}")
+    finally:
+        cursor.close()
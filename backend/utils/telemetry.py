@@ -0,0 +1,180 @@
+"""
+Binary telemetry frames for ambulance GPS ingest over Socket.IO.
+A frame is a 16-byte header followed by fixed 18-byte points, all
+little-endian, so a ping costs a few dozen bytes instead of a JSON object with
+string keys. Tablets buffer points while offline and send them as one frame.
+Decoding reads straight out of the received buffer through a memoryview.
+Shared by the SQLAlchemy backend and simple_app.py.
+
+Header: version (u8), flags (u8), point count (u16), ambulance primary key (u32),
+        base timestamp in epoch milliseconds (i64)
+Point:  latitude, longitude in micro-degrees (i32, i32), milliseconds after the
+        base timestamp (u32), speed in cm/s (u16), heading in hundredths of a
+        degree (u16), sequence number (u16, wraps)
+"""
+
+import struct
+import threading
+import time
+from datetime import timedelta
+from backend.utils.location_batch import MAX_CLOCK_SKEW
+from backend.utils.track_encoding import from_micro_degrees
+
+TELEMETRY_VERSION = 1
+
+HEADER = struct.Struct('<BBHIq')
+POINT = struct.Struct('<iiIHHH')
+
+# Sentinel for speed or heading the device did not report
+UNKNOWN = 0xFFFF
+
+MAX_POINTS_PER_FRAME = 1024
+
+
+class TelemetryError(ValueError):
+    """Raised for frames that are truncated, oversized or of an unknown version"""
+
+
+def decode_frame(data):
+    """
+    Decode a telemetry frame without copying the point data.
+
+    Args:
+        data: bytes-like object holding one frame
+
+    Returns:
+        Tuple of (ambulance primary key, list of point dicts in frame order)
+
+    Raises:
+        TelemetryError: If the frame is malformed
+    """
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise TelemetryError("Frame shorter than its header")
+
+    try:
+        version, _flags, count, ambulance_pk, base_ms = HEADER.unpack_from(view, 0)
+    except struct.error as e:
+        raise TelemetryError(f"Malformed frame header: {e}")
+    if version != TELEMETRY_VERSION:
+        raise TelemetryError(f"Unsupported telemetry version {version}")
+    if count > MAX_POINTS_PER_FRAME:
+        raise TelemetryError(f"Frame holds {count} points, limit is {MAX_POINTS_PER_FRAME}")
+
+    end = HEADER.size + count * POINT.size
+    if len(view) < end:
+        raise TelemetryError("Frame truncated")
+
+    points = []
+    for lat_e6, lon_e6, offset_ms, speed, heading, seq in POINT.iter_unpack(view[HEADER.size:end]):
+        points.append({
+            'timestamp_ms': base_ms + offset_ms,
+            'latitude': from_micro_degrees(lat_e6),
+            'longitude': from_micro_degrees(lon_e6),
+            'speed': None if speed == UNKNOWN else speed / 100,
+            'heading': None if heading == UNKNOWN else heading / 100,
+            'seq': seq
+        })
+
+    return ambulance_pk, points
+
+
+def valid_points(points, now_ms=None):
+    """
+    Drop points a device cannot have measured: coordinates out of range, or
+    timestamps before the epoch or further ahead than MAX_CLOCK_SKEW (the rule
+    of the batch endpoint). A future point would otherwise become the
+    watermark and turn every later real point stale.
+
+    Args:
+        points: Point dicts as returned by decode_frame
+        now_ms: Current time in epoch milliseconds (defaults to now)
+
+    Returns:
+        The remaining points, in their original order
+    """
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    latest_ms = now_ms + MAX_CLOCK_SKEW // timedelta(milliseconds=1)
+    return [
+        p for p in points
+        if -90 <= p['latitude'] <= 90 and -180 <= p['longitude'] <= 180
+        and 0 <= p['timestamp_ms'] <= latest_ms
+    ]
+
+
+def encode_frame(ambulance_pk, points):
+    """
+    Encode points into a telemetry frame (the inverse of decode_frame).
+    Used by tools and load generators; tablets build frames in JavaScript.
+
+    Args:
+        ambulance_pk: Primary key of the ambulance
+        points: Sequence of point dicts as returned by decode_frame
+
+    Returns:
+        bytes
+    """
+    if len(points) > MAX_POINTS_PER_FRAME:
+        raise TelemetryError(f"At most {MAX_POINTS_PER_FRAME} points fit in a frame")
+
+    base_ms = min((p['timestamp_ms'] for p in points), default=0)
+    buffer = bytearray(HEADER.size + len(points) * POINT.size)
+    HEADER.pack_into(buffer, 0, TELEMETRY_VERSION, 0, len(points), ambulance_pk, base_ms)
+
+    offset = HEADER.size
+    for p in points:
+        speed = p.get('speed')
+        heading = p.get('heading')
+        POINT.pack_into(
+            buffer, offset,
+            int(round(p['latitude'] * 1_000_000)),
+            int(round(p['longitude'] * 1_000_000)),
+            p['timestamp_ms'] - base_ms,
+            UNKNOWN if speed is None else min(int(round(speed * 100)), UNKNOWN - 1),
+            UNKNOWN if heading is None else int(round(heading * 100)) % 36000,
+            p.get('seq', 0) & 0xFFFF
+        )
+        offset += POINT.size
+
+    return bytes(buffer)
+
+
+class TelemetryWatermarks:
+    """
+    Per-ambulance timestamp of the newest point stored by this process, so
+    a batch re-sent after a lost acknowledgement is not ingested twice.
+    Callers filter a frame, store the result and only then commit it: a frame
+    whose write failed is taken again when the tablet re-sends it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest_ms = {}
+
+    def filter(self, ambulance_pk, points):
+        """
+        Drop points at or before the watermark, without advancing it.
+
+        Returns:
+            The new points, ordered by timestamp
+        """
+        with self._lock:
+            watermark = self._latest_ms.get(ambulance_pk, -1)
+        return sorted(
+            (p for p in points if p['timestamp_ms'] > watermark),
+            key=lambda p: p['timestamp_ms']
+        )
+
+    def commit(self, ambulance_pk, points):
+        """Advance the watermark past points that have been stored"""
+        if not points:
+            return
+        newest = max(p['timestamp_ms'] for p in points)
+        with self._lock:
+            if newest > self._latest_ms.get(ambulance_pk, -1):
+                self._latest_ms[ambulance_pk] = newest
+
+
+# Shared by every socket handler in this process
+telemetry_watermarks = TelemetryWatermarks()
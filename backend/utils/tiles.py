@@ -0,0 +1,256 @@
+"""
+Read-only access to a region tile pack stored as an MBTiles file.
+MBTiles is a SQLite database with a `tiles` table (or view) keyed by
+(zoom_level, tile_column, tile_row) in TMS order, and a `metadata` table of
+name/value pairs. The pack is opened read-only and immutable with SQLite's
+memory-mapped I/O, so tile reads are served from the page cache without
+taking file locks. Shared by the SQLAlchemy backend and simple_app.py.
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from flask import Response, request
+
+MIME_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'pbf': 'application/x-protobuf'
+}
+
+# Web Mercator stops at ~85.05 degrees
+MAX_LATITUDE = 85.0511287798
+
+
+def lat_lng_to_tile(latitude, longitude, zoom):
+    """
+    Convert a position to XYZ tile coordinates (the scheme Leaflet uses).
+
+    Returns:
+        Tuple of (x, y)
+    """
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    n = 2 ** zoom
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat_rad = math.radians(latitude)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class TilePackError(Exception):
+    pass
+
+
+class TileStore:
+    def __init__(self, path, mmap_size=256 * 1024 * 1024):
+        """
+        Args:
+            path: Path of the .mbtiles file
+            mmap_size: Bytes of the file SQLite may memory-map
+
+        Raises:
+            TilePackError: If the file is missing or not an MBTiles pack
+        """
+        if not os.path.isfile(path):
+            raise TilePackError(f"Tile pack not found: {path}")
+
+        self.path = path
+        # One connection shared under a lock; tile reads take microseconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            f'file:{os.path.abspath(path)}?mode=ro&immutable=1',
+            uri=True,
+            check_same_thread=False
+        )
+        self._conn.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+
+        try:
+            self.metadata = dict(self._conn.execute('SELECT name, value FROM metadata'))
+        except sqlite3.DatabaseError as e:
+            self._conn.close()
+            raise TilePackError(f"Not an MBTiles file: {path} ({e})")
+
+        self.format = self.metadata.get('format', 'png').lower()
+        self.mimetype = MIME_TYPES.get(self.format, 'application/octet-stream')
+
+        zooms = self._conn.execute('SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles').fetchone()
+        self.minzoom = int(self.metadata.get('minzoom', zooms[0] or 0))
+        self.maxzoom = int(self.metadata.get('maxzoom', zooms[1] or 0))
+
+        bounds = self.metadata.get('bounds')
+        self.bounds = [float(v) for v in bounds.split(',')] if bounds else [-180.0, -MAX_LATITUDE, 180.0, MAX_LATITUDE]
+
+        # Changes whenever a new pack is dropped in, so clients can tell packs apart
+        stat = os.stat(path)
+        self.version = hashlib.blake2b(
+            f'{stat.st_size}:{stat.st_mtime_ns}'.encode(), digest_size=8
+        ).hexdigest()
+
+    def get_tile(self, z, x, y):
+        """
+        Read one tile by XYZ coordinates.
+
+        Returns:
+            Tuple of (tile bytes, strong ETag), or None if the pack has no such tile
+        """
+        if not self.minzoom <= z <= self.maxzoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (z, x, (2 ** z - 1) - y)
+            ).fetchone()
+
+        if not row or row[0] is None:
+            return None
+
+        data = bytes(row[0])
+        return data, hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def tile_keys(self, bbox=None, minzoom=None, maxzoom=None, limit=None):
+        """
+        List the tiles the pack holds inside a bounding box and zoom range.
+
+        Args:
+            bbox: [west, south, east, north] in degrees (defaults to the pack bounds)
+            minzoom: Lowest zoom (defaults to the pack's)
+            maxzoom: Highest zoom (defaults to the pack's)
+            limit: Maximum number of keys returned
+
+        Returns:
+            Tuple of (list of "z/x/y" keys, truncated flag)
+        """
+        west, south, east, north = bbox or self.bounds
+        minzoom = max(self.minzoom, self.minzoom if minzoom is None else minzoom)
+        maxzoom = min(self.maxzoom, self.maxzoom if maxzoom is None else maxzoom)
+
+        keys = []
+        with self._lock:
+            for z in range(minzoom, maxzoom + 1):
+                min_x, min_y = lat_lng_to_tile(north, west, z)
+                max_x, max_y = lat_lng_to_tile(south, east, z)
+                top = 2 ** z - 1
+
+                # Range scan on the (zoom_level, tile_column, tile_row) index
+                rows = self._conn.execute(
+                    '''SELECT tile_column, tile_row FROM tiles
+                       WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?
+                       ORDER BY tile_column, tile_row DESC''',
+                    (z, min_x, max_x, top - max_y, top - min_y)
+                )
+                for x, tms_y in rows:
+                    if limit is not None and len(keys) >= limit:
+                        return keys, True
+                    keys.append(f'{z}/{x}/{top - tms_y}')
+
+        return keys, False
+
+    def manifest(self, tile_url):
+        """
+        Describe the pack for clients.
+
+        Args:
+            tile_url: URL template of the tile endpoint, with {z}, {x} and {y}
+
+        Returns:
+            Dict with name, format, bounds, zoom range, version and tile URL
+        """
+        center = self.metadata.get('center')
+        return {
+            'name': self.metadata.get('name', os.path.splitext(os.path.basename(self.path))[0]),
+            'attribution': self.metadata.get('attribution'),
+            'format': self.format,
+            'bounds': self.bounds,
+            'center': [float(v) for v in center.split(',')] if center else None,
+            'minzoom': self.minzoom,
+            'maxzoom': self.maxzoom,
+            'version': self.version,
+            'tile_url': tile_url
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def tile_response(store, z, x, y, max_age):
+    """
+    Build the HTTP response for one tile: the bytes with a strong ETag and
+    long cache lifetime, 304 when the client already has them, or 404.
+
+    Args:
+        store: TileStore to read from
+        z, x, y: XYZ tile coordinates
+        max_age: Cache lifetime of a tile in seconds
+    """
+    tile = store.get_tile(z, x, y)
+    if not tile:
+        response = Response(status=404)
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600  # packs are replaced, not patched
+        return response
+
+    data, etag = tile
+    response = Response(data, mimetype=store.mimetype)
+    if data[:2] == b'\x1f\x8b':
+        # Vector tiles are usually stored gzipped
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+def parse_bbox(value):
+    """
+    Parse a "west,south,east,north" query parameter.
+
+    Returns:
+        List of four floats, or None if value is empty
+
+    Raises:
+        ValueError: If the value is malformed
+    """
+    if not value:
+        return None
+    parts = [float(v) for v in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox must be west,south,east,north")
+    west, south, east, north = parts
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        raise ValueError("bbox out of range")
+    return parts
+
+
+def parse_coverage_report(data):
+    """
+    Validate a tile coverage report from an ambulance app's service worker.
+
+    Args:
+        data: Dict with total, cached and failed tile counts, and optionally
+            the storage usage and quota in bytes
+
+    Returns:
+        Dict of the counts plus coverage (share of the corridor cached, 0-1)
+
+    Raises:
+        ValueError: If a count is missing or not a non-negative integer
+    """
+    report = {}
+    for field in ('total', 'cached', 'failed', 'usage', 'quota'):
+        value = data.get(field)
+        if value is None and field in ('usage', 'quota'):
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"{field} must be a non-negative integer")
+        report[field] = value
+
+    if report['cached'] > report['total']:
+        raise ValueError("cached cannot exceed total")
+    report['coverage'] = round(report['cached'] / report['total'], 3) if report['total'] else 1.0
+    return report
@@ -0,0 +1,151 @@
+"""
+Stage timing traces for the dispatch pipeline.
+A dispatch runs its stages in sequence: call lookup, fleet query, distance
+scoring, route bundle, commit, notifications and SMS. Wrapping the pipeline
+in dispatch_trace() and each stage in span() records how long every stage
+took; finished traces go to a ring buffer so the slowest recent dispatches
+can be inspected at a debug endpoint, and stage durations feed /metrics.
+
+The active trace is kept per thread (per greenlet under eventlet), and span()
+outside a trace does nothing beyond one attribute lookup, so the helpers can
+sit in shared service code. Shared by the SQLAlchemy backend and
+simple_app.py.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from backend.utils.metrics import registry
+
+DISPATCH_DURATION = registry.histogram(
+    'dispatch_duration_seconds', 'End-to-end dispatch pipeline time by kind', ('kind',))
+DISPATCH_STAGE_DURATION = registry.histogram(
+    'dispatch_stage_duration_seconds', 'Time spent in each dispatch stage', ('kind', 'stage'))
+
+_local = threading.local()
+
+
+class DispatchTrace:
+    def __init__(self, kind, attributes):
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.depth = 0
+        self.stages = []
+
+    def to_dict(self):
+        totals = {}
+        for name, _, duration, depth in self.stages:
+            if depth == 0:
+                totals[name] = totals.get(name, 0.0) + duration
+        return {
+            'kind': self.kind,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            **self.attributes,
+            'stage_totals_ms': {name: round(seconds * 1000, 3) for name, seconds in totals.items()},
+            'stages': [
+                {'name': name, 'start_ms': round(offset * 1000, 3), 'duration_ms': round(duration * 1000, 3), 'depth': depth}
+                for name, offset, duration, depth in sorted(self.stages, key=lambda stage: stage[1])
+            ]
+        }
+
+
+class TraceBuffer:
+    def __init__(self, maxlen=500):
+        self._lock = threading.Lock()
+        self._traces = deque(maxlen=maxlen)
+
+    def resize(self, maxlen):
+        with self._lock:
+            self._traces = deque(self._traces, maxlen=maxlen)
+
+    def add(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent(self, limit=20):
+        """The latest finished traces, newest first"""
+        with self._lock:
+            traces = list(self._traces)
+        return [trace.to_dict() for trace in reversed(traces[-limit:])]
+
+    def slowest(self, limit=20):
+        """The slowest traces still in the buffer, slowest first"""
+        with self._lock:
+            traces = list(self._traces)
+        traces.sort(key=lambda trace: trace.duration, reverse=True)
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._traces)
+
+
+# Shared by every request handler in this process
+dispatch_traces = TraceBuffer()
+
+
+def current_trace():
+    """The dispatch trace active on this thread, or None"""
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def span(name):
+    """Time one stage of the active dispatch trace, if there is one"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    depth = trace.depth
+    trace.depth += 1
+    try:
+        yield
+    finally:
+        trace.depth = depth
+        trace.stages.append((name, start - trace.start, time.perf_counter() - start, depth))
+
+
+@contextmanager
+def dispatch_trace(kind, **attributes):
+    """
+    Trace one run of the dispatch pipeline. Inside another trace (e.g. an
+    assignment made while re-dispatching) this becomes a stage of the outer one.
+
+    Args:
+        kind: Pipeline name, e.g. 'assign' or 'redispatch'
+        **attributes: Fields stored with the trace, e.g. call_id
+
+    Yields:
+        The DispatchTrace; set trace.attributes['outcome'] before it ends
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        with span(kind):
+            for key, value in attributes.items():
+                trace.attributes.setdefault(key, value)
+            yield trace
+        return
+
+    trace = _local.trace = DispatchTrace(kind, attributes)
+    try:
+        yield trace
+    except Exception:
+        trace.attributes['outcome'] = 'error'
+        raise
+    finally:
+        _local.trace = None
+        trace.duration = time.perf_counter() - trace.start
+        dispatch_traces.add(trace)
+        DISPATCH_DURATION.observe(trace.duration, kind=kind)
+        for name, _, duration, depth in trace.stages:
+            if depth == 0:
+                DISPATCH_STAGE_DURATION.observe(duration, kind=kind, stage=name)
@@ -0,0 +1,105 @@
+"""
+Compact binary encoding for ambulance GPS tracks.
+Points are stored as int32 micro-degrees and millisecond timestamps; every point
+after the first is written as a zigzag varint delta from its predecessor, which
+keeps a typical 10-second ping down to a handful of bytes.
+"""
+
+import struct
+
+TRACK_FORMAT_VERSION = 1
+
+# version, point count, first latitude/longitude (micro-degrees), first timestamp (ms)
+_HEADER = struct.Struct('<BHiiq')
+
+MAX_POINTS_PER_BLOB = 0xFFFF
+
+
+def to_micro_degrees(value):
+    """Convert a coordinate in decimal degrees to int32 micro-degrees"""
+    return int(round(value * 1_000_000))
+
+
+def from_micro_degrees(value):
+    """Convert int32 micro-degrees back to decimal degrees"""
+    return value / 1_000_000
+
+
+def _write_varint(out, value):
+    # Zigzag so small negative deltas stay small
+    value = (value << 1) ^ (value >> 63)
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), pos
+
+
+def encode_track(points):
+    """
+    Encode a list of track points.
+
+    Args:
+        points: Sequence of (timestamp_ms, lat_e6, lon_e6) integer tuples,
+                ordered by timestamp
+
+    Returns:
+        Encoded bytes
+    """
+    if not points:
+        raise ValueError("Cannot encode an empty track")
+    if len(points) > MAX_POINTS_PER_BLOB:
+        raise ValueError(f"A track blob holds at most {MAX_POINTS_PER_BLOB} points")
+
+    first_ts, first_lat, first_lon = points[0]
+    out = bytearray(_HEADER.pack(TRACK_FORMAT_VERSION, len(points), first_lat, first_lon, first_ts))
+
+    prev_ts, prev_lat, prev_lon = first_ts, first_lat, first_lon
+    for ts, lat, lon in points[1:]:
+        _write_varint(out, lat - prev_lat)
+        _write_varint(out, lon - prev_lon)
+        _write_varint(out, ts - prev_ts)
+        prev_ts, prev_lat, prev_lon = ts, lat, lon
+
+    return bytes(out)
+
+
+def decode_track(data):
+    """
+    Decode bytes produced by encode_track.
+
+    Args:
+        data: Encoded track bytes
+
+    Returns:
+        List of (timestamp_ms, lat_e6, lon_e6) tuples
+    """
+    buf = memoryview(data)
+    version, count, lat, lon, ts = _HEADER.unpack_from(buf, 0)
+    if version != TRACK_FORMAT_VERSION:
+        raise ValueError(f"Unsupported track format version: {version}")
+
+    points = [(ts, lat, lon)]
+    pos = _HEADER.size
+    for _ in range(count - 1):
+        dlat, pos = _read_varint(buf, pos)
+        dlon, pos = _read_varint(buf, pos)
+        dts, pos = _read_varint(buf, pos)
+        lat += dlat
+        lon += dlon
+        ts += dts
+        points.append((ts, lat, lon))
+
+    return points
@@ -0,0 +1,106 @@
+"""
+Dispatch waitlist for calls that found no available ambulance.
+Instead of waiting for a dispatcher to retry, such a call is queued. Each
+queued call gets a queue key: the time it was queued, moved earlier by a head
+start for its severity. Ordering by the key, an indexed column, serves calls
+by wait time and severity together; with the default step a critical call
+queued now ranks with a routine one that has waited ten minutes.
+
+Whenever a unit becomes free (a call completes or is cancelled, a re-dispatch
+releases it) or is registered, the first few calls of the queue are read and
+the unit goes to the one it reaches fastest. Shared by the SQLAlchemy backend
+and simple_app.py.
+"""
+
+from datetime import datetime
+
+from backend.utils.distance import haversine_distance
+
+SEVERITIES = {1: 'critical', 2: 'urgent', 3: 'routine'}
+DEFAULT_SEVERITY = 2
+# Severity steps a call is moved up the queue by
+SEVERITY_HEAD_START = {1: 2, 2: 1, 3: 0}
+
+# Columns waitlist lookups select, in this order
+WAITLIST_FIELDS = ('id', 'latitude', 'longitude', 'queued_time')
+
+# Only queued calls have a key, so the index stays as small as the queue
+WAITLIST_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS ix_emergency_calls_queue_key '
+    'ON emergency_calls (queue_key) WHERE queue_key IS NOT NULL'
+)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_severity(value):
+    """
+    Read a call's severity from a request.
+
+    Args:
+        value: 1-3, or critical/urgent/routine; None or empty for the default
+
+    Returns:
+        Severity level, 1 being the most severe
+
+    Raises:
+        ValueError: If the value is not a known severity
+    """
+    if value is None or value == '':
+        return DEFAULT_SEVERITY
+
+    if isinstance(value, str) and not value.strip().isdigit():
+        for level, name in SEVERITIES.items():
+            if value.strip().lower() == name:
+                return level
+        raise ValueError(f"Unknown severity: {value}")
+
+    try:
+        severity = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Unknown severity: {value}")
+    if severity not in SEVERITIES:
+        raise ValueError(f"Severity must be one of {', '.join(map(str, SEVERITIES))}")
+    return severity
+
+
+def queue_key(queued_time, severity, step_seconds):
+    """
+    Sort key of a queued call; smaller keys are served first.
+
+    Args:
+        queued_time: Naive UTC datetime the call was queued
+        severity: Severity level of the call
+        step_seconds: Wait time one severity level is worth
+
+    Returns:
+        Seconds since the epoch, less the call's head start
+    """
+    head_start = SEVERITY_HEAD_START.get(severity, SEVERITY_HEAD_START[DEFAULT_SEVERITY])
+    return (queued_time - _EPOCH).total_seconds() - head_start * step_seconds
+
+
+def rank_by_reach(latitude, longitude, candidates):
+    """
+    Order queued calls by how fast a unit at a position reaches them.
+
+    Args:
+        latitude, longitude: Position of the unit
+        candidates: Rows of WAITLIST_FIELDS
+
+    Returns:
+        List of (distance_km, call_id), nearest first
+    """
+    ranked = [
+        (haversine_distance(latitude, longitude, call_latitude, call_longitude), call_id)
+        for call_id, call_latitude, call_longitude, _ in candidates
+    ]
+    ranked.sort()
+    return ranked
+
+
+def wait_seconds(queued_time, now=None):
+    """Seconds a call has waited since queued_time (a datetime or SQLite timestamp string)"""
+    if isinstance(queued_time, str):
+        queued_time = datetime.fromisoformat(queued_time)
+    return max(0.0, ((now or datetime.utcnow()) - queued_time).total_seconds())
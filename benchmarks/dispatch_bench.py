@@ -0,0 +1,403 @@
+"""
+Dispatch benchmark on synthetic city fleets and call storms.
+Loads a synthetic fleet into a fresh database, replays a call arrival process
+against the SQLAlchemy app (backend/app.py) and/or simple_app.py through
+Flask's test client, and records the latency of:
+
+    assign           dispatching the nearest available ambulance
+    location_submit  POST /api/location/submit
+    active_calls     GET /api/callcenter/active-calls
+    sms_webhook      POST /api/sms/webhook (SQLAlchemy app only)
+
+Calls are replayed as fast as the app answers; simulated time only decides
+when a dispatched unit finishes its job and becomes available again. In the
+SQLAlchemy app location_submit dispatches the call itself, so its latency
+includes assign. Every (app, fleet, process) run gets its own process and
+database. SMS, reverse geocoding and routing are switched off so that only
+this code is timed (--routing-url points dispatch at a local router).
+
+The JSON report carries p50/p95/p99 and throughput per operation together
+with the commit it was measured on; --baseline compares against an earlier
+report and exits with status 1 if any p95 regressed beyond --tolerance.
+
+Usage:
+    python benchmarks/dispatch_bench.py --fleet 10,100,1000,10000 --process steady,poisson,mci
+    python benchmarks/dispatch_bench.py --app simple --fleet 1000 --calls 500 --output before.json
+    python benchmarks/dispatch_bench.py --app simple --fleet 1000 --calls 500 --baseline before.json
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import ARRIVAL_PROCESSES, generate_arrivals, generate_fleet  # noqa: E402
+
+APPS = ('backend', 'simple')
+OPERATIONS = ('assign', 'location_submit', 'active_calls', 'sms_webhook')
+REPORT_VERSION = 1
+NOISE_FLOOR_MS = 0.5  # p95 changes smaller than this are never regressions
+
+
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+
+    def record(self, operation, elapsed_ms, ok=True):
+        self.samples[operation].append(elapsed_ms)
+        if not ok:
+            self.errors[operation] += 1
+
+    def request(self, operation, send):
+        """Time one test-client request; 5xx responses and exceptions count as errors"""
+        start = time.perf_counter()
+        try:
+            response = send()
+        except Exception:
+            self.record(operation, (time.perf_counter() - start) * 1000, ok=False)
+            if self.errors[operation] == 1:
+                traceback.print_exc()
+            return None
+        self.record(operation, (time.perf_counter() - start) * 1000, response.status_code < 500)
+        return response
+
+
+def percentile(ordered, p):
+    # Nearest-rank percentile of a sorted list
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples, errors):
+    ordered = sorted(samples)
+    total_s = sum(ordered) / 1000
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'p50_ms': round(percentile(ordered, 50), 3),
+        'p95_ms': round(percentile(ordered, 95), 3),
+        'p99_ms': round(percentile(ordered, 99), 3),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+        'max_ms': round(ordered[-1], 3),
+        'throughput_per_s': round(len(ordered) / total_s, 1) if total_s else None
+    }
+
+
+class Fixtures:
+    """Direct SQLite access for loading the fleet and finishing jobs; not timed"""
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, timeout=30)
+
+    def load_fleet(self, fleet):
+        now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+        self.conn.execute('DELETE FROM ambulances')  # simple_app seeds two units
+        self.conn.executemany(
+            '''INSERT INTO ambulances (ambulance_id, driver_name, driver_phone, latitude, longitude, is_available, last_updated)
+               VALUES (?, ?, ?, ?, ?, 1, ?)''',
+            [row + (now,) for row in fleet]
+        )
+        self.conn.commit()
+
+    def new_call(self, caller_phone):
+        location_link_id = str(uuid.uuid4())
+        cursor = self.conn.execute(
+            'INSERT INTO emergency_calls (caller_phone, call_time, status, location_link_id) VALUES (?, ?, ?, ?)',
+            [caller_phone, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f'), 'initiated', location_link_id]
+        )
+        self.conn.commit()
+        return cursor.lastrowid, location_link_id
+
+    def assignment(self, caller_phone):
+        row = self.conn.execute(
+            'SELECT id, assigned_ambulance_id FROM emergency_calls WHERE caller_phone = ? ORDER BY id DESC LIMIT 1',
+            [caller_phone]
+        ).fetchone()
+        return row if row else (None, None)
+
+    def finish(self, call_ids):
+        marks = ','.join('?' * len(call_ids))
+        self.conn.execute(
+            f'''UPDATE ambulances SET is_available = 1 WHERE id IN
+                (SELECT assigned_ambulance_id FROM emergency_calls WHERE id IN ({marks}))''',
+            call_ids
+        )
+        self.conn.execute(
+            f"UPDATE emergency_calls SET status = 'completed', completion_time = ? WHERE id IN ({marks})",
+            [datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')] + list(call_ids)
+        )
+        self.conn.commit()
+
+
+class BackendTarget:
+    name = 'backend'
+    has_sms_webhook = True
+    submit_assigns = True
+
+    def __init__(self, timings):
+        from backend.app import create_app
+
+        self.app, _ = create_app()
+        self.client = self.app.test_client()
+
+        # Time the dispatch that location_submit runs
+        service = self.app.extensions['services'].ambulance
+        assign = service.assign_nearest_ambulance
+
+        def timed_assign(emergency_call_id):
+            start = time.perf_counter()
+            try:
+                return assign(emergency_call_id)
+            finally:
+                timings.record('assign', (time.perf_counter() - start) * 1000)
+
+        service.assign_nearest_ambulance = timed_assign
+
+    def assign(self, timings, call_id):
+        pass  # already dispatched by location_submit
+
+
+class SimpleTarget:
+    name = 'simple'
+    has_sms_webhook = False
+    submit_assigns = False
+
+    def __init__(self, timings):
+        import simple_app  # creates the tables in DATABASE_PATH
+        self.client = simple_app.app.test_client()
+
+    def assign(self, timings, call_id):
+        # Dispatchers assign from the dashboard in simple_app
+        timings.request('assign', lambda: self.client.post(f'/api/callcenter/assign-ambulance/{call_id}'))
+
+
+def run_one(config):
+    """Replay one arrival process against one app in this process"""
+    db_path = os.path.join(tempfile.mkdtemp(prefix='dispatch-bench-'), 'bench.db')
+    os.environ.update({
+        'DATABASE_URI': f'sqlite:///{db_path}',
+        'DATABASE_PATH': db_path,
+        'SMS_ENABLED': 'False',
+        'NOMINATIM_URL': '',
+        'ROUTING_URL': config['routing_url'] or '',
+        'CALL_ARCHIVE_INTERVAL_SECONDS': '0'
+    })
+
+    timings = Timings()
+    target = (BackendTarget if config['app'] == 'backend' else SimpleTarget)(timings)
+    client = target.client
+
+    fixtures = Fixtures(db_path)
+    fixtures.load_fleet(generate_fleet(config['fleet'], seed=config['seed']))
+    arrivals = generate_arrivals(config['process'], config['calls'], config['rate_per_min'], seed=config['seed'])
+
+    rng = random.Random(config['seed'] + 1)
+    service_s = config['service_min'] * 60
+    busy = []  # (simulated end of job, call id)
+    dispatched = unassigned = 0
+
+    start = time.perf_counter()
+    for i, arrival in enumerate(arrivals):
+        done = []
+        while busy and busy[0][0] <= arrival.at_s:
+            done.append(heapq.heappop(busy)[1])
+        if done:
+            fixtures.finish(done)
+
+        caller_phone = f'+9180{i:08d}'
+        if target.has_sms_webhook and rng.random() < config['sms_share']:
+            timings.request('sms_webhook', lambda: client.post('/api/sms/webhook', data={
+                'From': caller_phone,
+                'Body': f'HELP {arrival.latitude:.6f}, {arrival.longitude:.6f}'
+            }))
+        else:
+            call_id, location_link_id = fixtures.new_call(caller_phone)
+            timings.request('location_submit', lambda: client.post('/api/location/submit', json={
+                'location_link_id': location_link_id,
+                'latitude': arrival.latitude,
+                'longitude': arrival.longitude,
+                'accuracy': 20,
+                'phase': 'fine'
+            }))
+            target.assign(timings, call_id)
+
+        call_id, ambulance_pk = fixtures.assignment(caller_phone)
+        if ambulance_pk:
+            dispatched += 1
+            heapq.heappush(busy, (arrival.at_s + service_s, call_id))
+        else:
+            unassigned += 1
+
+        if (i + 1) % config['active_calls_every'] == 0:
+            timings.request('active_calls', lambda: client.get('/api/callcenter/active-calls'))
+    wall_s = time.perf_counter() - start
+
+    return {
+        'app': config['app'],
+        'fleet': config['fleet'],
+        'process': config['process'],
+        'calls': len(arrivals),
+        'simulated_min': round(arrivals[-1].at_s / 60, 1) if arrivals else 0,
+        'dispatched': dispatched,
+        'unassigned': unassigned,
+        'location_submit_includes_assign': target.submit_assigns,
+        'wall_s': round(wall_s, 3),
+        'calls_per_s': round(len(arrivals) / wall_s, 1) if wall_s else None,
+        'operations': {
+            operation: summarize(timings.samples[operation], timings.errors[operation])
+            for operation in OPERATIONS if timings.samples[operation]
+        }
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, report, tolerance):
+    """
+    Print the p95 change of every operation found in both reports.
+
+    Returns:
+        Number of regressions beyond tolerance
+    """
+    def index(runs):
+        return {(run['app'], run['fleet'], run['process']): run for run in runs if 'operations' in run}
+
+    before = index(baseline.get('runs', ()))
+    regressions = 0
+    print(f"\np95 vs baseline {(baseline.get('commit') or '?')[:12]}:", file=sys.stderr)
+    for key, run in index(report['runs']).items():
+        if key not in before:
+            continue
+        for operation, stats in run['operations'].items():
+            old = before[key]['operations'].get(operation)
+            if not old:
+                continue
+            change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+            regressed = change > tolerance and stats['p95_ms'] - old['p95_ms'] > NOISE_FLOOR_MS
+            regressions += regressed
+            print(f"  {key[0]:8} fleet={key[1]:<6} {key[2]:8} {operation:16} "
+                  f"{old['p95_ms']:9.2f} -> {stats['p95_ms']:9.2f} ms ({change:+.0%})"
+                  f"{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    return regressions
+
+
+def main(args):
+    apps = APPS if args.app == 'both' else (args.app,)
+    fleets = [int(size) for size in args.fleet.split(',')]
+    processes = args.process.split(',')
+    for process in processes:
+        if process not in ARRIVAL_PROCESSES:
+            raise SystemExit(f"Unknown arrival process {process!r}; use one of {', '.join(ARRIVAL_PROCESSES)}")
+
+    settings = {
+        'calls': args.calls,
+        'rate_per_min': args.rate,
+        'service_min': args.service_min,
+        'sms_share': args.sms_share,
+        'active_calls_every': args.active_calls_every,
+        'routing_url': args.routing_url,
+        'seed': args.seed
+    }
+
+    runs = []
+    for app in apps:
+        for fleet in fleets:
+            for process in processes:
+                config = dict(settings, app=app, fleet=fleet, process=process)
+                fd, result_path = tempfile.mkstemp(suffix='.json')
+                os.close(fd)
+                try:
+                    # A process per run: simple_app is configured at import and
+                    # monkey-patches the interpreter with eventlet
+                    completed = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), '--run-one', json.dumps(config), '--result', result_path],
+                        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL
+                    )
+                    if completed.returncode == 0:
+                        with open(result_path) as f:
+                            run = json.load(f)
+                    else:
+                        run = {'app': app, 'fleet': fleet, 'process': process,
+                               'error': f'run exited with status {completed.returncode} (rerun with --verbose)'}
+                finally:
+                    os.unlink(result_path)
+
+                runs.append(run)
+                summary = ' '.join(
+                    f"{operation}={stats['p95_ms']:.2f}ms"
+                    for operation, stats in run.get('operations', {}).items()
+                ) or run.get('error')
+                print(f"{app:8} fleet={fleet:<6} {process:8} p95 {summary}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'dispatch',
+        'version': REPORT_VERSION,
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': settings,
+        'runs': runs
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', choices=APPS + ('both',), default='both')
+    parser.add_argument('--fleet', default='10,100,1000', help='Comma-separated fleet sizes')
+    parser.add_argument('--process', default='steady,poisson,mci',
+                        help=f"Comma-separated arrival processes ({', '.join(ARRIVAL_PROCESSES)})")
+    parser.add_argument('--calls', type=int, default=200, help='Calls per run')
+    parser.add_argument('--rate', type=float, default=2.0, help='Background calls per simulated minute')
+    parser.add_argument('--service-min', type=float, default=45, help='Simulated minutes a unit is busy per call')
+    parser.add_argument('--sms-share', type=float, default=0.2, help='Share of calls arriving through the SMS webhook')
+    parser.add_argument('--active-calls-every', type=int, default=5, help='Poll active calls after this many calls')
+    parser.add_argument('--routing-url', default='', help='OSRM-compatible router for route bundles (default: straight line)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare p95 latencies with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 increase over the baseline (0.2 = 20%%)')
+    parser.add_argument('--verbose', action='store_true', help='Show app logs of the runs')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        result = run_one(json.loads(args.run_one))
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+    else:
+        main(args)
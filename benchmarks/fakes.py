@@ -0,0 +1,184 @@
+"""
+Local stand-ins for the third-party services the backends call.
+One HTTP server answers like the three upstreams, so load tests never reach
+the real ones and are not throttled or billed by them:
+
+    POST /2010-04-01/Accounts/<sid>/Messages.json   Twilio's send-SMS API
+    GET  /reverse?lat=..&lon=..                     Nominatim reverse geocoding
+    GET  /route/v1/driving/<lon,lat;lon,lat>        OSRM driving route
+    GET  /stats                                     Request counts per service
+
+Each service can be given an artificial response delay to mimic the real
+round trip. Point the app at it with TWILIO_API_URL, NOMINATIM_URL and
+ROUTING_URL.
+
+Usage:
+    python benchmarks/fakes.py --port 5999 --routing-delay-ms 80
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.utils.distance import haversine_distance  # noqa: E402
+from backend.utils.route_bundle import encode_polyline  # noqa: E402
+
+ROAD_FACTOR = 1.3  # road distance over straight-line distance in a city
+ROAD_SPEED_KMH = 40
+ROUTE_POINTS = 40
+
+
+def fake_route(start, end):
+    """
+    An OSRM route response for a dog-leg between two points: along the
+    latitude of the start, then along the longitude of the end.
+    """
+    (lat1, lon1), (lat2, lon2) = start, end
+    half = ROUTE_POINTS // 2
+    points = ([(lat1, lon1 + (lon2 - lon1) * i / half) for i in range(half + 1)]
+              + [(lat1 + (lat2 - lat1) * i / half, lon2) for i in range(1, half + 1)])
+    distance_m = haversine_distance(lat1, lon1, lat2, lon2) * 1000 * ROAD_FACTOR
+    duration_s = distance_m / (ROAD_SPEED_KMH / 3.6)
+    return {
+        'code': 'Ok',
+        'routes': [{
+            'geometry': encode_polyline(points),
+            'distance': distance_m,
+            'duration': duration_s,
+            'legs': [{'steps': [
+                {'maneuver': {'type': 'depart', 'location': [lon1, lat1]}, 'name': 'Start Road',
+                 'distance': distance_m / 2, 'duration': duration_s / 2},
+                {'maneuver': {'type': 'turn', 'modifier': 'left', 'location': [lon2, lat1]}, 'name': 'Turn Street',
+                 'distance': distance_m / 2, 'duration': duration_s / 2},
+                {'maneuver': {'type': 'arrive', 'location': [lon2, lat2]}, 'name': '',
+                 'distance': 0, 'duration': 0}
+            ]}]
+        }]
+    }
+
+
+class FakeServices(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delays=None):
+        """
+        Args:
+            address: (host, port) to listen on
+            delays: Dict of seconds to wait before answering, keyed by
+                'twilio', 'nominatim' and 'routing'
+        """
+        super().__init__(address, FakeServicesHandler)
+        self.delays = delays or {}
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, service):
+        with self.lock:
+            self.counts[service] += 1
+        delay = self.delays.get(service)
+        if delay:
+            time.sleep(delay)
+
+
+class FakeServicesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/reverse':
+            self.server.count('nominatim')
+            try:
+                lat, lon = float(query['lat'][0]), float(query['lon'][0])
+            except (KeyError, ValueError):
+                return self.send_json(400, {'error': 'Unable to geocode'})
+            return self.send_json(200, {
+                'lat': str(lat),
+                'lon': str(lon),
+                'display_name': f'Synthetic Street, near {lat:.4f}, {lon:.4f}, Davanagere, Karnataka, India'
+            })
+
+        if url.path.startswith('/route/v1/driving/'):
+            self.server.count('routing')
+            try:
+                coords = url.path[len('/route/v1/driving/'):].split(';')
+                (lon1, lat1), (lon2, lat2) = [tuple(map(float, c.split(','))) for c in coords]
+            except ValueError:
+                return self.send_json(400, {'code': 'InvalidQuery', 'message': 'Query string malformed'})
+            return self.send_json(200, fake_route((lat1, lon1), (lat2, lon2)))
+
+        if url.path == '/stats':
+            with self.server.lock:
+                return self.send_json(200, dict(self.server.counts))
+
+        self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode()) if length else {}
+        parts = self.path.split('/')
+
+        # /2010-04-01/Accounts/<sid>/Messages.json
+        if len(parts) == 5 and parts[2] == 'Accounts' and parts[4] == 'Messages.json':
+            self.server.count('twilio')
+            return self.send_json(201, {
+                'sid': 'SM' + uuid.uuid4().hex,
+                'account_sid': parts[3],
+                'to': form.get('To', [''])[0],
+                'from': form.get('From', [''])[0],
+                'body': form.get('Body', [''])[0],
+                'status': 'queued',
+                'num_segments': '1',
+                'direction': 'outbound-api',
+                'api_version': '2010-04-01'
+            })
+
+        self.send_json(404, {'error': 'Not found'})
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, delays=None, host='127.0.0.1'):
+    server = FakeServices((host, port), delays)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5999)
+    parser.add_argument('--twilio-delay-ms', type=float, default=0)
+    parser.add_argument('--nominatim-delay-ms', type=float, default=0)
+    parser.add_argument('--routing-delay-ms', type=float, default=0)
+    args = parser.parse_args()
+    try:
+        serve(args.port, {
+            'twilio': args.twilio_delay_ms / 1000,
+            'nominatim': args.nominatim_delay_ms / 1000,
+            'routing': args.routing_delay_ms / 1000
+        }, host=args.host)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,537 @@
+"""
+End-to-end load generator with simulated callers, ambulances and dashboards.
+Thousands of virtual clients run as asyncio tasks in one process and drive a
+running server over real HTTP and Socket.IO:
+
+    ambulances  register, join their room and POST update-location every
+                --ping-interval seconds; on assignment_update they fetch the
+                assignment, mark arrival and complete the job
+    callers     arrive on a synthetic arrival process; each goes through
+                initiate-call, the share-location page, the connectivity ping
+                and a coarse then a fine /api/location/submit, and the
+                dispatcher assigns an ambulance if the server did not
+    dashboards  hold a dispatch socket and poll /api/changes
+
+Besides request latencies it measures event delivery lag: ambulance_update
+at a dashboard after the ping was sent, assignment_update at the ambulance
+after dispatch started, and location_update at a dashboard after the fix
+was submitted.
+
+With --start the server is launched on a fresh database together with
+benchmarks/fakes.py, which stands in for Twilio, Nominatim and OSRM; with
+--url point at a server you started yourself (configure TWILIO_API_URL,
+NOMINATIM_URL and ROUTING_URL to avoid hitting the real services).
+
+Usage:
+    python benchmarks/loadgen.py --start simple --ambulances 500 --dashboards 50 --rate 60 --duration 120
+    python benchmarks/loadgen.py --start backend --ambulances 200 --output loadgen.json
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 --ambulances 100
+
+Requires aiohttp and python-socketio[asyncio_client] (benchmarks/requirements.txt),
+and gunicorn for --start simple. Raise the open file limit (ulimit -n) for
+thousands of clients.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import aiohttp
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dispatch_bench import git_commit, summarize  # noqa: E402
+from multiworker_fanout import free_port, wait_for_port  # noqa: E402
+from synthetic import ARRIVAL_PROCESSES, generate_arrivals, generate_fleet, random_point  # noqa: E402
+
+REPORT_VERSION = 1
+METERS_PER_DEGREE = 111320
+
+# socketio.run with eventlet, monkey-patched first like gunicorn's eventlet
+# worker does
+BACKEND_SERVER = """
+import eventlet
+eventlet.monkey_patch()
+import sys
+from backend.app import create_app
+app, socketio = create_app()
+socketio.run(app, host='127.0.0.1', port=int(sys.argv[1]), log_output=False)
+"""
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self.statuses = defaultdict(Counter)
+        self.events = Counter()
+        self.first_errors = {}
+
+    def record(self, name, elapsed_ms, ok=True):
+        self.samples[name].append(elapsed_ms)
+        if not ok:
+            self.errors[name] += 1
+
+    def lag(self, name, sent_at):
+        if sent_at is not None:
+            self.samples[name].append((time.perf_counter() - sent_at) * 1000)
+
+    def fail(self, name, error):
+        self.errors[name] += 1
+        self.first_errors.setdefault(name, f'{type(error).__name__}: {error}')
+
+
+class LoadTest:
+    def __init__(self, url, args):
+        self.url = url.rstrip('/')
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder()
+        self.stopping = asyncio.Event()
+        self.run_tag = uuid.uuid4().hex[:4].upper()  # keeps ambulance ids unique across runs on one server
+
+        # Send times that the receiving side turns into delivery lag
+        self.positions_sent = {}
+        self.dispatch_started = {}
+        self.submit_started = {}
+
+        self.sockets = []
+        self.jobs = set()
+
+    async def request(self, operation, method, path, **kwargs):
+        """
+        Time one HTTP request; 5xx responses and exceptions count as errors.
+
+        Returns:
+            Tuple of (status, parsed JSON body or None), or (None, None) on failure
+        """
+        start = time.perf_counter()
+        try:
+            async with self.http.request(method, self.url + path, **kwargs) as response:
+                body = await response.read()
+                status = response.status
+        except Exception as e:
+            self.recorder.record(operation, (time.perf_counter() - start) * 1000, ok=False)
+            self.recorder.first_errors.setdefault(operation, f'{type(e).__name__}: {e}')
+            return None, None
+
+        self.recorder.record(operation, (time.perf_counter() - start) * 1000, status < 500)
+        self.recorder.statuses[operation][status] += 1
+        if response.content_type != 'application/json':
+            return status, None
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+    async def connect_socket(self, name):
+        """Open a websocket-only Socket.IO client, timing the handshake"""
+        sio = socketio.AsyncClient(reconnection=False, http_session=self.socket_http)
+        start = time.perf_counter()
+        try:
+            await sio.connect(self.url, transports=['websocket'], wait_timeout=10)
+        except Exception as e:
+            self.recorder.fail(f'{name}_connect', e)
+            return None
+        self.recorder.record(f'{name}_connect', (time.perf_counter() - start) * 1000)
+        self.sockets.append(sio)
+        return sio
+
+    async def sleep(self, seconds):
+        """Sleep, waking early when the run is stopping; returns True if it is"""
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # Ambulances
+
+    async def ambulance(self, unit, start_delay):
+        ambulance_id, driver_name, driver_phone, latitude, longitude = unit
+        if await self.sleep(start_delay):
+            return
+
+        status, body = await self.request('register', 'POST', '/api/ambulance/register', json={
+            'ambulance_id': ambulance_id,
+            'driver_name': driver_name,
+            'driver_phone': driver_phone,
+            'latitude': latitude,
+            'longitude': longitude
+        })
+        if not body or not body.get('success'):
+            return
+        ambulance_pk = body['ambulance']['id']
+
+        sio = await self.connect_socket('ambulance')
+        if sio:
+            @sio.on('assignment_update')
+            async def on_assignment(data):
+                self.recorder.events['assignment_update'] += 1
+                if data.get('ambulance_id') != ambulance_pk or data.get('completed') or data.get('reassigned'):
+                    return
+                call_id = data.get('emergency_call_id')
+                if (ambulance_pk, call_id) in self.jobs:
+                    return  # a reroute of the job in hand
+                self.jobs.add((ambulance_pk, call_id))
+                self.recorder.lag('lag_assignment_update', self.dispatch_started.get(call_id))
+                asyncio.ensure_future(self.run_job(ambulance_id, ambulance_pk, call_id))
+
+            try:
+                await sio.call('join_ambulance', {'ambulance_id': ambulance_id}, timeout=10)
+            except Exception as e:
+                self.recorder.fail('join_ambulance', e)
+
+        rng = random.Random(f'{self.args.seed}-{ambulance_id}')
+        if await self.sleep(rng.uniform(0, self.args.ping_interval)):
+            return
+        while True:
+            # Wander up to ping_step_m per ping
+            step = self.args.ping_step_m / METERS_PER_DEGREE
+            latitude = round(latitude + rng.uniform(-step, step), 6)
+            longitude = round(longitude + rng.uniform(-step, step), 6)
+            self.positions_sent[(ambulance_id, latitude, longitude)] = time.perf_counter()
+            await self.request('update_location', 'POST', '/api/ambulance/update-location', json={
+                'ambulance_id': ambulance_id,
+                'latitude': latitude,
+                'longitude': longitude
+            })
+            if await self.sleep(self.args.ping_interval * rng.uniform(0.9, 1.1)):
+                return
+
+    async def run_job(self, ambulance_id, ambulance_pk, call_id):
+        try:
+            await self.request('get_assignment', 'GET', f'/api/ambulance/get-assignment/{ambulance_id}')
+            if await self.sleep(self.args.service_s / 2):
+                return
+            await self.request('mark_arrived', 'POST', '/api/ambulance/mark-arrived', json={
+                'ambulance_id': ambulance_id,
+                'emergency_call_id': call_id
+            })
+            if await self.sleep(self.args.service_s / 2):
+                return
+            await self.request('mark_completed', 'POST', '/api/ambulance/mark-completed', json={
+                'emergency_call_id': call_id
+            })
+        finally:
+            self.jobs.discard((ambulance_pk, call_id))
+
+    # Callers
+
+    async def caller(self, index, arrival):
+        rng = random.Random(f'{self.args.seed}-caller-{index}')
+        status, body = await self.request('initiate_call', 'POST', '/api/callcenter/initiate-call', json={
+            'caller_phone': f'+91800{index:07d}',
+            'connectivity_status': 'online'
+        })
+        if not body or not body.get('success'):
+            return
+        call_id = body['emergency_call_id']
+        link_id = body['location_link_id']
+
+        # The caller opens the SMS link
+        await self.request('share_page', 'GET', f'/share-location/{link_id}')
+        await self.request('connection_ping', 'GET', '/api/connection/ping')
+
+        sio = await self.connect_socket('caller')
+        if sio:
+            try:
+                await sio.call('join_call', {'location_link_id': link_id}, timeout=10)
+            except Exception as e:
+                self.recorder.fail('join_call', e)
+
+        # Coarse network fix somewhere near the caller, then the GPS fix
+        coarse_accuracy = rng.uniform(300, 2000)
+        latitude, longitude = random_point(rng, (arrival.latitude, arrival.longitude), coarse_accuracy / 2000)
+        fixes = [
+            ('coarse', latitude, longitude, coarse_accuracy),
+            ('fine', arrival.latitude, arrival.longitude, rng.uniform(5, 25))
+        ]
+
+        for phase, latitude, longitude, accuracy in fixes:
+            if phase == 'fine' and await self.sleep(rng.uniform(*self.args.fine_delay_s)):
+                break
+            now = time.perf_counter()
+            self.submit_started[(call_id, phase)] = now
+            self.dispatch_started.setdefault(call_id, now)  # the backend dispatches on the first fix
+            status, body = await self.request(f'submit_{phase}', 'POST', '/api/location/submit', json={
+                'location_link_id': link_id,
+                'latitude': round(latitude, 6),
+                'longitude': round(longitude, 6),
+                'accuracy': round(accuracy, 1),
+                'phase': phase
+            })
+
+            # What the dispatcher does when the server did not assign a unit itself
+            if phase == 'coarse' and body and body.get('success') and not body.get('ambulance_assigned'):
+                self.dispatch_started[call_id] = time.perf_counter()
+                await self.request('dispatcher_assign', 'POST', f'/api/callcenter/assign-ambulance/{call_id}')
+
+        # Keep the page open a little while, as a caller watching for the ambulance would
+        await self.sleep(self.args.caller_linger_s)
+        if sio:
+            await sio.disconnect()
+
+    async def callers(self, arrivals):
+        started = time.perf_counter()
+        tasks = []
+        for index, arrival in enumerate(arrivals):
+            if await self.sleep(arrival.at_s - (time.perf_counter() - started)):
+                break
+            tasks.append(asyncio.ensure_future(self.caller(index, arrival)))
+        await asyncio.gather(*tasks)
+
+    # Dashboards
+
+    async def dashboard(self, index, start_delay):
+        if await self.sleep(start_delay):
+            return
+
+        sio = await self.connect_socket('dashboard')
+        if sio:
+            @sio.on('ambulance_update')
+            async def on_positions(data):
+                self.recorder.events['ambulance_update'] += 1
+                for position in data.get('positions', ()):
+                    key = (position.get('ambulance_id'), position.get('latitude'), position.get('longitude'))
+                    self.recorder.lag('lag_ambulance_update', self.positions_sent.get(key))
+                return True  # acks let the coalescer send the next frame
+
+            @sio.on('location_update')
+            async def on_location(data):
+                self.recorder.events['location_update'] += 1
+                self.recorder.lag('lag_location_update',
+                                  self.submit_started.get((data.get('emergency_call_id'), data.get('phase'))))
+
+            @sio.on('assignment_update')
+            async def on_assignment(data):
+                self.recorder.events['dashboard_assignment_update'] += 1
+
+            await sio.emit('join_dispatch')
+
+        seq = 0
+        if await self.sleep(random.Random(index).uniform(0, self.args.poll_interval)):
+            return
+        while True:
+            status, body = await self.request('changes', 'GET', '/api/changes', params={'since': seq})
+            if body and body.get('success'):
+                seq = body['seq']
+            if await self.sleep(self.args.poll_interval):
+                return
+
+    async def run(self):
+        args = self.args
+        connector = aiohttp.TCPConnector(limit=args.max_connections)
+        async with aiohttp.ClientSession(connector=connector) as self.http, \
+                aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as self.socket_http:
+            fleet = [
+                (f'LG{self.run_tag}-{i + 1:05d}', *unit[1:])
+                for i, unit in enumerate(generate_fleet(args.ambulances, seed=args.seed))
+            ]
+            count = max(1, int(args.rate * args.duration / 60))
+            arrivals = [
+                arrival for arrival in generate_arrivals(args.process, count, args.rate, seed=args.seed)
+                if arrival.at_s < args.duration
+            ]
+
+            started = time.perf_counter()
+            tasks = [asyncio.ensure_future(self.ambulance(unit, self.rng.uniform(0, args.ramp))) for unit in fleet]
+            tasks += [asyncio.ensure_future(self.dashboard(i, self.rng.uniform(0, args.ramp)))
+                      for i in range(args.dashboards)]
+            tasks.append(asyncio.ensure_future(self.sleep(args.ramp)))
+            await tasks[-1]  # fleet and dashboards are up before the first call
+            tasks.append(asyncio.ensure_future(self.callers(arrivals)))
+
+            await self.sleep(args.ramp + args.duration - (time.perf_counter() - started))
+            self.stopping.set()
+            await asyncio.wait(tasks, timeout=30)
+            elapsed = time.perf_counter() - started
+
+            for sio in self.sockets:
+                if sio.connected:
+                    await sio.disconnect()
+
+        return self.report(elapsed, len(arrivals))
+
+    def report(self, elapsed_s, calls):
+        def stats(name):
+            summary = summarize(self.recorder.samples[name], self.recorder.errors[name])
+            # Requests overlap, so throughput is completions over wall-clock time
+            summary['throughput_per_s'] = round(summary['count'] / elapsed_s, 1)
+            return summary
+
+        names = sorted(name for name, samples in self.recorder.samples.items() if samples)
+        return {
+            'elapsed_s': round(elapsed_s, 1),
+            'calls': calls,
+            'operations': {name: stats(name) for name in names if not name.startswith('lag_')},
+            'lags': {name[len('lag_'):]: stats(name) for name in names if name.startswith('lag_')},
+            'statuses': {name: dict(counts) for name, counts in self.recorder.statuses.items()},
+            'events': dict(self.recorder.events),
+            'first_errors': self.recorder.first_errors
+        }
+
+
+def start_servers(args, processes):
+    """Start the fake upstreams and the app on a fresh database; returns the app URL"""
+    fakes_port = free_port()
+    processes.append(subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'fakes.py'), '--port', str(fakes_port),
+         '--twilio-delay-ms', str(args.twilio_delay_ms),
+         '--nominatim-delay-ms', str(args.nominatim_delay_ms),
+         '--routing-delay-ms', str(args.routing_delay_ms)]
+    ))
+    wait_for_port(fakes_port)
+    fakes_url = f'http://127.0.0.1:{fakes_port}'
+
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    db_path = os.path.join(tempfile.mkdtemp(prefix='loadgen-'), 'loadgen.db')
+    env = dict(
+        os.environ,
+        DATABASE_PATH=db_path,
+        DATABASE_URI=f'sqlite:///{db_path}',
+        BASE_URL=url,
+        SMS_ENABLED='True',
+        TWILIO_API_URL=fakes_url,
+        NOMINATIM_URL=fakes_url,
+        ROUTING_URL=fakes_url,
+        CALL_ARCHIVE_INTERVAL_SECONDS='0',
+        PYTHONPATH=ROOT
+    )
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    output = None if args.verbose else subprocess.DEVNULL
+
+    if args.start == 'simple':
+        command = ['gunicorn', '--worker-class', 'eventlet', '-w', '1', '-b', f'127.0.0.1:{port}',
+                   '--log-level', 'warning', 'simple_app:app']
+    else:
+        command = [sys.executable, '-c', BACKEND_SERVER, str(port)]
+    processes.append(subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=output))
+    wait_for_port(port, timeout=60)
+    return url, fakes_url
+
+
+async def fake_stats(fakes_url):
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'{fakes_url}/stats') as response:
+                return await response.json()
+    except aiohttp.ClientError:
+        return None
+
+
+def raise_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(args):
+    if args.process not in ARRIVAL_PROCESSES:
+        raise SystemExit(f"Unknown arrival process {args.process!r}; use one of {', '.join(ARRIVAL_PROCESSES)}")
+    if not args.url and not args.start:
+        raise SystemExit("Give --url of a running server or --start simple|backend")
+    raise_file_limit()
+
+    processes = []
+    fakes_url = None
+    try:
+        url = args.url
+        if args.start:
+            url, fakes_url = start_servers(args, processes)
+
+        result = asyncio.run(LoadTest(url, args).run())
+        if fakes_url:
+            result['fakes'] = asyncio.run(fake_stats(fakes_url))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        'benchmark': 'loadgen',
+        'version': REPORT_VERSION,
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'target': args.start or args.url,
+        'settings': {
+            'ambulances': args.ambulances,
+            'dashboards': args.dashboards,
+            'process': args.process,
+            'rate_per_min': args.rate,
+            'duration_s': args.duration,
+            'ramp_s': args.ramp,
+            'ping_interval_s': args.ping_interval,
+            'poll_interval_s': args.poll_interval,
+            'service_s': args.service_s,
+            'seed': args.seed
+        },
+        **result
+    }
+
+    print(f"{report['target']}: {args.ambulances} ambulances, {args.dashboards} dashboards, "
+          f"{result['calls']} calls in {result['elapsed_s']}s", file=sys.stderr)
+    for section in ('operations', 'lags'):
+        for name, stats in result[section].items():
+            print(f"  {section[:-1]:9} {name:26} n={stats['count']:<7} err={stats['errors']:<5} "
+                  f"p50={stats['p50_ms']:9.2f} p95={stats['p95_ms']:9.2f} p99={stats['p99_ms']:9.2f} ms",
+                  file=sys.stderr)
+    for name, error in result['first_errors'].items():
+        print(f"  first error in {name}: {error}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='Base URL of a running server')
+    target.add_argument('--start', choices=('simple', 'backend'), help='Start this app with fake upstreams')
+    parser.add_argument('--ambulances', type=int, default=200)
+    parser.add_argument('--dashboards', type=int, default=20)
+    parser.add_argument('--process', default='poisson', help=f"Call arrival process ({', '.join(ARRIVAL_PROCESSES)})")
+    parser.add_argument('--rate', type=float, default=30, help='Background calls per minute')
+    parser.add_argument('--duration', type=float, default=120, help='Seconds of load after the ramp')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which ambulances and dashboards connect')
+    parser.add_argument('--ping-interval', type=float, default=10, help='Seconds between ambulance location pings')
+    parser.add_argument('--ping-step-m', type=float, default=100, help='Largest move between two pings')
+    parser.add_argument('--poll-interval', type=float, default=5, help='Seconds between dashboard change polls')
+    parser.add_argument('--service-s', type=float, default=60, help='Seconds an ambulance spends on a job')
+    parser.add_argument('--fine-delay-s', type=float, nargs=2, default=(2, 8), metavar=('MIN', 'MAX'),
+                        help='Range of seconds between the coarse and the fine fix')
+    parser.add_argument('--caller-linger-s', type=float, default=10, help='Seconds a caller keeps the page open')
+    parser.add_argument('--max-connections', type=int, default=500, help='Concurrent HTTP connections')
+    parser.add_argument('--twilio-delay-ms', type=float, default=150, help='Response delay of the fake Twilio')
+    parser.add_argument('--nominatim-delay-ms', type=float, default=300, help='Response delay of the fake Nominatim')
+    parser.add_argument('--routing-delay-ms', type=float, default=50, help='Response delay of the fake router')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='Show server logs')
+    main(parser.parse_args())
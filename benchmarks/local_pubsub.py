@@ -0,0 +1,117 @@
+"""
+Minimal Redis-compatible pub/sub server for local multi-worker testing.
+Speaks enough of the Redis protocol (HELLO, PING, SUBSCRIBE, UNSUBSCRIBE,
+PUBLISH, in RESP2 or RESP3) for Flask-SocketIO's Redis message queue, so
+several workers can be run on a laptop or CI box without installing Redis.
+Not for production.
+
+Usage:
+    python benchmarks/local_pubsub.py --port 6390
+    SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6390/0 gunicorn ...
+"""
+
+import argparse
+import asyncio
+
+
+class PubSubServer:
+    def __init__(self):
+        self.channels = {}
+        self.protocols = {}
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        self.protocols[writer] = 2
+        try:
+            while True:
+                command = await _read_command(reader)
+                if command is None:
+                    break
+                name = command[0].upper() if command else b''
+
+                if name == b'SUBSCRIBE':
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(self._push(writer, [b'subscribe', channel, len(subscribed)]))
+                elif name == b'UNSUBSCRIBE':
+                    for channel in command[1:] or list(subscribed):
+                        self.channels.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(self._push(writer, [b'unsubscribe', channel, len(subscribed)]))
+                elif name == b'PUBLISH':
+                    channel, message = command[1], command[2]
+                    receivers = list(self.channels.get(channel, ()))
+                    for receiver in receivers:
+                        receiver.write(self._push(receiver, [b'message', channel, message]))
+                    writer.write(b':%d\r\n' % len(receivers))
+                elif name == b'HELLO':
+                    protocol = int(command[1]) if len(command) > 1 else 2
+                    self.protocols[writer] = protocol
+                    info = [b'server', b'redis', b'version', b'7.0.0', b'proto', protocol,
+                            b'id', 1, b'mode', b'standalone', b'role', b'master']
+                    writer.write(_array(info, b'%' if protocol == 3 else b'*'))
+                elif name == b'PING':
+                    if subscribed and self.protocols[writer] == 2:
+                        writer.write(_array([b'pong', command[1] if len(command) > 1 else b'']))
+                    else:
+                        writer.write(b'+PONG\r\n')
+                else:
+                    # CLIENT SETINFO, SELECT and friends: accept and ignore
+                    writer.write(b'+OK\r\n')
+
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            self.protocols.pop(writer, None)
+            writer.close()
+
+    def _push(self, writer, items):
+        # RESP3 clients get pub/sub traffic as out-of-band push frames
+        return _array(items, b'>' if self.protocols.get(writer) == 3 else b'*')
+
+
+async def _read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        # Inline command, e.g. from redis-cli or telnet
+        return line.split()
+
+    parts = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        parts.append((await reader.readexactly(length + 2))[:-2])
+    return parts
+
+
+def _array(items, kind=b'*'):
+    # A map ('%') counts key/value pairs, everything else counts elements
+    count = len(items) // 2 if kind == b'%' else len(items)
+    out = [kind + b'%d\r\n' % count]
+    for item in items:
+        if isinstance(item, int):
+            out.append(b':%d\r\n' % item)
+        else:
+            out.append(b'$%d\r\n%s\r\n' % (len(item), item))
+    return b''.join(out)
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(PubSubServer().handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    print(f"Pub/sub stand-in listening on redis://{args.host}:{args.port}/0")
+    asyncio.run(serve(args.host, args.port))
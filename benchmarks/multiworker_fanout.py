@@ -0,0 +1,180 @@
+"""
+Multi-worker Socket.IO fan-out load test.
+Starts simple_app.py under gunicorn with several eventlet workers sharing a
+message queue, connects dashboards (which the kernel spreads over the
+workers) and one ambulance tablet, streams binary telemetry from the tablet
+and measures how many dashboards see each position and how long it takes.
+
+Run it once with --no-queue to see dashboards on other workers miss updates,
+then without it to see every dashboard reached.
+
+Usage:
+    python benchmarks/multiworker_fanout.py --workers 4 --dashboards 40 --pings 200
+    python benchmarks/multiworker_fanout.py --queue redis://localhost:6379/0
+
+Requires gunicorn, python-socketio[client] and redis (the Python client);
+without --queue a local Redis-protocol stand-in is started.
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.utils.telemetry import encode_frame  # noqa: E402
+
+AMBULANCE_ID = 'DVG-AMB-001'
+AMBULANCE_PK = 1
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+class Dashboard:
+    def __init__(self, url, index):
+        self.index = index
+        self.received = {}
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('ambulance_update', self.on_update)
+        self.client.connect(url, transports=['websocket'])
+        self.client.emit('join_dispatch')
+
+    def on_update(self, data):
+        now = time.perf_counter()
+        for position in data.get('positions', ()):
+            seq = round((position['latitude'] - 14.0) * 1e5)
+            self.received.setdefault(seq, now)
+        return True
+
+
+def run(args):
+    processes = []
+    queue = None if args.no_queue else args.queue
+
+    try:
+        if not args.no_queue and not queue:
+            broker_port = free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'benchmarks', 'local_pubsub.py'), '--port', str(broker_port)],
+                stdout=subprocess.DEVNULL
+            ))
+            wait_for_port(broker_port)
+            queue = f'redis://127.0.0.1:{broker_port}/0'
+
+        port = free_port()
+        env = dict(
+            os.environ,
+            DATABASE_PATH=os.path.join(tempfile.mkdtemp(), 'fanout.db'),
+            SOCKETIO_TRANSPORTS='websocket',
+            POSITION_BROADCAST_INTERVAL=str(args.tick),
+            PYTHONPATH=ROOT
+        )
+        env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+        if queue:
+            env['SOCKETIO_MESSAGE_QUEUE'] = queue
+            env['SOCKETIO_WORKERS'] = str(args.workers)
+        else:
+            # --no-queue shows what the app's startup check guards against
+            env.pop('SOCKETIO_WORKERS', None)
+
+        processes.append(subprocess.Popen(
+            ['gunicorn', '--worker-class', 'eventlet', '-w', str(args.workers),
+             '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'simple_app:app'],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if args.quiet else None
+        ))
+        wait_for_port(port)
+        time.sleep(1)  # let every worker finish booting
+        url = f'http://127.0.0.1:{port}'
+
+        dashboards = [Dashboard(url, i) for i in range(args.dashboards)]
+
+        tablet = socketio.Client(reconnection=False)
+        tablet.connect(url, transports=['websocket'])
+        joined = tablet.call('join_ambulance', {'ambulance_id': AMBULANCE_ID}, timeout=10)
+        if not joined or not joined.get('success'):
+            raise RuntimeError(f"Tablet could not join its room: {joined}")
+        time.sleep(0.5)
+
+        sent_at = {}
+        base_ms = int(time.time() * 1000) + 60_000  # newer than the seeded position
+        interval = 1.0 / args.rate
+        for seq in range(args.pings):
+            frame = encode_frame(AMBULANCE_PK, [{
+                'timestamp_ms': base_ms + seq * 1000,
+                'latitude': 14.0 + seq / 1e5,
+                'longitude': 75.9,
+                'speed': 10.0,
+                'heading': 90.0,
+                'seq': seq
+            }])
+            sent_at[seq] = time.perf_counter()
+            tablet.call('telemetry', frame, timeout=10)
+            time.sleep(interval)
+
+        time.sleep(args.tick * 3 + 1)  # drain the last ticks
+
+        last = args.pings - 1
+        reached_last = sum(1 for d in dashboards if last in d.received)
+        reached_any = sum(1 for d in dashboards if d.received)
+        latencies = [
+            (received - sent_at[seq]) * 1000
+            for d in dashboards for seq, received in d.received.items() if seq in sent_at
+        ]
+
+        print(f"workers={args.workers} dashboards={args.dashboards} pings={args.pings} "
+              f"queue={'off' if args.no_queue else queue}")
+        print(f"  dashboards that saw any update:     {reached_any}/{args.dashboards}")
+        print(f"  dashboards that saw the last ping:  {reached_last}/{args.dashboards}")
+        if latencies:
+            latencies.sort()
+            print(f"  positions delivered: {len(latencies)} "
+                  f"(coalesced at {1 / args.tick:.0f} Hz from {args.rate:.0f} pings/s)")
+            print(f"  latency ms: p50={statistics.median(latencies):.1f} "
+                  f"p95={latencies[int(len(latencies) * 0.95) - 1]:.1f} max={latencies[-1]:.1f}")
+
+        tablet.disconnect()
+        for d in dashboards:
+            d.client.disconnect()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dashboards', type=int, default=40)
+    parser.add_argument('--pings', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=50, help='Telemetry frames per second from the tablet')
+    parser.add_argument('--tick', type=float, default=0.2, help='Position broadcast interval in seconds')
+    parser.add_argument('--queue', help='Message queue URL; a local stand-in is started when omitted')
+    parser.add_argument('--no-queue', action='store_true', help='Run the workers without a message queue')
+    parser.add_argument('--quiet', action='store_true', help='Hide server logs')
+    run(parser.parse_args())
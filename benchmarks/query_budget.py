@@ -0,0 +1,221 @@
+"""
+Query budget check for the dashboard and call views.
+Seeds a fleet and a table of active calls, about half of them assigned, into
+a fresh database of the SQLAlchemy app (backend/app.py) and/or simple_app.py,
+requests each read endpoint once through Flask's test client and counts the
+SQL statements it runs. A view that loads related rows one query at a time
+(N+1) shows up as a count that grows with --calls; the check exits with
+status 1 if any endpoint runs more statements than its budget.
+
+Statements are counted with SQLite's trace callback on every connection the
+request uses, so raw DB-API queries (change feed, simple_app) count the same
+as ORM ones. Only SELECT/INSERT/UPDATE/DELETE are counted, not BEGIN/COMMIT,
+PRAGMA or the R*Tree module's own reads of its node tables.
+
+Usage:
+    python benchmarks/query_budget.py
+    python benchmarks/query_budget.py --app simple --calls 500 --verbose
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dispatch_bench import APPS, Fixtures  # noqa: E402
+from synthetic import generate_fleet, random_point  # noqa: E402
+
+COUNTED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+# The R*Tree module reads its shadow tables with statements of its own
+RTREE_INTERNAL = re.compile(r"'\w+'\.'\w+_(node|parent|rowid)'")
+
+# Endpoint name -> (URL template, statements allowed). {call_id} is an
+# assigned call and {ambulance_id} its unit.
+BUDGETS = {
+    'active_calls': ('/api/callcenter/active-calls', 1),
+    'active_calls_embed': ('/api/callcenter/active-calls?embed=ambulance', 1),
+    'calls_in_viewport': ('/api/callcenter/calls-in-viewport?min_lat=14.3&max_lat=14.6&min_lon=75.8&max_lon=76.1', 1),
+    'call_details': ('/api/callcenter/call/{call_id}', 1),
+    'ambulances_all': ('/api/ambulance/all', 1),
+    'ambulances_nearby': ('/api/ambulance/nearby?lat=14.4644&lon=75.9218&radius_km=5', 1),
+    'get_assignment': ('/api/ambulance/get-assignment/{ambulance_id}', 3),
+    'changes_snapshot': ('/api/changes?since=0', 4)
+}
+
+
+class QueryCounter:
+    """Collects the statements run while counting() is active"""
+
+    def __init__(self):
+        self.statements = None
+        self.recorded = []
+
+    def record(self, statement):
+        if self.statements is None or RTREE_INTERNAL.search(statement):
+            return
+        if statement.lstrip().split(None, 1)[0].upper() in COUNTED:
+            self.statements.append(statement)
+
+    def trace(self, connection):
+        """Report the statements of a sqlite3 connection to this counter"""
+        connection.set_trace_callback(self.record)
+
+    @contextmanager
+    def counting(self):
+        self.statements = []
+        try:
+            yield self
+        finally:
+            statements, self.statements = self.statements, None
+            self.recorded = statements
+
+
+def assert_queries(client, counter, url, budget):
+    """
+    Request a URL and check how many statements it ran.
+
+    Returns:
+        Tuple of (statement count, statements)
+
+    Raises:
+        AssertionError: If the request failed or ran more than budget statements
+    """
+    with counter.counting():
+        response = client.get(url)
+    if response.status_code != 200:
+        raise AssertionError(f'{url} answered {response.status_code}')
+    if len(counter.recorded) > budget:
+        raise AssertionError(f'{url} ran {len(counter.recorded)} statements, budget {budget}')
+    return len(counter.recorded), counter.recorded
+
+
+def seed(db_path, fleet, calls, seed_value):
+    """Load the fleet and active calls; returns (an assigned call id, its ambulance_id)"""
+    rng = random.Random(seed_value)
+    fixtures = Fixtures(db_path)
+    fixtures.load_fleet(generate_fleet(fleet, seed_value))
+    units = fixtures.conn.execute('SELECT id, ambulance_id FROM ambulances').fetchall()
+    rng.shuffle(units)
+
+    sample = None
+    for i in range(calls):
+        call_id, _ = fixtures.new_call(f'+9180{i:08d}')
+        latitude, longitude = random_point(rng)
+        if i % 2 == 0 and units:
+            unit_pk, unit_id = units.pop()
+            fixtures.conn.execute(
+                '''UPDATE emergency_calls SET status = 'assigned', latitude = ?, longitude = ?,
+                   assigned_ambulance_id = ?, assigned_time = call_time WHERE id = ?''',
+                [latitude, longitude, unit_pk, call_id]
+            )
+            fixtures.conn.execute('UPDATE ambulances SET is_available = 0 WHERE id = ?', [unit_pk])
+            sample = sample or (call_id, unit_id)
+        else:
+            fixtures.conn.execute(
+                "UPDATE emergency_calls SET status = 'location_shared', latitude = ?, longitude = ? WHERE id = ?",
+                [latitude, longitude, call_id]
+            )
+    fixtures.conn.commit()
+    if sample is None:
+        raise SystemExit('Nothing was assigned; use a fleet and --calls of at least 1')
+    return sample
+
+
+def backend_client(counter):
+    from sqlalchemy import event
+    from backend.app import create_app
+    from backend.models import db
+
+    app, _ = create_app()
+    with app.app_context():
+        event.listen(db.engine, 'checkout', lambda connection, record, proxy: counter.trace(connection))
+    return app.test_client()
+
+
+def simple_client(counter):
+    import simple_app  # creates the tables in DATABASE_PATH
+
+    # Registered before the first request, after simple_app's own hooks
+    @simple_app.app.before_request
+    def trace_queries():
+        counter.trace(simple_app.get_db())
+
+    return simple_app.app.test_client()
+
+
+def run_one(config):
+    """Check every endpoint of one app in this process"""
+    db_path = os.path.join(tempfile.mkdtemp(prefix='query-budget-'), 'budget.db')
+    os.environ.update({
+        'DATABASE_URI': f'sqlite:///{db_path}',
+        'DATABASE_PATH': db_path,
+        'SMS_ENABLED': 'False',
+        'NOMINATIM_URL': '',
+        'CALL_ARCHIVE_INTERVAL_SECONDS': '0',
+        'SOCKETIO_ASYNC_MODE': 'threading'
+    })
+
+    counter = QueryCounter()
+    client = (backend_client if config['app'] == 'backend' else simple_client)(counter)
+    call_id, ambulance_id = seed(db_path, config['fleet'], config['calls'], config['seed'])
+
+    results = {}
+    for name, (template, budget) in BUDGETS.items():
+        url = template.format(call_id=call_id, ambulance_id=ambulance_id)
+        try:
+            count, statements = assert_queries(client, counter, url, budget)
+            results[name] = {'queries': count, 'budget': budget, 'ok': True}
+        except AssertionError as e:
+            statements = counter.recorded or []
+            results[name] = {'queries': len(statements), 'budget': budget, 'ok': False, 'error': str(e)}
+        if config['verbose']:
+            results[name]['statements'] = statements
+    return {'app': config['app'], 'fleet': config['fleet'], 'calls': config['calls'], 'endpoints': results}
+
+
+def main(args):
+    apps = APPS if args.app == 'both' else (args.app,)
+    failed = False
+    for app in apps:
+        config = {'app': app, 'fleet': args.fleet, 'calls': args.calls, 'seed': args.seed, 'verbose': args.verbose}
+        # A process per app: simple_app is configured at import
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-one', json.dumps(config)],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True
+        )
+        if completed.returncode != 0:
+            print(f'{app:8} run exited with status {completed.returncode} (rerun with --verbose)', file=sys.stderr)
+            failed = True
+            continue
+
+        run = json.loads(completed.stdout.strip().splitlines()[-1])
+        for name, result in run['endpoints'].items():
+            failed = failed or not result['ok']
+            print(f"{app:8} {name:20} queries={result['queries']:<4} budget={result['budget']:<3}"
+                  f"{'' if result['ok'] else '  OVER BUDGET'}", file=sys.stderr)
+            for statement in result.get('statements', ()):
+                print(f'           {" ".join(statement.split())[:160]}', file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', choices=APPS + ('both',), default='both')
+    parser.add_argument('--fleet', type=int, default=200, help='Ambulances to load')
+    parser.add_argument('--calls', type=int, default=100, help='Active calls to load; every other one is assigned')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help='Show the statements of each endpoint and app output')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,205 @@
+"""
+Serialization microbenchmark for the dashboard list endpoints.
+Loads a synthetic fleet and a table of active calls into a fresh database of
+the SQLAlchemy app and times building the JSON body of active-calls and
+ambulance/all three ways:
+
+    to_dict_jsonify   the previous path: load model objects, to_dict() each,
+                      encode with jsonify
+    projection_json   read only the served columns as untracked rows
+                      (backend.services.read_service), zip them into dicts,
+                      encode with the standard library
+    projection_fast   the same, encoded by backend.utils.serialization
+                      (orjson when installed)
+
+plus projection_fast with a sparse fieldset (?fields=). Each path also gets
+one untimed run under tracemalloc, reported as peak_kib: the memory a request
+holds at once. The endpoints themselves are also timed end to end through
+Flask's test client. Bodies of the three paths are checked to decode to the
+same data.
+
+Usage:
+    python benchmarks/serialization_bench.py --rows 100,1000,10000
+    python benchmarks/serialization_bench.py --rows 5000 --repeat 50 --output serialization.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dispatch_bench import git_commit, summarize  # noqa: E402
+from synthetic import generate_fleet, random_point  # noqa: E402
+
+REPORT_VERSION = 2
+SPARSE_FIELDS = {
+    'calls': 'id,status,latitude,longitude,assigned_ambulance_id',
+    'ambulances': 'id,latitude,longitude,is_available'
+}
+OPEN_STATUSES = ('initiated', 'location_shared', 'assigned')
+
+
+def load_rows(db, Ambulance, EmergencyCall, rows, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(Ambulance, [
+        {'ambulance_id': ambulance_id, 'driver_name': name, 'driver_phone': phone,
+         'latitude': latitude, 'longitude': longitude, 'is_available': rng.random() < 0.7,
+         'last_updated': now - timedelta(seconds=rng.randint(0, 600))}
+        for ambulance_id, name, phone, latitude, longitude in generate_fleet(rows, seed)
+    ])
+    calls = []
+    for i in range(rows):
+        latitude, longitude = random_point(rng)
+        status = rng.choice(OPEN_STATUSES)
+        call_time = now - timedelta(seconds=rng.randint(0, 7200), microseconds=rng.randint(0, 999999))
+        calls.append({
+            'caller_phone': f'+9180{i:08d}', 'call_time': call_time, 'status': status,
+            'location_link_id': f'bench-{i}', 'connectivity_status': 'online', 'location_method': 'web',
+            'latitude': latitude, 'longitude': longitude, 'location_accuracy': rng.uniform(5, 80),
+            'address': f'{rng.randint(1, 400)} Synthetic Road, Davanagere, Karnataka, India',
+            'assigned_ambulance_id': rng.randint(1, rows) if status == 'assigned' else None,
+            'assigned_time': call_time + timedelta(minutes=2) if status == 'assigned' else None,
+            'location_shared_time': call_time + timedelta(minutes=1) if status != 'initiated' else None
+        })
+    db.session.bulk_insert_mappings(EmergencyCall, calls)
+    db.session.commit()
+
+
+def time_path(build, repeat):
+    samples = []
+    body = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = build()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples, 0), body
+
+
+def peak_memory(build):
+    """Peak traced allocation of one call of build, in KiB"""
+    tracemalloc.start()
+    try:
+        build()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run(rows, repeat, seed):
+    """Time every path on a fresh database with rows ambulances and rows active calls"""
+    from flask import jsonify
+    from backend.app import create_app
+    from backend.config import Config
+    from backend.models import db, Ambulance, EmergencyCall, CLOSED_CALL_STATUSES
+    from backend.utils import serialization
+    from backend.utils.serialization import dumps, parse_fields, rows_to_dicts
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='serialization-bench-'), 'bench.db')
+        SMS_ENABLED = False
+        CALL_ARCHIVE_INTERVAL_SECONDS = 0
+        METRICS_ENABLED = False
+        SOCKETIO_ASYNC_MODE = 'threading'
+
+    app, _ = create_app(BenchConfig)
+    client = app.test_client()
+    stdlib = json.JSONEncoder(separators=(',', ':'), default=serialization._default)
+
+    result = {'rows': rows, 'paths': {}, 'endpoints': {}}
+    with app.test_request_context():
+        load_rows(db, Ambulance, EmergencyCall, rows, seed)
+        reads = app.extensions['services'].reads
+
+        def active_calls():
+            return EmergencyCall.query.filter(
+                EmergencyCall.status.notin_(CLOSED_CALL_STATUSES)
+            ).order_by(EmergencyCall.call_time.desc())
+
+        tables = {
+            'calls': (EmergencyCall, active_calls, reads.active_calls),
+            'ambulances': (Ambulance, lambda: Ambulance.query, reads.ambulances)
+        }
+        for table, (model, query, read) in tables.items():
+            fields = model.SERIALIZED_FIELDS
+            sparse = parse_fields(SPARSE_FIELDS[table], fields)
+            paths = {
+                'to_dict_jsonify': lambda: jsonify(
+                    {'success': True, table: [item.to_dict() for item in query().all()]}).get_data(),
+                'projection_json': lambda: stdlib.encode(
+                    {'success': True, table: rows_to_dicts(fields, read(fields))}).encode(),
+                'projection_fast': lambda: dumps({'success': True, table: rows_to_dicts(fields, read(fields))}),
+                'projection_fast_sparse': lambda: dumps({'success': True, table: rows_to_dicts(sparse, read(sparse))})
+            }
+            bodies = {}
+            for name, build in paths.items():
+                stats, body = time_path(build, repeat)
+                stats['bytes'] = len(body)
+                db.session.remove()
+                stats['peak_kib'] = peak_memory(build)
+                result['paths'][f'{table}.{name}'] = stats
+                bodies[name] = json.loads(body)
+            if not bodies['to_dict_jsonify'] == bodies['projection_json'] == bodies['projection_fast']:
+                raise AssertionError(f'{table}: serialization paths disagree')
+            db.session.remove()
+
+    endpoints = {
+        'active_calls': '/api/callcenter/active-calls',
+        'active_calls_sparse': f"/api/callcenter/active-calls?fields={SPARSE_FIELDS['calls']}",
+        'ambulances_all': '/api/ambulance/all',
+        'ambulances_all_sparse': f"/api/ambulance/all?fields={SPARSE_FIELDS['ambulances']}"
+    }
+    for name, url in endpoints.items():
+        stats, response = time_path(lambda: client.get(url), repeat)
+        if response.status_code != 200:
+            raise AssertionError(f'{url} answered {response.status_code}')
+        stats['bytes'] = len(response.get_data())
+        result['endpoints'][name] = stats
+    return result
+
+
+def main(args):
+    from backend.utils.serialization import JSON_BACKEND
+
+    report = {
+        'version': REPORT_VERSION,
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'json_backend': JSON_BACKEND,
+        'repeat': args.repeat,
+        'runs': []
+    }
+    for rows in [int(value) for value in args.rows.split(',')]:
+        run_result = run(rows, args.repeat, args.seed)
+        report['runs'].append(run_result)
+        for group in ('paths', 'endpoints'):
+            for name, stats in run_result[group].items():
+                print(f"rows={rows:<6} {name:38} p50={stats['p50_ms']:9.3f} p95={stats['p95_ms']:9.3f} ms"
+                      f"  {stats['bytes']:>9} bytes"
+                      + (f"  peak={stats['peak_kib']:>9} KiB" if 'peak_kib' in stats else ''), file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', default='100,1000,10000', help='Comma-separated ambulance and active call counts')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed repetitions per path')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    main(parser.parse_args())
@@ -0,0 +1,122 @@
+"""
+Synthetic city fixtures for benchmarks.
+Builds fleets of ambulances scattered over a city and call arrival processes
+in simulated time: a steady stream, Poisson arrivals with periodic bursts, and
+mass-casualty incidents that drop a cluster of calls on one spot on top of the
+background load. Every generator takes a seed, so a run can be repeated
+exactly on another commit.
+"""
+
+import math
+import random
+from collections import namedtuple
+
+# Davanagere, where the seeded units of simple_init_db.py are
+CITY_CENTER = (14.4644, 75.9218)
+CITY_RADIUS_KM = 15
+
+Arrival = namedtuple('Arrival', 'at_s latitude longitude incident')
+
+
+def random_point(rng, center=CITY_CENTER, radius_km=CITY_RADIUS_KM):
+    """Uniformly random (latitude, longitude) inside a disc"""
+    distance_km = radius_km * math.sqrt(rng.random())
+    bearing = rng.uniform(0, 2 * math.pi)
+    latitude = center[0] + distance_km * math.cos(bearing) / 111.32
+    longitude = center[1] + distance_km * math.sin(bearing) / (111.32 * math.cos(math.radians(center[0])))
+    return latitude, longitude
+
+
+def generate_fleet(size, seed=0, center=CITY_CENTER, radius_km=CITY_RADIUS_KM):
+    """
+    Build a fleet of ambulances spread over the city.
+
+    Returns:
+        List of (ambulance_id, driver_name, driver_phone, latitude, longitude)
+        tuples, the row shape simple_init_db.py inserts
+    """
+    rng = random.Random(seed)
+    fleet = []
+    for i in range(size):
+        latitude, longitude = random_point(rng, center, radius_km)
+        fleet.append((f'SYN-AMB-{i + 1:05d}', f'Driver {i + 1}', f'+91900{i:07d}', latitude, longitude))
+    return fleet
+
+
+def steady_arrivals(count, rate_per_min, rng, center, radius_km):
+    """Calls at a fixed interval, anywhere in the city"""
+    interval_s = 60.0 / rate_per_min
+    return [Arrival(i * interval_s, *random_point(rng, center, radius_km), None) for i in range(count)]
+
+
+def poisson_bursts(count, rate_per_min, rng, center, radius_km,
+                   burst_factor=6, burst_every_min=60, burst_length_min=10):
+    """
+    Poisson arrivals whose rate jumps by burst_factor for burst_length_min at
+    the start of every burst_every_min (rush hour, festival crowds). Drawn by
+    thinning a Poisson process at the burst rate.
+    """
+    peak_per_s = rate_per_min * burst_factor / 60.0
+    arrivals = []
+    at_s = 0.0
+    while len(arrivals) < count:
+        at_s += rng.expovariate(peak_per_s)
+        in_burst = (at_s / 60.0) % burst_every_min < burst_length_min
+        if in_burst or rng.random() < 1.0 / burst_factor:
+            arrivals.append(Arrival(at_s, *random_point(rng, center, radius_km), None))
+    return arrivals
+
+
+def mass_casualty(count, rate_per_min, rng, center, radius_km,
+                  incidents=3, incident_share=0.4, cluster_radius_km=0.3, mean_gap_s=20):
+    """
+    Poisson background calls plus incidents: each one sends a share of the
+    calls from within cluster_radius_km of a single point, a few seconds apart.
+    """
+    per_incident = max(1, int(count * incident_share / incidents)) if incidents else 0
+    background = count - per_incident * incidents
+    span_s = max(background, 1) * 60.0 / rate_per_min
+
+    arrivals = []
+    at_s = 0.0
+    for _ in range(background):
+        at_s += rng.expovariate(rate_per_min / 60.0)
+        arrivals.append(Arrival(at_s, *random_point(rng, center, radius_km), None))
+
+    for incident in range(incidents):
+        site = random_point(rng, center, radius_km)
+        at_s = rng.uniform(0, span_s)
+        for _ in range(per_incident):
+            arrivals.append(Arrival(at_s, *random_point(rng, site, cluster_radius_km), incident))
+            at_s += rng.expovariate(1.0 / mean_gap_s)
+
+    arrivals.sort(key=lambda arrival: arrival.at_s)
+    return arrivals
+
+
+ARRIVAL_PROCESSES = {
+    'steady': steady_arrivals,
+    'poisson': poisson_bursts,
+    'mci': mass_casualty
+}
+
+
+def generate_arrivals(process, count, rate_per_min=2.0, seed=0, center=CITY_CENTER, radius_km=CITY_RADIUS_KM):
+    """
+    Build a call arrival sequence.
+
+    Args:
+        process: One of ARRIVAL_PROCESSES
+        count: Number of calls
+        rate_per_min: Average background call rate
+        seed: Random seed
+        center: City centre (latitude, longitude)
+        radius_km: City radius
+
+    Returns:
+        List of Arrival tuples ordered by at_s (seconds since the start)
+    """
+    if process not in ARRIVAL_PROCESSES:
+        raise ValueError(f"Unknown arrival process {process!r}; use one of {', '.join(ARRIVAL_PROCESSES)}")
+    rng = random.Random(seed)
+    return ARRIVAL_PROCESSES[process](count, rate_per_min, rng, center, radius_km)
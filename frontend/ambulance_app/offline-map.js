@@ -27,6 +27,29 @@ class OfflineMapManager {
         this.registerServiceWorker();
     }
     
+    // Overlay the district tile pack served by the backend, when one is configured.
+    // Its tiles are cached by the service worker, so the map keeps working offline.
+    async addRegionTileLayer(map) {
+        try {
+            const response = await fetch('/api/tiles/manifest');
+            const data = await response.json();
+            if (!data.success) return null;
+            
+            const manifest = data.manifest;
+            const [west, south, east, north] = manifest.bounds;
+            this.regionManifest = manifest;
+            return L.tileLayer(manifest.tile_url, {
+                minZoom: manifest.minzoom,
+                maxNativeZoom: manifest.maxzoom,
+                bounds: [[south, west], [north, east]],
+                attribution: manifest.attribution || ''
+            }).addTo(map);
+        } catch (error) {
+            console.warn('Region tile pack unavailable:', error);
+            return null;
+        }
+    }
+    
     // Register service worker for offline support
     registerServiceWorker() {
         if ('serviceWorker' in navigator) {
@@ -44,6 +67,10 @@ class OfflineMapManager {
                     console.log(`Sync completed: ${event.data.count} items synced`);
                     // You could show a notification here
                 }
+                if (event.data && event.data.type === 'tile-coverage') {
+                    console.log(`Route tiles available offline: ${event.data.cached}/${event.data.total}`);
+                    this.tileCoverage = event.data;
+                }
             });
         } else {
             console.warn('Service workers are not supported in this browser');
@@ -89,6 +116,23 @@ class OfflineMapManager {
         }
     }
     
+    // Ask the service worker to cache the map tiles along an assignment's route
+    // (zooms 13-17, or the route bundle's tile keys); it reports the resulting
+    // coverage to the dispatcher
+    prefetchRoute(path, ambulanceId, emergencyCallId, tileKeys) {
+        if (!('serviceWorker' in navigator) || !path || !path.length) return;
+        
+        navigator.serviceWorker.ready.then(registration => {
+            registration.active.postMessage({
+                type: 'prefetch-corridor',
+                path: path,
+                tiles: tileKeys || null, // "z/x/y" keys from the route bundle, if any
+                ambulance_id: ambulanceId,
+                emergency_call_id: emergencyCallId
+            });
+        });
+    }
+    
     // Cache the current map area
     cacheMapArea() {
         if (!this.map) return;
@@ -223,7 +267,7 @@ class OfflineMapManager {
     // Open the offline database
     openOfflineDB() {
         return new Promise((resolve, reject) => {
-            const request = indexedDB.open('ers-offline-db', 1);
+            const request = indexedDB.open('ers-offline-db', 2);
             
             request.onerror = event => {
                 reject('IndexedDB error');
@@ -250,6 +294,12 @@ class OfflineMapManager {
                 if (!db.objectStoreNames.contains('location-updates')) {
                     db.createObjectStore('location-updates', { keyPath: 'timestamp' });
                 }
+                
+                // Create store for map tile usage (LRU eviction in the service worker)
+                if (!db.objectStoreNames.contains('tile-usage')) {
+                    const tileUsage = db.createObjectStore('tile-usage', { keyPath: 'url' });
+                    tileUsage.createIndex('lastUsed', 'lastUsed');
+                }
             };
         });
     }
@@ -10,8 +10,60 @@ import sqlite3
 import uuid
 import json
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, g, abort, send_from_directory
-from flask_socketio import SocketIO
+from flask import Flask, Response, render_template, request, jsonify, g, abort, send_from_directory
+from flask_socketio import SocketIO, join_room, rooms
+from backend.utils.distance import haversine_distance
+from backend.utils.spatial_index import (
+    ensure_spatial_index,
+    bounding_box,
+    SEARCH_RADII_KM,
+    AMBULANCES_IN_BOX_SQL,
+    AVAILABLE_AMBULANCES_IN_BOX_SQL,
+    ACTIVE_CALLS_IN_BOX_SQL
+)
+from backend.utils.sqlite_pragmas import apply_sqlite_pragmas
+from backend.utils.change_feed import CALL, AMBULANCE, ensure_change_feed, read_changes
+from backend.utils.position_coalescer import PositionCoalescer
+from backend.utils.assignment_notifier import ASSIGNMENT_VERSIONS_SQL, assignment_notifier, publish_assignment_update
+from backend.utils.telemetry import TelemetryError, decode_frame, telemetry_watermarks, valid_points
+from backend.utils.location_batch import APPLIED, STALE, plan_batch
+from backend.utils.tiles import TileStore, TilePackError, parse_bbox, parse_coverage_report, tile_response
+from backend.utils.route_bundle import build_route_bundle
+from backend.utils.caller_location import INITIAL, MOVED, IGNORED, classify_fix, parse_location_fix
+from backend.utils.schema import ensure_columns
+from backend.utils.connectivity import VERY_LOW_BANDWIDTH, parse_connectivity_report, probe_payload
+from backend.utils.rooms import DISPATCHERS_ROOM, ambulance_room, call_room, rooms_for
+from backend.utils.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    DISPATCHES,
+    REDISPATCHES,
+    SOCKETIO_CLIENTS,
+    WAITLIST_WAIT,
+    InstrumentedConnection,
+    install_metrics,
+    registry as metrics_registry
+)
+from backend.utils.tracing import dispatch_trace, dispatch_traces, span
+from backend.utils.debug_access import debug_access_allowed
+from backend.utils.serialization import json_response, parse_fields, rows_to_dicts, rows_to_embedded_dicts
+from backend.utils.waitlist import (
+    WAITLIST_FIELDS,
+    WAITLIST_INDEX_SQL,
+    parse_severity,
+    queue_key,
+    rank_by_reach,
+    wait_seconds
+)
+from backend.utils.profiling import (
+    PROFILE_SORT_KEYS,
+    ProfilingError,
+    install_request_profiler,
+    memory_snapshots,
+    parse_sample_every,
+    parse_sampler_window,
+    request_profiler,
+    stack_sampler
+)
 
 # Get absolute path to the current directory
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -35,9 +87,35 @@ app = Flask(__name__,
             template_folder=FRONTEND_DIR)
 
 # Configuration
-DATABASE = os.path.join(BASE_DIR, 'emergency_response.db')
+DATABASE = os.environ.get('DATABASE_PATH', os.path.join(BASE_DIR, 'emergency_response.db'))
+# FULL syncs every commit; NORMAL is faster but an OS crash can lose the last commits
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'FULL')
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-for-testing')
 DEBUG = True
+SPATIAL_INDEX_ENABLED = False
+CHANGE_FEED_ENABLED = False
+CHANGE_FEED_RETENTION = int(os.environ.get('CHANGE_FEED_RETENTION', '10000'))
+CLOSED_CALL_STATUSES = ('completed', 'cancelled')
+ASSIGNMENT_WAIT_MAX_SECONDS = int(os.environ.get('ASSIGNMENT_WAIT_MAX_SECONDS', '25'))
+LOCATION_BATCH_MAX_ITEMS = int(os.environ.get('LOCATION_BATCH_MAX_ITEMS', '1000'))
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_MAX_KEY_LENGTH = 128
+TILE_PACK_PATH = os.environ.get('TILE_PACK_PATH')
+TILE_CACHE_MAX_AGE = int(os.environ.get('TILE_CACHE_MAX_AGE', '604800'))
+TILE_KEYS_MAX = int(os.environ.get('TILE_KEYS_MAX', '100000'))
+ROUTING_URL = os.environ.get('ROUTING_URL', '')  # your own OSRM-compatible router; empty ships the straight line
+ROUTING_TIMEOUT_SECONDS = float(os.environ.get('ROUTING_TIMEOUT_SECONDS', '3'))
+CONNECTIVITY_PROBE_MAX_BYTES = int(os.environ.get('CONNECTIVITY_PROBE_MAX_BYTES', '262144'))
+LOCATION_REDISPATCH_DISTANCE_M = float(os.environ.get('LOCATION_REDISPATCH_DISTANCE_M', '500'))
+POSITION_BROADCAST_INTERVAL = float(os.environ.get('POSITION_BROADCAST_INTERVAL', '1.0'))  # 0 emits every ping
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'  # Prometheus metrics at /metrics
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')  # X-Debug-Token for /api/debug; unset disables it
+DISPATCH_TRACE_BUFFER_SIZE = int(os.environ.get('DISPATCH_TRACE_BUFFER_SIZE', '500'))
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', '0'))  # cProfile one in N requests from startup
+STACK_SAMPLER_MAX_SECONDS = int(os.environ.get('STACK_SAMPLER_MAX_SECONDS', '300'))
+DISPATCH_WAITLIST_CANDIDATES = int(os.environ.get('DISPATCH_WAITLIST_CANDIDATES', '5'))  # queued calls a freed unit chooses from
+DISPATCH_WAITLIST_SEVERITY_STEP_SECONDS = int(os.environ.get('DISPATCH_WAITLIST_SEVERITY_STEP_SECONDS', '300'))
+ASSIGN_ATTEMPTS = 3  # nearest-unit searches when other dispatches keep taking it first
 
 app.config.from_mapping(
     SECRET_KEY=SECRET_KEY,
@@ -71,17 +149,63 @@ def init_db_tables():
                 call_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 status TEXT DEFAULT 'initiated',
                 location_link_id TEXT UNIQUE,
+                connectivity_status TEXT DEFAULT 'unknown',
                 latitude REAL,
                 longitude REAL,
+                location_accuracy REAL,
                 address TEXT,
                 assigned_ambulance_id INTEGER,
                 assigned_time TIMESTAMP,
+                severity INTEGER DEFAULT 2,
+                queued_time TIMESTAMP,
+                queue_key REAL,
                 location_shared_time TIMESTAMP,
                 pickup_time TIMESTAMP,
                 completion_time TIMESTAMP,
                 FOREIGN KEY (assigned_ambulance_id) REFERENCES ambulances (id)
             )
             ''')
+            ensure_columns(db, 'emergency_calls', {
+                'connectivity_status': "TEXT DEFAULT 'unknown'",
+                'location_accuracy': 'REAL',
+                'severity': 'INTEGER DEFAULT 2',
+                'queued_time': 'TIMESTAMP',
+                'queue_key': 'REAL'
+            })
+            # Calls waiting for a free unit, by wait time and severity
+            db.execute(WAITLIST_INDEX_SQL)
+            # Long-poll assignment versions, shared by every worker process
+            db.execute(ASSIGNMENT_VERSIONS_SQL)
+            
+            # Stored responses of batched writes, keyed by the client's Idempotency-Key
+            db.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                response TEXT NOT NULL,
+                created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (key, endpoint)
+            )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created_time ON idempotency_keys (created_time)')
+            
+            # Offline route bundles built at dispatch time; the latest per call is served
+            db.execute('''
+            CREATE TABLE IF NOT EXISTS route_bundles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                emergency_call_id INTEGER NOT NULL,
+                ambulance_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                distance_m INTEGER,
+                duration_s INTEGER,
+                data TEXT NOT NULL,
+                created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (emergency_call_id) REFERENCES emergency_calls (id),
+                FOREIGN KEY (ambulance_id) REFERENCES ambulances (id)
+            )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS ix_route_bundles_emergency_call_id ON route_bundles (emergency_call_id)')
             
             # Seed test data if empty
             cursor = db.execute("SELECT COUNT(*) FROM ambulances")
@@ -99,12 +223,68 @@ def init_db_tables():
                 print("Database seeded with test data.")
 
             db.commit()
+            
+            # R*Tree index over ambulance and call positions, maintained by triggers,
+            # and a change log giving dashboards a version to sync from
+            global SPATIAL_INDEX_ENABLED, CHANGE_FEED_ENABLED
+            SPATIAL_INDEX_ENABLED = ensure_spatial_index(db)
+            CHANGE_FEED_ENABLED = ensure_change_feed(db, CHANGE_FEED_RETENTION)
             print("Database tables initialized successfully.")
     except Exception as e:
         print(f"Error initializing database tables: {e}")
 
-# Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Initialize SocketIO. With SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0)
+# emits from any worker reach clients on all of them. SOCKETIO_WORKERS (the
+# Procfile's gunicorn -w) above 1 also needs SOCKETIO_TRANSPORTS=websocket, as
+# workers behind one port are not sticky.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_TRANSPORTS = [t.strip() for t in os.environ.get('SOCKETIO_TRANSPORTS', '').split(',') if t.strip()] or None
+SOCKETIO_WORKERS = int(os.environ.get('SOCKETIO_WORKERS', '1'))
+if SOCKETIO_WORKERS > 1 and not (SOCKETIO_MESSAGE_QUEUE and SOCKETIO_TRANSPORTS == ['websocket']):
+    raise RuntimeError("SOCKETIO_WORKERS > 1 needs SOCKETIO_MESSAGE_QUEUE and SOCKETIO_TRANSPORTS=websocket")
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    message_queue=SOCKETIO_MESSAGE_QUEUE,
+    transports=SOCKETIO_TRANSPORTS
+)
+
+# Ambulance positions reach dashboards in batched, rate-limited frames
+position_coalescer = None
+if POSITION_BROADCAST_INTERVAL > 0:
+    position_coalescer = PositionCoalescer(
+        socketio,
+        interval=POSITION_BROADCAST_INTERVAL,
+        max_in_flight=int(os.environ.get('POSITION_BROADCAST_MAX_IN_FLIGHT', '2')),
+        ack_timeout=float(os.environ.get('POSITION_BROADCAST_ACK_TIMEOUT', '10')),
+        # Dashboards may sit on other workers; broadcast through the queue
+        room=DISPATCHERS_ROOM if SOCKETIO_MESSAGE_QUEUE else None
+    )
+
+# Offline map tiles for the district, memory-mapped from an MBTiles file
+tile_store = None
+if TILE_PACK_PATH:
+    try:
+        tile_store = TileStore(TILE_PACK_PATH, mmap_size=int(os.environ.get('TILE_PACK_MMAP_SIZE', str(256 * 1024 * 1024))))
+    except TilePackError as e:
+        print(f"Region tiles disabled: {e}")
+
+# Request, database, dependency and Socket.IO metrics for /metrics
+if METRICS_ENABLED:
+    install_metrics(app, socketio, position_coalescer, waitlist=lambda: waitlist_stats())
+dispatch_traces.resize(DISPATCH_TRACE_BUFFER_SIZE)
+
+# Token-guarded debug endpoints under /api/debug: dispatch traces, request
+# profiles, stack samples and memory snapshots
+@app.before_request
+def require_debug_token():
+    # Hide the endpoints entirely from anyone without the token
+    if request.path.startswith('/api/debug/') and not debug_access_allowed(DEBUG_TOKEN, request.headers):
+        abort(404)
+
+if DEBUG_TOKEN:
+    request_profiler.configure(PROFILE_SAMPLE_EVERY)
+    install_request_profiler(app)
 
 print(f"Using database: {DATABASE}")
 print(f"Frontend directory: {FRONTEND_DIR}")
@@ -113,12 +293,35 @@ print(f"Frontend directory: {FRONTEND_DIR}")
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = g._database = sqlite3.connect(DATABASE, factory=InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection)
         db.row_factory = sqlite3.Row  # This enables column access by name
+        apply_sqlite_pragmas(db, synchronous=SQLITE_SYNCHRONOUS)  # WAL + busy timeout for multi-worker deployments
     return db
 
+def connect_db():
+    # A connection of its own, for work outside the request's transaction
+    conn = sqlite3.connect(DATABASE)
+    apply_sqlite_pragmas(conn, synchronous=SQLITE_SYNCHRONOUS)
+    return conn
+
 # Run initialization (must be after get_db is defined)
 init_db_tables()
+app.extensions['assignment_versions'] = connect_db
+# Several workers need a message queue; only then can another process change a version
+app.extensions['assignment_recheck'] = bool(SOCKETIO_MESSAGE_QUEUE)
+
+# Columns list endpoints return, in output order; ?fields= picks a subset
+CALL_FIELDS = (
+    'id', 'caller_phone', 'call_time', 'status', 'location_link_id', 'connectivity_status',
+    'latitude', 'longitude', 'location_accuracy', 'address', 'assigned_ambulance_id',
+    'assigned_time', 'severity', 'queued_time', 'location_shared_time', 'pickup_time', 'completion_time'
+)
+AMBULANCE_FIELDS = (
+    'id', 'ambulance_id', 'driver_name', 'driver_phone',
+    'latitude', 'longitude', 'is_available', 'last_updated'
+)
+# Unit summary embedded in call lists (?embed=ambulance)
+AMBULANCE_SUMMARY_FIELDS = ('id', 'ambulance_id', 'driver_name', 'driver_phone', 'latitude', 'longitude', 'last_updated')
 
 def query_db(query, args=(), one=False):
     try:
@@ -143,6 +346,248 @@ def insert_db(query, args=()):
         db.rollback()
         return None
 
+def get_ambulances_in_radius(latitude, longitude, radius_km, available_only=True):
+    """Get ambulances inside the bounding box of a radius around a point"""
+    box = bounding_box(latitude, longitude, radius_km)
+    
+    if SPATIAL_INDEX_ENABLED:
+        sql = AVAILABLE_AMBULANCES_IN_BOX_SQL if available_only else AMBULANCES_IN_BOX_SQL
+        return query_db(sql, box)
+    
+    sql = 'SELECT * FROM ambulances WHERE latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon'
+    if available_only:
+        sql += ' AND is_available = 1'
+    return query_db(sql, box)
+
+def find_nearest_available_ambulance(latitude, longitude):
+    """Find the nearest available ambulance, searching growing radii"""
+    def nearest_of(candidates):
+        best, best_distance = None, None
+        for ambulance in candidates:
+            distance = haversine_distance(latitude, longitude, ambulance['latitude'], ambulance['longitude'])
+            if best is None or distance < best_distance:
+                best, best_distance = ambulance, distance
+        return best, best_distance
+    
+    for radius_km in SEARCH_RADII_KM:
+        with span('fleet_query'):
+            candidates = get_ambulances_in_radius(latitude, longitude, radius_km)
+        with span('distance_scoring'):
+            nearest, distance = nearest_of(candidates)
+        # Anything outside the box is further than radius_km away
+        if nearest and distance <= radius_km:
+            return nearest, distance
+    
+    with span('fleet_query'):
+        candidates = query_db('SELECT * FROM ambulances WHERE is_available = 1')
+    with span('distance_scoring'):
+        return nearest_of(candidates)
+
+def save_route_bundle(call_id, ambulance, latitude, longitude):
+    # Build the offline route bundle from an ambulance to the call and stage
+    # it; the caller commits. Its ETA comes from the router, or 40 km/h along
+    # the straight line when no router answers.
+    bundle = build_route_bundle(
+        (ambulance['latitude'], ambulance['longitude']),
+        (latitude, longitude),
+        router_url=ROUTING_URL or None,
+        timeout=ROUTING_TIMEOUT_SECONDS
+    )
+    get_db().execute(
+        'INSERT INTO route_bundles (emergency_call_id, ambulance_id, source, distance_m, duration_s, data) VALUES (?, ?, ?, ?, ?, ?)',
+        [call_id, ambulance['id'], bundle['source'], bundle['distance_m'], bundle['duration_s'],
+         json.dumps(bundle, separators=(',', ':'))]
+    )
+    return bundle
+
+def redispatch_call(call):
+    # Re-run dispatch after the caller moved: hand the call to a closer
+    # available ambulance, or re-route the assigned one to the new position
+    with dispatch_trace('redispatch', call_id=call['id']) as trace:
+        target, reassigned = redispatch_traced(call)
+        trace.attributes['outcome'] = 'reassigned' if reassigned else 'rerouted'
+        return target, reassigned
+
+def redispatch_traced(call):
+    current = query_db('SELECT * FROM ambulances WHERE id = ?', [call['assigned_ambulance_id']], one=True)
+    nearest, distance_km = find_nearest_available_ambulance(call['latitude'], call['longitude'])
+    current_km = haversine_distance(call['latitude'], call['longitude'], current['latitude'], current['longitude'])
+    
+    db = get_db()
+    reassigned = nearest is not None and distance_km < current_km
+    target = nearest if reassigned else current
+    
+    # Route first, so the write lock is not held across the router round trip
+    with span('route_bundle'):
+        save_route_bundle(call['id'], target, call['latitude'], call['longitude'])
+    with span('commit'):
+        # The call moves only if it is still open with the current unit
+        if reassigned and not (db.execute(
+            'UPDATE emergency_calls SET assigned_ambulance_id = ?, assigned_time = CURRENT_TIMESTAMP '
+            f"WHERE id = ? AND assigned_ambulance_id = ? AND status NOT IN ({', '.join('?' * len(CLOSED_CALL_STATUSES))})",
+            [nearest['id'], call['id'], current['id'], *CLOSED_CALL_STATUSES]
+        ).rowcount and claim_ambulance(db, nearest['id'])):
+            # Another dispatch took the nearer unit or the call; the current one keeps it
+            db.rollback()
+            reassigned, target = False, current
+            save_route_bundle(call['id'], current, call['latitude'], call['longitude'])
+        if reassigned:
+            db.execute('UPDATE ambulances SET is_available = 1 WHERE id = ?', [current['id']])
+        db.commit()
+    REDISPATCHES.inc(outcome='reassigned' if reassigned else 'rerouted')
+    
+    # The released unit drops the call and the assigned one fetches its new route
+    with span('publish'):
+        publish_redispatch(call, current, target, reassigned)
+    
+    # The released unit goes to the waitlist
+    if reassigned:
+        dispatch_waitlist(current['id'])
+    return target, reassigned
+
+def publish_redispatch(call, current, target, reassigned):
+    if reassigned:
+        publish_assignment_update(call['id'], current['id'], socketio=socketio, reassigned=True)
+        publish_assignment_update(call['id'], target['id'], socketio=socketio)
+    else:
+        publish_assignment_update(call['id'], target['id'], socketio=socketio, rerouted=True)
+
+def get_route_bundle(call_id):
+    # Latest offline route bundle of a call, or None
+    record = query_db(
+        'SELECT data FROM route_bundles WHERE emergency_call_id = ? ORDER BY id DESC LIMIT 1',
+        [call_id],
+        one=True
+    )
+    return json.loads(record['data']) if record else None
+
+def claim_ambulance(db, ambulance_id):
+    # Mark a unit unavailable in the current transaction, unless another
+    # dispatch took it first; returns whether this one got it
+    return db.execute(
+        'UPDATE ambulances SET is_available = 0 WHERE id = ? AND is_available = 1',
+        [ambulance_id]
+    ).rowcount == 1
+
+def release_ambulance(db, call):
+    # Make the unit of a closing call available again, unless another open
+    # call holds it; returns the freed unit's id or None. The caller commits.
+    if not call['assigned_ambulance_id']:
+        return None
+    freed = db.execute(
+        f'''UPDATE ambulances SET is_available = 1 WHERE id = ? AND NOT EXISTS (
+               SELECT 1 FROM emergency_calls WHERE assigned_ambulance_id = ? AND id != ?
+               AND status NOT IN ({', '.join('?' * len(CLOSED_CALL_STATUSES))}))''',
+        [call['assigned_ambulance_id'], call['assigned_ambulance_id'], call['id'], *CLOSED_CALL_STATUSES]
+    ).rowcount
+    return call['assigned_ambulance_id'] if freed else None
+
+def assign_call(call, ambulance, distance_km, claim=False):
+    # Assign an available ambulance to a call, commit and notify. The unit is
+    # claimed in the same transaction, and the call only changes if it is
+    # still open with the unit it had when read (with claim, it must also
+    # still be on the waitlist); returns None if another worker took either.
+    # Route first, so the write lock is not held across the router round trip
+    with span('route_bundle'):
+        bundle = save_route_bundle(call['id'], ambulance, call['latitude'], call['longitude'])
+    eta_minutes = int(bundle['duration_s'] / 60)
+    
+    with span('commit'):
+        # Update emergency call with assigned ambulance; it leaves the waitlist
+        db = get_db()
+        sql = ('UPDATE emergency_calls SET assigned_ambulance_id = ?, assigned_time = CURRENT_TIMESTAMP, status = ?, '
+               'queued_time = NULL, queue_key = NULL WHERE id = ? AND assigned_ambulance_id IS ? '
+               f"AND status NOT IN ({', '.join('?' * len(CLOSED_CALL_STATUSES))})")
+        if claim:
+            sql += ' AND queue_key IS NOT NULL'
+        args = [ambulance['id'], 'assigned', call['id'], call['assigned_ambulance_id'], *CLOSED_CALL_STATUSES]
+        if not db.execute(sql, args).rowcount:
+            db.rollback()
+            return None
+        
+        # Mark ambulance as unavailable
+        if not claim_ambulance(db, ambulance['id']):
+            db.rollback()
+            return None
+        
+        db.commit()
+    if call['queued_time']:
+        WAITLIST_WAIT.observe(wait_seconds(call['queued_time']))
+    DISPATCHES.inc(outcome='assigned')
+    
+    # Push the dispatch to the ambulance app and dashboards
+    with span('publish'):
+        publish_assignment_update(call['id'], ambulance['id'], socketio=socketio)
+    
+    return {
+        "success": True,
+        "emergency_call_id": call['id'],
+        "ambulance_id": ambulance['ambulance_id'],
+        "driver_name": ambulance['driver_name'],
+        "distance_km": round(distance_km, 2),
+        "eta_minutes": eta_minutes,
+        "route_source": bundle['source']
+    }
+
+def enqueue_call(call):
+    # Put a call that found no free unit on the dispatch waitlist; one already
+    # on it keeps its place. Returns whether the call is queued.
+    if call['assigned_ambulance_id']:
+        return False
+    queued_time = datetime.utcnow()
+    db = get_db()
+    db.execute(
+        'UPDATE emergency_calls SET queued_time = ?, queue_key = ? WHERE id = ? AND queue_key IS NULL',
+        [queued_time.isoformat(sep=' '),
+         queue_key(queued_time, call['severity'], DISPATCH_WAITLIST_SEVERITY_STEP_SECONDS),
+         call['id']]
+    )
+    db.commit()
+    return True
+
+def dispatch_waitlist(ambulance_id):
+    # Offer a unit that just became free to the waitlist: it goes to the call
+    # it reaches fastest among the first DISPATCH_WAITLIST_CANDIDATES queued
+    ambulance = query_db('SELECT * FROM ambulances WHERE id = ?', [ambulance_id], one=True)
+    if not ambulance or not ambulance['is_available']:
+        return None
+    
+    with dispatch_trace('waitlist', ambulance_id=ambulance_id) as trace:
+        with span('queue_lookup'):
+            head = query_db(
+                f"SELECT {', '.join(WAITLIST_FIELDS)} FROM emergency_calls "
+                'WHERE queue_key IS NOT NULL ORDER BY queue_key LIMIT ?',
+                [DISPATCH_WAITLIST_CANDIDATES]
+            )
+        if not head:
+            trace.attributes['outcome'] = 'empty'
+            return None
+        
+        for distance_km, call_id in rank_by_reach(ambulance['latitude'], ambulance['longitude'], head):
+            # Another worker may be offering the same call a unit; only one
+            # of them claims it
+            call = query_db('SELECT * FROM emergency_calls WHERE id = ?', [call_id], one=True)
+            result = assign_call(call, ambulance, distance_km, claim=True) if call else None
+            if result:
+                trace.attributes['call_id'] = call_id
+                trace.attributes['outcome'] = 'assigned'
+                return result
+            # If another dispatch took the unit, every further candidate
+            # would fail after its router round trip
+            if not query_db('SELECT is_available FROM ambulances WHERE id = ?', [ambulance_id], one=True)[0]:
+                break
+        
+        trace.attributes['outcome'] = 'claimed_elsewhere'
+        return None
+
+def waitlist_stats():
+    # (queued calls, seconds the oldest has waited) for the metrics gauges
+    count, oldest = query_db(
+        'SELECT COUNT(*), MIN(queued_time) FROM emergency_calls WHERE queue_key IS NOT NULL',
+        one=True
+    )
+    return count, wait_seconds(oldest) if oldest else 0.0
+
 @app.teardown_appcontext
 def close_connection(exception):
     db = getattr(g, '_database', None)
@@ -154,6 +599,14 @@ def close_connection(exception):
 def frontend_files(filename):
     return send_from_directory(FRONTEND_DIR, filename)
 
+# Served from the root so its scope covers the whole app
+@app.route('/service-worker.js')
+def service_worker():
+    response = send_from_directory(os.path.join(BASE_DIR, 'backend', 'services'), 'service-worker.js',
+                                   mimetype='application/javascript', max_age=0)
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
 # Root route
 @app.route('/')
 def root():
@@ -202,13 +655,18 @@ def initiate_call():
     if not data or 'caller_phone' not in data:
         return jsonify({"success": False, "error": "Caller phone number is required"}), 400
     
+    try:
+        severity = parse_severity(data.get('severity'))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     # Generate location sharing link ID
     location_link_id = str(uuid.uuid4())
     
     # Create emergency call record
     call_id = insert_db(
-        'INSERT INTO emergency_calls (caller_phone, location_link_id, status) VALUES (?, ?, ?)',
-        [data['caller_phone'], location_link_id, 'initiated']
+        'INSERT INTO emergency_calls (caller_phone, location_link_id, status, connectivity_status, severity) VALUES (?, ?, ?, ?, ?)',
+        [data['caller_phone'], location_link_id, 'initiated', data.get('connectivity_status', 'unknown'), severity]
     )
     
     if call_id is None:
@@ -235,38 +693,87 @@ def initiate_call():
 
 @app.route('/api/callcenter/active-calls', methods=['GET'])
 def get_active_calls():
-    # Get all calls that are not completed
-    active_calls = query_db('SELECT * FROM emergency_calls WHERE status != ? ORDER BY call_time DESC', ['completed'])
+    try:
+        fields = parse_fields(request.args.get('fields'), CALL_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    embed = request.args.get('embed')
+    if embed not in (None, '', 'ambulance'):
+        return jsonify({"success": False, "error": f"Unknown embed: {embed}"}), 400
+    
+    if embed:
+        # The assigned unit comes from the same query, not one query per call
+        active_calls = query_db(
+            f"""SELECT {', '.join('c.' + name for name in fields)},
+                      {', '.join('a.' + name for name in AMBULANCE_SUMMARY_FIELDS)}
+               FROM emergency_calls c LEFT JOIN ambulances a ON a.id = c.assigned_ambulance_id
+               WHERE c.status NOT IN ({', '.join('?' * len(CLOSED_CALL_STATUSES))})
+               ORDER BY c.call_time DESC""",
+            CLOSED_CALL_STATUSES
+        )
+        return json_response({
+            "success": True,
+            "calls": rows_to_embedded_dicts(fields, 'assigned_ambulance', AMBULANCE_SUMMARY_FIELDS, active_calls)
+        })
+    
+    # Get all calls that are not closed; fields are whitelisted column names
+    active_calls = query_db(
+        f"SELECT {', '.join(fields)} FROM emergency_calls "
+        f"WHERE status NOT IN ({', '.join('?' * len(CLOSED_CALL_STATUSES))}) ORDER BY call_time DESC",
+        CLOSED_CALL_STATUSES
+    )
     
-    # Convert to list of dictionaries
-    calls = []
-    for call in active_calls:
-        calls.append(dict(call))
+    return json_response({
+        "success": True,
+        "calls": rows_to_dicts(fields, active_calls)
+    })
+
+@app.route('/api/callcenter/calls-in-viewport', methods=['GET'])
+def get_calls_in_viewport():
+    box = {
+        'min_lat': request.args.get('min_lat', type=float),
+        'max_lat': request.args.get('max_lat', type=float),
+        'min_lon': request.args.get('min_lon', type=float),
+        'max_lon': request.args.get('max_lon', type=float)
+    }
+    
+    if any(value is None for value in box.values()):
+        return jsonify({"success": False, "error": "min_lat, max_lat, min_lon and max_lon are required"}), 400
+    
+    if SPATIAL_INDEX_ENABLED:
+        calls = query_db(ACTIVE_CALLS_IN_BOX_SQL, box)
+    else:
+        calls = query_db(
+            """SELECT * FROM emergency_calls
+               WHERE status NOT IN ('completed', 'cancelled')
+                 AND latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lon AND :max_lon""",
+            box
+        )
     
     return jsonify({
         "success": True,
-        "calls": calls
+        "calls": [dict(call) for call in calls]
     })
 
 @app.route('/api/callcenter/call/<int:call_id>', methods=['GET'])
 def get_call_details(call_id):
-    call = query_db('SELECT * FROM emergency_calls WHERE id = ?', [call_id], one=True)
+    # The call and its assigned ambulance in one query; ambulance columns come last
+    row = query_db(
+        f"""SELECT c.*, {', '.join('a.' + name for name in AMBULANCE_FIELDS)}
+            FROM emergency_calls c LEFT JOIN ambulances a ON a.id = c.assigned_ambulance_id
+            WHERE c.id = ?""",
+        [call_id],
+        one=True
+    )
     
-    if not call:
+    if not row:
         return jsonify({"success": False, "error": "Call not found"}), 404
     
-    # Get assigned ambulance details if available
-    ambulance = None
-    if call['assigned_ambulance_id']:
-        ambulance = query_db(
-            'SELECT * FROM ambulances WHERE id = ?', 
-            [call['assigned_ambulance_id']], 
-            one=True
-        )
-    
-    call_dict = dict(call)
-    if ambulance:
-        call_dict['assigned_ambulance'] = dict(ambulance)
+    split = len(row) - len(AMBULANCE_FIELDS)
+    call_dict = rows_to_embedded_dicts(row.keys()[:split], 'assigned_ambulance', AMBULANCE_FIELDS, [row])[0]
+    if call_dict['assigned_ambulance'] is None:
+        del call_dict['assigned_ambulance']
     
     return jsonify({
         "success": True,
@@ -275,53 +782,41 @@ def get_call_details(call_id):
 
 @app.route('/api/callcenter/assign-ambulance/<int:call_id>', methods=['POST'])
 def assign_ambulance(call_id):
-    # Get emergency call
-    call = query_db('SELECT * FROM emergency_calls WHERE id = ?', [call_id], one=True)
-    
-    if not call or not call['latitude'] or not call['longitude']:
-        return jsonify({"success": False, "error": "Invalid emergency call or location not shared"}), 400
-    
-    # Get all available ambulances
-    available_ambulances = query_db('SELECT * FROM ambulances WHERE is_available = 1')
-    
-    if not available_ambulances:
-        return jsonify({"success": False, "error": "No ambulances available"}), 400
-    
-    # Find nearest ambulance (simplified)
-    nearest_ambulance = available_ambulances[0]  # Just use first one for this simplified version
-    
-    # Calculate rough distance and ETA
-    distance_km = 5.0  # Simplified
-    eta_minutes = 15   # Simplified
-    
-    # Update emergency call with assigned ambulance
-    db = get_db()
-    db.execute(
-        'UPDATE emergency_calls SET assigned_ambulance_id = ?, assigned_time = CURRENT_TIMESTAMP, status = ? WHERE id = ?',
-        [nearest_ambulance['id'], 'assigned', call_id]
-    )
-    
-    # Mark ambulance as unavailable
-    db.execute(
-        'UPDATE ambulances SET is_available = 0 WHERE id = ?',
-        [nearest_ambulance['id']]
-    )
-    
-    db.commit()
-    
-    # Emit socket event
-    socketio.emit('assignment_update', {
-        'emergency_call_id': call_id,
-        'ambulance_id': nearest_ambulance['id']
-    })
-    
-    return jsonify({
-        "success": True,
-        "ambulance_id": nearest_ambulance['ambulance_id'],
-        "driver_name": nearest_ambulance['driver_name'],
-        "distance_km": distance_km,
-        "eta_minutes": eta_minutes
-    })
+    # Stage timings go to the dispatch trace buffer (/api/debug/dispatches)
+    with dispatch_trace('assign', call_id=call_id) as trace:
+        # Get emergency call
+        with span('call_lookup'):
+            call = query_db('SELECT * FROM emergency_calls WHERE id = ?', [call_id], one=True)
+        
+        if not call or not call['latitude'] or not call['longitude']:
+            DISPATCHES.inc(outcome='invalid_call')
+            trace.attributes['outcome'] = 'invalid_call'
+            return jsonify({"success": False, "error": "Invalid emergency call or location not shared"}), 400
+        
+        for _ in range(ASSIGN_ATTEMPTS):
+            # Find the nearest available ambulance
+            nearest_ambulance, distance_km = find_nearest_available_ambulance(call['latitude'], call['longitude'])
+            if not nearest_ambulance:
+                break
+            
+            result = assign_call(call, nearest_ambulance, distance_km)
+            if result:
+                trace.attributes['outcome'] = 'assigned'
+                return jsonify(result)
+            
+            # Another dispatch took the unit or the call while this one was routing
+            latest = query_db('SELECT assigned_ambulance_id, status FROM emergency_calls WHERE id = ?',
+                              [call_id], one=True)
+            if latest['assigned_ambulance_id'] != call['assigned_ambulance_id'] or latest['status'] in CLOSED_CALL_STATUSES:
+                DISPATCHES.inc(outcome='call_taken')
+                trace.attributes['outcome'] = 'call_taken'
+                return jsonify({"success": False, "error": "Call was assigned or closed by another dispatch"}), 400
+        
+        DISPATCHES.inc(outcome='no_ambulance')
+        trace.attributes['outcome'] = 'no_ambulance'
+        # The next unit to become free is offered to the waitlist
+        queued = enqueue_call(call)
+        return jsonify({"success": False, "error": "No ambulances available", "queued": queued}), 400
 
 @app.route('/api/callcenter/complete-emergency/<int:call_id>', methods=['POST'])
 def complete_emergency(call_id):
@@ -331,39 +826,91 @@ def complete_emergency(call_id):
     if not call:
         return jsonify({"success": False, "error": "Emergency call not found"}), 404
     
+    # A repeated completion must not free a unit that has moved on
+    if call['status'] in CLOSED_CALL_STATUSES:
+        return jsonify({"success": True})
+    
     db = get_db()
     
-    # Update emergency call status
+    # Update emergency call status; a queued call leaves the waitlist
     db.execute(
-        'UPDATE emergency_calls SET status = ?, completion_time = CURRENT_TIMESTAMP WHERE id = ?',
+        'UPDATE emergency_calls SET status = ?, completion_time = CURRENT_TIMESTAMP, queued_time = NULL, queue_key = NULL WHERE id = ?',
         ['completed', call_id]
     )
     
     # Make ambulance available again if assigned
-    if call['assigned_ambulance_id']:
-        db.execute(
-            'UPDATE ambulances SET is_available = 1 WHERE id = ?',
-            [call['assigned_ambulance_id']]
-        )
+    freed = release_ambulance(db, call)
     
     db.commit()
     
     # Emit socket event
-    socketio.emit('assignment_update', {
-        'emergency_call_id': call_id,
-        'completed': True
-    })
+    publish_assignment_update(call_id, call['assigned_ambulance_id'], socketio=socketio, completed=True)
+    
+    # The freed unit goes to the waitlist
+    if freed:
+        dispatch_waitlist(freed)
     
     return jsonify({"success": True})
 
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    # Incremental dashboard sync: rows changed after `since`, or a full snapshot on reset
+    since = request.args.get('since', 0, type=int)
+    
+    if CHANGE_FEED_ENABLED:
+        changes = read_changes(get_db(), since)
+    else:
+        changes = {'seq': 0, 'reset': True}
+    
+    if changes['reset']:
+        calls = query_db('SELECT * FROM emergency_calls WHERE status NOT IN (?, ?) ORDER BY call_time DESC',
+                         CLOSED_CALL_STATUSES)
+        ambulances = query_db('SELECT * FROM ambulances')
+        removed_calls = []
+        removed_ambulances = []
+    else:
+        def fetch_by_ids(table, ids):
+            if not ids:
+                return []
+            placeholders = ','.join('?' * len(ids))
+            return query_db(f'SELECT * FROM {table} WHERE id IN ({placeholders})', list(ids))
+        
+        calls = []
+        removed_calls = list(changes['deleted'][CALL])
+        for call in fetch_by_ids('emergency_calls', changes['changed'][CALL]):
+            if call['status'] in CLOSED_CALL_STATUSES:
+                removed_calls.append(call['id'])
+            else:
+                calls.append(call)
+        
+        ambulances = fetch_by_ids('ambulances', changes['changed'][AMBULANCE])
+        removed_ambulances = list(changes['deleted'][AMBULANCE])
+    
+    return jsonify({
+        "success": True,
+        "seq": changes['seq'],
+        "reset": changes['reset'],
+        "calls": [dict(call) for call in calls],
+        "ambulances": [dict(ambulance) for ambulance in ambulances],
+        "removed_calls": removed_calls,
+        "removed_ambulances": removed_ambulances
+    })
+
 # 2. Location API
 @app.route('/api/location/submit', methods=['POST'])
 def submit_location():
+    # Coarse fix first, then more accurate ones; the call keeps the best fix
+    # and only re-runs dispatch if the caller turns out to be somewhere else
     data = request.get_json()
     
     if not data or 'location_link_id' not in data or 'latitude' not in data or 'longitude' not in data:
         return jsonify({"success": False, "error": "Missing required data"}), 400
     
+    try:
+        fix = parse_location_fix(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     # Find the emergency call
     call = query_db(
         'SELECT * FROM emergency_calls WHERE location_link_id = ?',
@@ -374,31 +921,106 @@ def submit_location():
     if not call:
         return jsonify({"success": False, "error": "Invalid location link"}), 404
     
+    outcome, moved_m = classify_fix(
+        call['latitude'], call['longitude'], call['location_accuracy'], fix, LOCATION_REDISPATCH_DISTANCE_M
+    )
+    if call['status'] in CLOSED_CALL_STATUSES:
+        outcome = IGNORED
+    
+    if outcome == IGNORED:
+        return jsonify({
+            "success": True,
+            "message": "A more accurate location is already known",
+            "outcome": outcome,
+            "accuracy": call['location_accuracy'],
+            "ambulance_assigned": call['assigned_ambulance_id'] is not None
+        })
+    
     # Simple address lookup (would use Nominatim in real app)
     address = "Near Davanagere, Karnataka, India"
     
     # Update the emergency call with location data
     db = get_db()
-    db.execute(
-        '''UPDATE emergency_calls 
-           SET latitude = ?, longitude = ?, address = ?, 
-               status = ?, location_shared_time = CURRENT_TIMESTAMP
-           WHERE location_link_id = ?''',
-        [data['latitude'], data['longitude'], address, 'location_shared', data['location_link_id']]
-    )
+    if outcome == INITIAL:
+        db.execute(
+            '''UPDATE emergency_calls 
+               SET latitude = ?, longitude = ?, location_accuracy = ?, address = ?, 
+                   status = ?, location_shared_time = CURRENT_TIMESTAMP
+               WHERE id = ?''',
+            [fix['latitude'], fix['longitude'], fix['accuracy'], address, 'location_shared', call['id']]
+        )
+    else:
+        db.execute(
+            'UPDATE emergency_calls SET latitude = ?, longitude = ?, location_accuracy = ?, address = ? WHERE id = ?',
+            [fix['latitude'], fix['longitude'], fix['accuracy'], address, call['id']]
+        )
     db.commit()
     
-    # Emit socket event
+    # Emit socket event; the assigned unit follows the refined position too
     socketio.emit('location_update', {
         'emergency_call_id': call['id'],
-        'latitude': data['latitude'],
-        'longitude': data['longitude']
-    })
+        'latitude': fix['latitude'],
+        'longitude': fix['longitude'],
+        'accuracy': fix['accuracy'],
+        'phase': fix['phase'],
+        'address': address
+    }, to=rooms_for(call_id=call['id'], ambulance_pk=call['assigned_ambulance_id']))
+    
+    if outcome == MOVED and call['assigned_ambulance_id'] and not call['pickup_time']:
+        print(f"Caller of call {call['id']} moved {moved_m:.0f} m, dispatching again")
+        redispatch_call(query_db('SELECT * FROM emergency_calls WHERE id = ?', [call['id']], one=True))
     
     return jsonify({
         "success": True,
         "message": "Location shared successfully",
-        "ambulance_assigned": False  # In a full implementation, you would auto-assign ambulance here
+        "outcome": outcome,
+        "accuracy": fix['accuracy'],
+        # Dispatchers assign from the dashboard once the first fix is in
+        "ambulance_assigned": call['assigned_ambulance_id'] is not None
+    })
+
+@app.route('/api/connection/ping', methods=['GET', 'HEAD'])
+def connection_ping():
+    # Latency check: an empty, uncacheable response with no database access
+    return Response(status=204, headers={'Cache-Control': 'no-store'})
+
+@app.route('/api/connection/probe', methods=['GET'])
+def connection_probe():
+    # Throughput check: `bytes` bytes of incompressible data for the client to time
+    payload = probe_payload(request.args.get('bytes', 16384, type=int), CONNECTIVITY_PROBE_MAX_BYTES)
+    return Response(payload, mimetype='application/octet-stream', headers={'Cache-Control': 'no-store'})
+
+@app.route('/api/connection/report', methods=['POST'])
+def connection_report():
+    # The share page's measurements become the call's connectivity_status
+    data = request.get_json()
+    
+    if not data or 'location_link_id' not in data:
+        return jsonify({"success": False, "error": "Missing required data"}), 400
+    
+    try:
+        measurement = parse_connectivity_report(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    call = query_db('SELECT * FROM emergency_calls WHERE location_link_id = ?', [data['location_link_id']], one=True)
+    if not call:
+        return jsonify({"success": False, "error": "Invalid location link"}), 404
+    
+    db = get_db()
+    db.execute('UPDATE emergency_calls SET connectivity_status = ? WHERE id = ?',
+               [measurement['connectivity_status'], call['id']])
+    db.commit()
+    
+    socketio.emit('connectivity_update', {'emergency_call_id': call['id'], **measurement},
+                  to=rooms_for(call_id=call['id']))
+    
+    # No SMS gateway here; the page shows its SMS instructions instead
+    return jsonify({
+        "success": True,
+        **measurement,
+        "use_sms": measurement['connectivity_status'] == VERY_LOW_BANDWIDTH and call['latitude'] is None,
+        "sms_protocol_initiated": False
     })
 
 # 3. Ambulance API
@@ -432,6 +1054,11 @@ def register_ambulance():
     if not data or not all(field in data for field in required_fields):
         return jsonify({"success": False, "error": "Missing required fields"}), 400
     
+    try:
+        position = parse_location_fix({'latitude': data['latitude'], 'longitude': data['longitude']})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     # Check if ambulance already exists
     existing = query_db(
         'SELECT * FROM ambulances WHERE ambulance_id = ?',
@@ -448,7 +1075,7 @@ def register_ambulance():
            (ambulance_id, driver_name, driver_phone, latitude, longitude, is_available) 
            VALUES (?, ?, ?, ?, ?, 1)''',
         [data['ambulance_id'], data['driver_name'], data['driver_phone'], 
-         data['latitude'], data['longitude']]
+         position['latitude'], position['longitude']]
     )
     
     if not ambulance_id:
@@ -463,19 +1090,52 @@ def register_ambulance():
     
     if not ambulance:
          return jsonify({"success": False, "error": "Registered but failed to retrieve details"}), 500
+    
+    # A new unit first serves the waitlist
+    dispatch = dispatch_waitlist(ambulance['id'])
+    if dispatch:
+        ambulance = query_db('SELECT * FROM ambulances WHERE id = ?', [ambulance['id']], one=True)
 
     return jsonify({
         "success": True,
-        "ambulance": dict(ambulance)
+        "ambulance": dict(ambulance),
+        "assigned_call_id": dispatch["emergency_call_id"] if dispatch else None
     })
 
 @app.route('/api/ambulance/all', methods=['GET'])
 def get_all_ambulances():
-    ambulances = query_db('SELECT * FROM ambulances')
+    try:
+        fields = parse_fields(request.args.get('fields'), AMBULANCE_FIELDS)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    ambulances = query_db(f"SELECT {', '.join(fields)} FROM ambulances")
+    
+    return json_response({
+        "success": True,
+        "ambulances": rows_to_dicts(fields, ambulances)
+    })
+
+@app.route('/api/ambulance/nearby', methods=['GET'])
+def get_nearby_ambulances():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', 5.0, type=float)
+    available_only = request.args.get('available_only', 'true').lower() != 'false'
+    
+    if latitude is None or longitude is None or not 0 < radius_km <= 500:
+        return jsonify({"success": False, "error": "lat, lon and a valid radius_km are required"}), 400
+    
+    nearby = []
+    for ambulance in get_ambulances_in_radius(latitude, longitude, radius_km, available_only):
+        distance = haversine_distance(latitude, longitude, ambulance['latitude'], ambulance['longitude'])
+        if distance <= radius_km:
+            nearby.append(dict(ambulance, distance_km=round(distance, 3)))
+    nearby.sort(key=lambda ambulance: ambulance['distance_km'])
     
     return jsonify({
         "success": True,
-        "ambulances": [dict(ambulance) for ambulance in ambulances]
+        "ambulances": nearby
     })
 
 @app.route('/api/ambulance/get-assignment/<ambulance_id>', methods=['GET'])
@@ -506,9 +1166,44 @@ def get_assignment(ambulance_id):
     return jsonify({
         "success": True,
         "has_assignment": True,
-        "emergency_call": dict(emergency_call)
+        "emergency_call": dict(emergency_call),
+        "route_bundle": get_route_bundle(emergency_call['id'])
     })
 
+@app.route('/api/ambulance/wait-assignment/<ambulance_id>', methods=['GET'])
+def wait_assignment(ambulance_id):
+    # Long-poll fallback: hold the request until the assignment changes from `since` or timeout
+    ambulance = query_db(
+        'SELECT * FROM ambulances WHERE ambulance_id = ?',
+        [ambulance_id], 
+        one=True
+    )
+    
+    if not ambulance:
+        return jsonify({"success": False, "error": "Invalid ambulance ID"}), 404
+    
+    since = request.args.get('since', type=int)
+    timeout = min(request.args.get('timeout', ASSIGNMENT_WAIT_MAX_SECONDS, type=float), ASSIGNMENT_WAIT_MAX_SECONDS)
+    
+    if since is None:
+        version, changed = assignment_notifier.version(ambulance['id']), True
+    else:
+        version, changed = assignment_notifier.wait(ambulance['id'], since, max(0, timeout))
+    
+    response = {"success": True, "version": version, "changed": changed}
+    if changed:
+        emergency_call = query_db(
+            'SELECT * FROM emergency_calls WHERE assigned_ambulance_id = ? AND status = ?',
+            [ambulance['id'], 'assigned'],
+            one=True
+        )
+        response["has_assignment"] = emergency_call is not None
+        if emergency_call:
+            response["emergency_call"] = dict(emergency_call)
+            response["route_bundle"] = get_route_bundle(emergency_call['id'])
+    
+    return jsonify(response)
+
 @app.route('/api/ambulance/mark-arrived', methods=['POST'])
 def mark_arrived():
     data = request.get_json()
@@ -553,28 +1248,29 @@ def mark_completed():
     if not call:
         return jsonify({"success": False, "error": "Emergency call not found"}), 404
     
+    # A repeated completion must not free a unit that has moved on
+    if call['status'] in CLOSED_CALL_STATUSES:
+        return jsonify({"success": True})
+    
     db = get_db()
     
-    # Update emergency call
+    # Update emergency call; a queued call leaves the waitlist
     db.execute(
-        'UPDATE emergency_calls SET status = ?, completion_time = CURRENT_TIMESTAMP WHERE id = ?',
+        'UPDATE emergency_calls SET status = ?, completion_time = CURRENT_TIMESTAMP, queued_time = NULL, queue_key = NULL WHERE id = ?',
         ['completed', data['emergency_call_id']]
     )
     
     # Update ambulance availability
-    if call['assigned_ambulance_id']:
-        db.execute(
-            'UPDATE ambulances SET is_available = 1 WHERE id = ?',
-            [call['assigned_ambulance_id']]
-        )
+    freed = release_ambulance(db, call)
     
     db.commit()
     
     # Emit socket event
-    socketio.emit('assignment_update', {
-        'emergency_call_id': call['id'],
-        'completed': True
-    })
+    publish_assignment_update(call['id'], call['assigned_ambulance_id'], socketio=socketio, completed=True)
+    
+    # The freed unit goes to the waitlist
+    if freed:
+        dispatch_waitlist(freed)
     
     return jsonify({"success": True})
 
@@ -603,27 +1299,410 @@ def update_location():
     )
     db.commit()
     
+    # Queue the position for the next batched dashboard frame
+    if position_coalescer:
+        position_coalescer.submit({
+            'ambulance_id': data['ambulance_id'],
+            'latitude': data['latitude'],
+            'longitude': data['longitude']
+        })
+    
+    return jsonify({"success": True})
+
+@app.route('/api/ambulance/update-locations', methods=['POST'])
+def update_locations():
+    # Batched updates from fleet gateways and offline replay, applied in one
+    # transaction; a repeated Idempotency-Key returns the stored response
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    
+    if not isinstance(items, list):
+        return jsonify({"success": False, "error": "Expected a list of location updates"}), 400
+    
+    if len(items) > LOCATION_BATCH_MAX_ITEMS:
+        return jsonify({"success": False, "error": f"At most {LOCATION_BATCH_MAX_ITEMS} updates per request"}), 413
+    
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_MAX_KEY_LENGTH:
+        return jsonify({"success": False, "error": "Invalid Idempotency-Key"}), 400
+    
+    def stored_response():
+        record = query_db(
+            'SELECT status_code, response FROM idempotency_keys WHERE key = ? AND endpoint = ?',
+            [key, 'update-locations'],
+            one=True
+        )
+        if record:
+            return jsonify(json.loads(record['response'])), record['status_code'], {'Idempotent-Replay': 'true'}
+        return None
+    
+    if key:
+        replay = stored_response()
+        if replay:
+            return replay
+    
+    ids = {str(item['ambulance_id']) for item in items if isinstance(item, dict) and item.get('ambulance_id')}
+    last_updated = {}
+    if ids:
+        rows = query_db(
+            'SELECT ambulance_id, last_updated FROM ambulances WHERE ambulance_id IN (%s)' % ','.join('?' * len(ids)),
+            list(ids)
+        )
+        for row in rows:
+            last_updated[row['ambulance_id']] = datetime.fromisoformat(row['last_updated']) if row['last_updated'] else None
+    
+    results, _, latest = plan_batch(items, last_updated)
+    body = {
+        "success": True,
+        "applied": sum(1 for result in results if result['status'] == APPLIED),
+        "stale": sum(1 for result in results if result['status'] == STALE),
+        "rejected": sum(1 for result in results if result['status'] not in (APPLIED, STALE)),
+        "results": results
+    }
+    
+    db = get_db()
+    try:
+        db.executemany(
+            'UPDATE ambulances SET latitude = ?, longitude = ?, last_updated = ? WHERE ambulance_id = ?',
+            [
+                (item['latitude'], item['longitude'], item['timestamp'].strftime('%Y-%m-%d %H:%M:%S.%f'), ambulance_id)
+                for ambulance_id, item in latest.items()
+            ]
+        )
+        if key:
+            db.execute(
+                'INSERT INTO idempotency_keys (key, endpoint, status_code, response) VALUES (?, ?, ?, ?)',
+                [key, 'update-locations', 200, json.dumps(body)]
+            )
+            db.execute(
+                "DELETE FROM idempotency_keys WHERE created_time < datetime('now', ?)",
+                ['-%d hours' % IDEMPOTENCY_KEY_TTL_HOURS]
+            )
+        db.commit()
+    except sqlite3.IntegrityError:
+        # The same key was committed by a concurrent retry; answer with its result
+        db.rollback()
+        replay = stored_response()
+        if not replay:
+            raise
+        return replay
+    
+    if position_coalescer:
+        for ambulance_id, item in latest.items():
+            position_coalescer.submit({
+                'ambulance_id': ambulance_id,
+                'latitude': item['latitude'],
+                'longitude': item['longitude']
+            })
+    
+    return jsonify(body)
+
+@app.route('/api/ambulance/tile-coverage', methods=['POST'])
+def report_tile_coverage():
+    # How much of the assignment's route corridor the tablet has cached; relayed to dispatchers
+    data = request.get_json(silent=True) or {}
+    
+    ambulance = query_db('SELECT * FROM ambulances WHERE ambulance_id = ?', [data.get('ambulance_id')], one=True)
+    if not ambulance:
+        return jsonify({"success": False, "error": "Invalid ambulance ID"}), 404
+    
+    try:
+        report = parse_coverage_report(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    report.update({
+        'ambulance_id': ambulance['id'],
+        'ambulance_code': ambulance['ambulance_id'],
+        'emergency_call_id': data.get('emergency_call_id'),
+        'reported_at': datetime.utcnow().isoformat()
+    })
+    socketio.emit('tile_coverage', report, to=DISPATCHERS_ROOM)
+    
+    return jsonify({"success": True, "coverage": report['coverage']})
+
+@app.route('/api/ambulance/broadcast-stats', methods=['GET'])
+def broadcast_stats():
+    # Position broadcast counters (received, coalesced, dropped, sent)
+    if not position_coalescer:
+        return jsonify({"success": False, "error": "Position coalescing is disabled"}), 404
+    
+    return jsonify({"success": True, "stats": position_coalescer.stats()})
+
+# Region tile pack for offline maps
+@app.route('/api/tiles/<int:z>/<int:x>/<int:y>.<ext>', methods=['GET'])
+def get_tile(z, x, y, ext):
+    if not tile_store:
+        return jsonify({"success": False, "error": "No tile pack configured"}), 404
+    
+    return tile_response(tile_store, z, x, y, TILE_CACHE_MAX_AGE)
+
+@app.route('/api/tiles/manifest', methods=['GET'])
+def get_tile_manifest():
+    if not tile_store:
+        return jsonify({"success": False, "error": "No tile pack configured"}), 404
+    
+    return jsonify({
+        "success": True,
+        "manifest": tile_store.manifest(f'/api/tiles/{{z}}/{{x}}/{{y}}.{tile_store.format}')
+    })
+
+@app.route('/api/tiles/keys', methods=['GET'])
+def get_tile_keys():
+    # "z/x/y" keys inside bbox (west,south,east,north) and a zoom range, for bulk prefetch
+    if not tile_store:
+        return jsonify({"success": False, "error": "No tile pack configured"}), 404
+    
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    keys, truncated = tile_store.tile_keys(
+        bbox,
+        request.args.get('minzoom', type=int),
+        request.args.get('maxzoom', type=int),
+        limit=TILE_KEYS_MAX
+    )
+    
+    return jsonify({
+        "success": True,
+        "version": tile_store.version,
+        "count": len(keys),
+        "truncated": truncated,
+        "keys": keys
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus scrape endpoint with this worker's metrics
+    if not METRICS_ENABLED:
+        abort(404)
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/debug/dispatches', methods=['GET'])
+def get_dispatch_traces():
+    # Recent dispatches with their stage timings
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    order = request.args.get('order', 'slowest')
+    
+    if order not in ('slowest', 'recent'):
+        return jsonify({"success": False, "error": "order must be slowest or recent"}), 400
+    
+    traces = dispatch_traces.slowest(limit) if order == 'slowest' else dispatch_traces.recent(limit)
+    
+    return jsonify({
+        "success": True,
+        "buffered": len(dispatch_traces),
+        "dispatches": traces
+    })
+
+@app.route('/api/debug/profile/requests', methods=['GET'])
+def get_request_profile():
+    # Merged cProfile stats of sampled requests
+    limit = min(request.args.get('limit', 30, type=int), 500)
+    sort = request.args.get('sort', 'cumulative')
+    
+    if sort not in PROFILE_SORT_KEYS:
+        return jsonify({"success": False, "error": "sort must be cumulative, tottime or calls"}), 400
+    
+    return jsonify({"success": True, **request_profiler.stats(limit, sort)})
+
+@app.route('/api/debug/profile/requests', methods=['POST'])
+def configure_request_profile():
+    # Profile one in sample_every requests (0 stops); clears the stats
+    try:
+        sample_every = parse_sample_every(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    request_profiler.configure(sample_every)
+    return jsonify({"success": True, "sample_every": sample_every})
+
+@app.route('/api/debug/profile/sampler', methods=['GET'])
+def get_stack_samples():
+    # Stack samples of the current or last window
+    limit = min(request.args.get('limit', 30, type=int), 500)
+    return jsonify({"success": True, **stack_sampler.results(limit)})
+
+@app.route('/api/debug/profile/sampler', methods=['POST'])
+def start_stack_sampler():
+    # Sample every thread's stack for duration_s seconds
+    try:
+        duration, interval = parse_sampler_window(request.get_json(silent=True) or {}, STACK_SAMPLER_MAX_SECONDS)
+        stack_sampler.start(duration, interval)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ProfilingError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    
+    return jsonify({"success": True, **stack_sampler.results(0)}), 202
+
+@app.route('/api/debug/profile/sampler/stop', methods=['POST'])
+def stop_stack_sampler():
+    # End the sampling window early and return its samples
+    stack_sampler.stop()
+    limit = min(request.args.get('limit', 30, type=int), 500)
+    return jsonify({"success": True, **stack_sampler.results(limit)})
+
+@app.route('/api/debug/memory/snapshots', methods=['GET'])
+def list_memory_snapshots():
+    return jsonify({"success": True, "snapshots": memory_snapshots.list()})
+
+@app.route('/api/debug/memory/snapshots', methods=['POST'])
+def take_memory_snapshot():
+    # Snapshot allocations and object counts; the first one starts tracemalloc
+    frames = (request.get_json(silent=True) or {}).get('frames', 1)
+    
+    if not isinstance(frames, int) or not 1 <= frames <= 25:
+        return jsonify({"success": False, "error": "frames must be between 1 and 25"}), 400
+    
+    snapshot_id = memory_snapshots.take(frames)
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    return jsonify({"success": True, **memory_snapshots.summary(snapshot_id, limit)})
+
+@app.route('/api/debug/memory/snapshots/<int:snapshot_id>', methods=['GET'])
+def get_memory_snapshot(snapshot_id):
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    group_by = request.args.get('group_by', 'lineno')
+    
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({"success": False, "error": "group_by must be lineno, filename or traceback"}), 400
+    
+    try:
+        return jsonify({"success": True, **memory_snapshots.summary(snapshot_id, limit, group_by)})
+    except ProfilingError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+
+@app.route('/api/debug/memory/diff', methods=['GET'])
+def diff_memory_snapshots():
+    # What grew between two snapshots (?from=&to=)
+    from_id = request.args.get('from', type=int)
+    to_id = request.args.get('to', type=int)
+    limit = min(request.args.get('limit', 20, type=int), 500)
+    group_by = request.args.get('group_by', 'lineno')
+    
+    if from_id is None or to_id is None:
+        return jsonify({"success": False, "error": "from and to snapshot ids are required"}), 400
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({"success": False, "error": "group_by must be lineno, filename or traceback"}), 400
+    
+    try:
+        return jsonify({"success": True, **memory_snapshots.diff(from_id, to_id, limit, group_by)})
+    except ProfilingError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+
+@app.route('/api/debug/memory/snapshots/clear', methods=['POST'])
+def clear_memory_snapshots():
+    # Drop every snapshot and stop tracemalloc
+    memory_snapshots.clear()
     return jsonify({"success": True})
 
 # Socket.IO event handlers
 @socketio.on('connect')
 def handle_connect():
     print('Client connected to Socket.IO')
+    SOCKETIO_CLIENTS.inc()
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected from Socket.IO')
+    SOCKETIO_CLIENTS.dec()
+    if position_coalescer:
+        position_coalescer.unsubscribe(request.sid)
+
+# Clients join rooms so events only reach the dashboards, tablet and caller involved
+@socketio.on('join_dispatch')
+def handle_join_dispatch(data=None):
+    join_room(DISPATCHERS_ROOM)
+    if position_coalescer:
+        position_coalescer.subscribe(request.sid)
+        position_coalescer.start()
+
+@socketio.on('join_ambulance')
+def handle_join_ambulance(data):
+    ambulance = query_db('SELECT id FROM ambulances WHERE ambulance_id = ?',
+                         [(data or {}).get('ambulance_id')], one=True)
+    if not ambulance:
+        return {"success": False, "error": "Invalid ambulance ID"}
+    join_room(ambulance_room(ambulance['id']))
+    return {"success": True}
+
+@socketio.on('join_call')
+def handle_join_call(data):
+    # The share link id is the caller's credential; the numeric call id is guessable
+    call = query_db('SELECT id FROM emergency_calls WHERE location_link_id = ?',
+                    [(data or {}).get('location_link_id')], one=True)
+    if not call:
+        return {"success": False, "error": "Invalid location link"}
+    join_room(call_room(call['id']))
+    return {"success": True}
 
 @socketio.on('location_shared')
 def handle_location_shared(data):
-    # Broadcast to call center dashboard
-    socketio.emit('location_update', data)
+    # Relay to call center dashboards and the caller's own page
+    socketio.emit('location_update', data, to=rooms_for(call_id=data.get('emergency_call_id')))
     print(f"Location shared: {data}")
 
 @socketio.on('ambulance_location_update')
 def handle_ambulance_update(data):
-    # Broadcast ambulance location updates to call center
-    socketio.emit('ambulance_update', data)
+    # Only dispatchers track the fleet; other tablets don't need each other's pings
+    if position_coalescer:
+        position_coalescer.submit(data)
+    else:
+        socketio.emit('ambulance_update', {'positions': [data]}, to=DISPATCHERS_ROOM)
+
+@socketio.on('telemetry')
+def handle_telemetry(frame):
+    # Binary GPS frames from tablets; acked so the tablet can drop its buffer
+    try:
+        ambulance_pk, points = decode_frame(frame)
+    except (TelemetryError, TypeError, OverflowError) as e:
+        return {"success": False, "error": str(e)}
+    
+    # Only the tablet that joined this ambulance's room may report for it
+    if ambulance_room(ambulance_pk) not in rooms():
+        return {"success": False, "error": "Join the ambulance room first"}
+    
+    last_seq = points[-1]['seq'] if points else None
+    valid = valid_points(points)
+    rejected = len(points) - len(valid)
+    points = telemetry_watermarks.filter(ambulance_pk, valid)
+    if points:
+        latest = points[-1]
+        # Same format as the batch endpoint, so points within one second still order
+        latest_time = datetime.utcfromtimestamp(latest['timestamp_ms'] / 1000).strftime('%Y-%m-%d %H:%M:%S.%f')
+        
+        # Buffered points from a connectivity gap must not rewind the current position
+        db = get_db()
+        try:
+            db.execute(
+                '''UPDATE ambulances SET latitude = ?, longitude = ?, last_updated = ?
+                   WHERE id = ? AND (last_updated IS NULL OR last_updated < ?)''',
+                [latest['latitude'], latest['longitude'], latest_time, ambulance_pk, latest_time]
+            )
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            print(f"Error storing telemetry for ambulance {ambulance_pk}: {e}")
+            return {"success": False, "error": "Could not store telemetry"}
+        telemetry_watermarks.commit(ambulance_pk, points)
+        
+        ambulance = query_db('SELECT * FROM ambulances WHERE id = ?', [ambulance_pk], one=True)
+        if ambulance:
+            position = {
+                'ambulance_id': ambulance['ambulance_id'],
+                'latitude': ambulance['latitude'],
+                'longitude': ambulance['longitude'],
+                'speed': latest['speed'],
+                'heading': latest['heading']
+            }
+            if position_coalescer:
+                position_coalescer.submit(position)
+            else:
+                socketio.emit('ambulance_update', {'positions': [position]}, to=DISPATCHERS_ROOM)
+    
+    return {"success": True, "accepted": len(points), "rejected": rejected, "last_seq": last_seq}
 
 # Main entry point
 if __name__ == '__main__':